@@ -0,0 +1,104 @@
+import time
+
+import numpy as np
+from videolib import Video
+
+from funque_plus.features.baseline_atoms import feature_graph
+from funque_plus.features.funque_atoms import pyr_features, conv_utils
+from funque_plus.feature_extractors import VmafFeatureExtractor
+from funque_plus.utils import get_standard
+
+import argparse
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Code to validate the fixed-point VIF, motion and Haar-domain MS-SSIM implementations against the float path on a video pair')
+    parser.add_argument('--ref_video', help='Path to reference video', type=str)
+    parser.add_argument('--dis_video', help='Path to distorted video', type=str)
+    parser.add_argument('--ref_standard', help='Standard to which the reference video conforms', type=str, default='sRGB')
+    parser.add_argument('--dis_standard', help='Standard to which the distorted video conforms', type=str, default='sRGB')
+    parser.add_argument('--width', help='Width of input video. Required for raw YUV videos.', type=int, default=None)
+    parser.add_argument('--height', help='Height of input video. Required for raw YUV videos.', type=int, default=None)
+    parser.add_argument('--max_frames', help='Maximum number of frames to compare. (Optional)', type=int, default=None)
+    parser.add_argument('--tol', help='Maximum absolute error allowed for each feature', type=float, default=2e-3)
+    return parser
+
+
+def _haar_feats(y_ref, y_dis, max_val, fixed):
+    # 5-level Haar-domain MS-SSIM, as used by MsSsimFastFeatureExtractor
+    h_crop = (y_ref.shape[0] >> 5) << 5
+    w_crop = (y_ref.shape[1] >> 5) << 5
+    y_ref = y_ref[:h_crop, :w_crop]
+    y_dis = y_dis[:h_crop, :w_crop]
+    if fixed:
+        pyr_ref, pyr_dis = [pyr_features.haar_wavedec2_int(np.rint(y), 5) for y in (y_ref, y_dis)]
+        pools = pyr_features.ms_ssim_pyr_int(pyr_ref, pyr_dis, max_val, pool='all')
+    else:
+        pyr_ref, pyr_dis = [pyr_features.custom_wavedec2(y / max_val, 'haar', 'periodization', 5) for y in (y_ref, y_dis)]
+        pools = pyr_features.ms_ssim_pyr(pyr_ref, pyr_dis, max_val=1, pool='all')
+    feats = {}
+    for pool, (ms_ssim_scales, _) in zip(('mean', 'cov', 'mink'), pools):
+        feats[f'haar_ms_ssim_{pool}'] = ms_ssim_scales[-1]
+    return feats
+
+
+def main():
+    args = get_parser().parse_args()
+    ref_standard = get_standard(args.ref_standard)
+    dis_standard = get_standard(args.dis_standard)
+    if ref_standard.range != dis_standard.range:
+        raise ValueError('Fixed-point arithmetic requires reference and distorted videos of the same range')
+
+    fex = VmafFeatureExtractor(use_cache=False)
+    graph_outputs = [f'vif_y_scale_{scale}' for scale in range(fex.scales)] + ['motion_y', 'vif_u_scale_0']
+    arithmetics = ['float', 'fixed']
+    plans = {
+        arithmetic: feature_graph.vmaf_family_graph(fex.vif_filters, fex.wavelet, fex.scales, fex.flow_method, arithmetic).plan(graph_outputs)
+        for arithmetic in arithmetics
+    }
+    vals = {arithmetic: [] for arithmetic in arithmetics}
+    times = {arithmetic: 0 for arithmetic in arithmetics}
+
+    with Video(
+        args.ref_video, mode='r',
+        standard=ref_standard,
+        width=args.width, height=args.height
+    ) as v_ref:
+        with Video(
+            args.dis_video, mode='r',
+            standard=dis_standard,
+            width=args.width, height=args.height
+        ) as v_dis:
+            for frame_ind, (frame_ref, frame_dis) in enumerate(zip(v_ref, v_dis)):
+                if args.max_frames is not None and frame_ind >= args.max_frames:
+                    break
+                sources = {'yuv_ref': frame_ref.yuv, 'yuv_dis': frame_dis.yuv}
+                for arithmetic in arithmetics:
+                    start = time.time()
+                    frame_vals = plans[arithmetic].run_frame(sources)
+                    frame_vals.update(_haar_feats(frame_ref.yuv[..., 0], frame_dis.yuv[..., 0], ref_standard.range, arithmetic == 'fixed'))
+                    times[arithmetic] += time.time() - start
+                    vals[arithmetic].append(frame_vals)
+
+    feat_names = list(vals['float'][0])
+    print(f'Compared {len(vals["float"])} frames')
+    for filt in fex.vif_filters:
+        print(f'{len(filt)}-tap filter: coefficient quantization error bound {conv_utils.quantization_error_bound(filt, conv_utils.quantize_kernel(filt)):.3e} x peak')
+    print()
+    print(f'{"Feature":<26} {"Max abs err":>12} {"Mean abs err":>12} {"Max rel err":>12} {"Status":>8}')
+    all_passed = True
+    for name in feat_names:
+        float_vals = np.array([frame_vals[name] for frame_vals in vals['float']], dtype='float64')
+        fixed_vals = np.array([frame_vals[name] for frame_vals in vals['fixed']], dtype='float64')
+        abs_err = np.abs(fixed_vals - float_vals)
+        rel_err = abs_err / np.maximum(np.abs(float_vals), 1e-10)
+        passed = abs_err.max() <= args.tol
+        all_passed &= passed
+        print(f'{name:<26} {abs_err.max():>12.3e} {abs_err.mean():>12.3e} {rel_err.max():>12.3e} {"ok" if passed else "FAIL":>8}')
+    print()
+    for arithmetic in arithmetics:
+        print(f'{arithmetic}: {times[arithmetic]:.2f} s')
+    print(f'All features within tolerance {args.tol:.1e}: {"yes" if all_passed else "no"}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+import time
+
+import numpy as np
+from scipy import stats
+from videolib import Video
+
+from funque_plus.features.baseline_atoms import feature_graph
+from funque_plus.feature_extractors import EnhVmafFeatureExtractor
+from funque_plus.utils import get_standard
+
+import argparse
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Code to compare E-DLM values obtained using the fast and skimage flow methods on a video pair')
+    parser.add_argument('--ref_video', help='Path to reference video', type=str)
+    parser.add_argument('--dis_video', help='Path to distorted video', type=str)
+    parser.add_argument('--ref_standard', help='Standard to which the reference video conforms', type=str, default='sRGB')
+    parser.add_argument('--dis_standard', help='Standard to which the distorted video conforms', type=str, default='sRGB')
+    parser.add_argument('--width', help='Width of input video. Required for raw YUV videos.', type=int, default=None)
+    parser.add_argument('--height', help='Height of input video. Required for raw YUV videos.', type=int, default=None)
+    parser.add_argument('--max_frames', help='Maximum number of frames to compare. (Optional)', type=int, default=None)
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    fex = EnhVmafFeatureExtractor(use_cache=False)
+    flow_methods = ['skimage', 'fast']
+    plans = {
+        method: feature_graph.vmaf_family_graph(fex.vif_filters, fex.wavelet, fex.scales, method).plan(['e_dlm_y_alpha_20'])
+        for method in flow_methods
+    }
+    e_dlm = {method: [] for method in flow_methods}
+    times = {method: 0 for method in flow_methods}
+
+    with Video(
+        args.ref_video, mode='r',
+        standard=get_standard(args.ref_standard),
+        width=args.width, height=args.height
+    ) as v_ref:
+        with Video(
+            args.dis_video, mode='r',
+            standard=get_standard(args.dis_standard),
+            width=args.width, height=args.height
+        ) as v_dis:
+            for frame_ind, (frame_ref, frame_dis) in enumerate(zip(v_ref, v_dis)):
+                if args.max_frames is not None and frame_ind >= args.max_frames:
+                    break
+                sources = {'yuv_ref': frame_ref.yuv, 'yuv_dis': frame_dis.yuv}
+                for method in flow_methods:
+                    start = time.time()
+                    e_dlm[method].append(plans[method].run_frame(sources)['e_dlm_y_alpha_20'])
+                    times[method] += time.time() - start
+
+    # The first frame has no motion-compensated difference and is identical for both methods
+    ref_vals = np.array(e_dlm['skimage'])[1:]
+    fast_vals = np.array(e_dlm['fast'])[1:]
+    abs_err = np.abs(fast_vals - ref_vals)
+    rel_err = abs_err / np.maximum(np.abs(ref_vals), 1e-10)
+
+    print(f'Compared {len(ref_vals)} frames')
+    for method in flow_methods:
+        print(f'{method}: mean E-DLM {np.mean(e_dlm[method]):.6f}, time {times[method]:.2f} s')
+    print(f'Max absolute error: {abs_err.max():.3e}')
+    print(f'Mean absolute error: {abs_err.mean():.3e}')
+    print(f'Max relative error: {rel_err.max():.3e}')
+    print(f'Error in mean E-DLM: {abs(np.mean(e_dlm["fast"]) - np.mean(e_dlm["skimage"])):.3e}')
+    if len(ref_vals) > 2:
+        print(f'PCC: {stats.pearsonr(ref_vals, fast_vals)[0]:.6f}')
+        print(f'SROCC: {stats.spearmanr(ref_vals, fast_vals)[0]:.6f}')
+
+
+if __name__ == '__main__':
+    main()
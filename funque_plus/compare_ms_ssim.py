@@ -0,0 +1,67 @@
+import time
+
+import numpy as np
+from scipy import stats
+from qualitylib.tools import import_python_file, read_dataset
+
+from funque_plus.feature_extractors import MsSsimFeatureExtractor, MsSsimFastFeatureExtractor
+
+import argparse
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description='Code to compare the skvideo and Haar-domain (fast) MS-SSIM values on a dataset')
+    parser.add_argument('--dataset', help='Path to dataset file', type=str)
+    parser.add_argument('--max_assets', help='Maximum number of assets to compare. (Optional)', type=int, default=None)
+    parser.add_argument('--use_cache', help='Read stored results if available. Timings are not meaningful for cached results.', action='store_true')
+    return parser
+
+
+def _corr_row(name, x, y):
+    if len(x) < 3:
+        return f'{name:<28} {"-":>10} {"-":>10}'
+    return f'{name:<28} {stats.pearsonr(x, y)[0]:>10.4f} {stats.spearmanr(x, y)[0]:>10.4f}'
+
+
+def main():
+    args = get_parser().parse_args()
+    dataset = import_python_file(args.dataset)
+    assets = read_dataset(dataset, shuffle=False)
+    if args.max_assets is not None:
+        assets = assets[:args.max_assets]
+
+    fex_ref = MsSsimFeatureExtractor(use_cache=args.use_cache)
+    fex_fast = MsSsimFastFeatureExtractor(use_cache=args.use_cache)
+    fast_names = list(fex_fast.feat_names)
+
+    rows = []
+    times = {'skvideo': 0, 'fast': 0}
+    for asset_dict in assets:
+        start = time.time()
+        result_ref = fex_ref(asset_dict)
+        times['skvideo'] += time.time() - start
+        start = time.time()
+        result_fast = fex_fast(asset_dict)
+        times['fast'] += time.time() - start
+        rows.append((asset_dict['asset_id'], asset_dict['score'], result_ref.agg_feats.flatten()[0], *result_fast.agg_feats.flatten()))
+    rows = np.array(rows, dtype='float64')
+
+    print(f'Dataset: {dataset.dataset_name}, {len(rows)} assets')
+    print(f'{"asset_id":>8} {"score":>10} {"skvideo":>10}' + ''.join(f' {name.split("_channel")[0]:>14}' for name in fast_names))
+    for row in rows:
+        print(f'{int(row[0]):>8} {row[1]:>10.4f} {row[2]:>10.6f}' + ''.join(f' {val:>14.6f}' for val in row[3:]))
+
+    print()
+    print(f'{"Correlation":<28} {"PCC":>10} {"SROCC":>10}')
+    for i, name in enumerate(fast_names):
+        print(_corr_row(f'{name.split("_channel")[0]} v skvideo', rows[:, 2], rows[:, 3+i]))
+    print(_corr_row('skvideo v score', rows[:, 2], rows[:, 1]))
+    for i, name in enumerate(fast_names):
+        print(_corr_row(f'{name.split("_channel")[0]} v score', rows[:, 3+i], rows[:, 1]))
+
+    print()
+    for method, total in times.items():
+        print(f'{method}: {total:.2f} s')
+
+
+if __name__ == '__main__':
+    main()
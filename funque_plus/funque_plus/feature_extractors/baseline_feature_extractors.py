@@ -1,15 +1,12 @@
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 
 from videolib import Video
 from qualitylib.feature_extractor import FeatureExtractor
 from qualitylib.result import Result
 
 import numpy as np
-import scipy as sp
-from skimage import metrics
 from skvideo import measure
-from image_similarity_measures import quality_metrics
-from ..features.baseline_atoms import vmaf_features, ens_vmaf_features, evmaf_features, flow_utils
+from ..features.baseline_atoms import feature_graph, fsim_features, psnr_features, ssim_features
 from ..features.funque_atoms import pyr_features
 
 
@@ -21,6 +18,11 @@ class SsimFeatureExtractor(FeatureExtractor):
     VERSION = '1.0'
     feat_names = ['ssim_channel_y']
 
+    def __init__(self, use_cache: bool = True, sample_rate: Optional[int] = None, batch_size: int = 1) -> None:
+        super().__init__(use_cache, sample_rate)
+        self.batch_size = batch_size  # Number of frames processed together by the SSIM engine
+        self.engine = ssim_features.SsimEngine(data_range=1)
+
     def _run_on_asset(self, asset_dict: Dict[str, Any]) -> Result:
         sample_interval = self._get_sample_interval(asset_dict)
         feats_dict = {key: [] for key in self.feat_names}
@@ -34,11 +36,20 @@ class SsimFeatureExtractor(FeatureExtractor):
                 standard=asset_dict['dis_standard'],
                 width=asset_dict['width'], height=asset_dict['height']
             ) as v_dis:
+                batch_ref_list = []
+                batch_dis_list = []
                 for frame_ind, (frame_ref, frame_dis) in enumerate(zip(v_ref, v_dis)):
                     if frame_ind % sample_interval:
                         continue
-                    ssim = metrics.structural_similarity(frame_ref.yuv[..., 0], frame_dis.yuv[..., 0], win_size=11, gaussian_weights=True, data_range=1)
-                    feats_dict['ssim_channel_y'].append(ssim)
+                    batch_ref_list.append(frame_ref.yuv[..., 0])
+                    batch_dis_list.append(frame_dis.yuv[..., 0])
+                    if len(batch_ref_list) == self.batch_size:
+                        feats_dict['ssim_channel_y'].extend(self.engine(np.stack(batch_ref_list), np.stack(batch_dis_list)))
+                        batch_ref_list = []
+                        batch_dis_list = []
+
+                if len(batch_ref_list) != 0:
+                    feats_dict['ssim_channel_y'].extend(self.engine(np.stack(batch_ref_list), np.stack(batch_dis_list)))
 
         feats = np.array(list(feats_dict.values())).T
         print(f'Processed {asset_dict["dis_path"]}')
@@ -48,12 +59,46 @@ class SsimFeatureExtractor(FeatureExtractor):
 class PsnrFeatureExtractor(FeatureExtractor):
     '''
     A feature extractor that implements PSNR.
+    Raw YUV 4:2:0 assets whose reference and distorted videos have the same bit depth are memory-mapped and processed in bulk
+    on integer codes. Other assets are decoded frame by frame. Assets may declare their chroma format using the
+    'chroma_format' key, which defaults to '420'.
     '''
     NAME = 'PSNR_fex'
     VERSION = '1.0'
     feat_names = ['psnr_channel_y']
+    chunk_frames = 16  # Number of frames processed together by the bulk path
+
+    @staticmethod
+    def _bulk_unsupported_reason(asset_dict: Dict[str, Any]) -> Optional[str]:
+        # Returns why the bulk path cannot process asset_dict, or None if it can
+        if not (psnr_features.is_raw_yuv(asset_dict['ref_path']) and psnr_features.is_raw_yuv(asset_dict['dis_path'])):
+            return 'raw YUV videos'
+        if asset_dict.get('chroma_format', '420') != '420':
+            return '4:2:0 chroma subsampling'
+        if asset_dict['ref_standard'].range != asset_dict['dis_standard'].range:
+            return 'reference and distorted videos of the same bit depth'
+        return None
+
+    def _check_bulk(self, asset_dict: Dict[str, Any]) -> None:
+        reason = self._bulk_unsupported_reason(asset_dict)
+        if reason is not None:
+            raise ValueError(f'{self.NAME} requires {reason}')
+
+    def _run_bulk(self, asset_dict: Dict[str, Any], lut: Optional[np.ndarray] = None, lut_peak: Optional[float] = None) -> Dict[str, np.ndarray]:
+        return psnr_features.yuv420_psnr(
+            asset_dict['ref_path'], asset_dict['dis_path'],
+            asset_dict['width'], asset_dict['height'],
+            bit_depth=int(asset_dict['ref_standard'].range).bit_length(),
+            sample_interval=self._get_sample_interval(asset_dict),
+            chunk_frames=self.chunk_frames, lut=lut, lut_peak=lut_peak
+        )
 
     def _run_on_asset(self, asset_dict: Dict[str, Any]) -> Result:
+        if self._bulk_unsupported_reason(asset_dict) is None:
+            feats = self._run_bulk(asset_dict)['y'][:, None]
+            print(f'Processed {asset_dict["dis_path"]}')
+            return self._to_result(asset_dict, feats, self.feat_names)
+
         sample_interval = self._get_sample_interval(asset_dict)
         feats_dict = {key: [] for key in self.feat_names}
         with Video(
@@ -79,6 +124,40 @@ class PsnrFeatureExtractor(FeatureExtractor):
         return self._to_result(asset_dict, feats, list(feats_dict.keys()))
 
 
+class PsnrYuvFeatureExtractor(PsnrFeatureExtractor):
+    '''
+    A feature extractor that implements PSNR of the Y, U and V planes of raw YUV 4:2:0 videos, at native chroma resolution.
+    '''
+    NAME = 'PSNR_YUV_fex'
+    VERSION = '1.0'
+    feat_names = ['psnr_channel_y', 'psnr_channel_u', 'psnr_channel_v']
+
+    def _run_on_asset(self, asset_dict: Dict[str, Any]) -> Result:
+        self._check_bulk(asset_dict)
+        psnr = self._run_bulk(asset_dict)
+        feats = np.stack([psnr['y'], psnr['u'], psnr['v']], axis=-1)
+        print(f'Processed {asset_dict["dis_path"]}')
+        return self._to_result(asset_dict, feats, self.feat_names)
+
+
+class PsnrHdrFeatureExtractor(PsnrFeatureExtractor):
+    '''
+    A feature extractor that implements PSNR of the Y, U and V planes and PU21-domain PSNR of the Y plane of raw PQ-coded YUV 4:2:0 videos.
+    PU21 values are obtained from full-range PQ codes using a lookup table, and the peak is the PU21 value of 10000 nits.
+    '''
+    NAME = 'PSNR_HDR_fex'
+    VERSION = '1.0'
+    feat_names = ['psnr_channel_y', 'psnr_channel_u', 'psnr_channel_v', 'psnr_pu_channel_y']
+
+    def _run_on_asset(self, asset_dict: Dict[str, Any]) -> Result:
+        self._check_bulk(asset_dict)
+        lut = psnr_features.pu21_lut(int(asset_dict['ref_standard'].range).bit_length())
+        psnr = self._run_bulk(asset_dict, lut=lut, lut_peak=psnr_features.pu21_encode(psnr_features.PU21_L_MAX))
+        feats = np.stack([psnr['y'], psnr['u'], psnr['v'], psnr['y_lut']], axis=-1)
+        print(f'Processed {asset_dict["dis_path"]}')
+        return self._to_result(asset_dict, feats, self.feat_names)
+
+
 class FsimFeatureExtractor(FeatureExtractor):
     '''
     A feature extractor that implements FSIM.
@@ -103,7 +182,7 @@ class FsimFeatureExtractor(FeatureExtractor):
                 for frame_ind, (frame_ref, frame_dis) in enumerate(zip(v_ref, v_dis)):
                     if frame_ind % sample_interval:
                         continue
-                    fsim = quality_metrics.fsim(frame_ref.yuv[..., :1], frame_dis[..., :1])
+                    fsim = fsim_features.fsim(frame_ref.yuv[..., 0], frame_dis.yuv[..., 0])
                     feats_dict['fsim_channel_y'].append(fsim)
 
         feats = np.array(list(feats_dict.values())).T
@@ -111,31 +190,64 @@ class FsimFeatureExtractor(FeatureExtractor):
         return self._to_result(asset_dict, feats, list(feats_dict.keys()))
 
 
-class StVmafFeatureExtractor(FeatureExtractor):
+def _check_arithmetic(fex: FeatureExtractor, arithmetic: str) -> str:
+    # Fixed-point results are cached separately from float results, under a distinct name
+    if arithmetic not in ('float', 'fixed'):
+        raise ValueError(f'Arithmetic must be one of \'float\' and \'fixed\', got {arithmetic!r}')
+    if arithmetic == 'fixed':
+        fex.NAME = f'{type(fex).NAME}_fixed'
+    return arithmetic
+
+
+class VmafFamilyFeatureExtractor(FeatureExtractor):
     '''
-    A feature extractor that implements ST-VMAF.
+    Base class for the VMAF-family feature extractors. Each extractor is expressed as a map from feature names
+    to nodes of a shared feature graph, so that intermediates such as pyramids are computed once per frame.
+    If arithmetic is 'fixed', fixed-point VIF and motion are used, and results are cached under NAME + '_fixed'.
     '''
-    NAME = 'STVMAF_fex'
-    VERSION = '1.0'
-    feat_names = \
-        [f'vif_channel_y_scale_{scale}' for scale in range(4)] + \
-        [f't_vif_channel_y_scale_{scale}' for scale in range(4)] + \
-        [f't_speed_channel_y_scale_{scale}' for scale in range(1, 4)] + \
-        ['dlm_channel_y']
+    feat_nodes: Dict[str, str] = {}
+    flow_method: str = 'skimage'
 
-    def __init__(self, use_cache: bool = True, sample_rate: Optional[int] = None) -> None:
+    def __init__(self, use_cache: bool = True, sample_rate: Optional[int] = None, arithmetic: str = 'float') -> None:
+        self._arithmetic = _check_arithmetic(self, arithmetic)
         super().__init__(use_cache, sample_rate)
         self.scales = 4
+        self.wavelet = 'db2'
         self.vif_filters = [
             np.array([0.00745626912, 0.0142655009, 0.0250313189, 0.0402820669, 0.0594526194, 0.0804751068, 0.0999041125, 0.113746084, 0.118773937, 0.113746084, 0.0999041125, 0.0804751068, 0.0594526194, 0.0402820669, 0.0250313189, 0.0142655009, 0.00745626912]),
             np.array([0.0189780835, 0.0558981746, 0.120920904, 0.192116052, 0.224173605, 0.192116052, 0.120920904, 0.0558981746, 0.0189780835]),
             np.array([0.054488685, 0.244201347, 0.402619958, 0.244201347, 0.054488685]),
             np.array([0.166378498, 0.667243004, 0.166378498])
         ]
+        self.graph = feature_graph.vmaf_family_graph(self.vif_filters, self.wavelet, self.scales, self.flow_method, self.arithmetic)
+
+    @property
+    def arithmetic(self) -> str:
+        # Read-only, since the feature graph is built for it
+        return self._arithmetic
 
     def _run_on_asset(self, asset_dict: Dict[str, Any]) -> Result:
-        sample_interval = self._get_sample_interval(asset_dict)
-        feats_dict = {key: [] for key in self.feat_names}
+        return self.run_combined([self], asset_dict)[0]
+
+    @staticmethod
+    def run_combined(extractors: List['VmafFamilyFeatureExtractor'], asset_dict: Dict[str, Any]) -> List[Result]:
+        '''
+        Runs several VMAF-family extractors in a single pass over the asset, computing shared nodes only once per frame.
+        Returns one result per extractor. The cache is neither read nor written.
+        '''
+        if not all(isinstance(fex, VmafFamilyFeatureExtractor) for fex in extractors):
+            raise TypeError('All extractors must be VMAF-family feature extractors')
+        sample_intervals = set(fex._get_sample_interval(asset_dict) for fex in extractors)
+        if len(sample_intervals) != 1:
+            raise ValueError('All extractors must use the same sample interval')
+        sample_interval = sample_intervals.pop()
+        if len(set(fex.flow_method for fex in extractors)) != 1:
+            raise ValueError('All extractors must use the same flow method')
+        if len(set(fex.arithmetic for fex in extractors)) != 1:
+            raise ValueError('All extractors must use the same arithmetic')
+
+        plan = extractors[0].graph.plan(feature_graph.union_outputs(*[fex.feat_nodes for fex in extractors]))
+        node_vals = {node: [] for node in plan.outputs}
         with Video(
             asset_dict['ref_path'], mode='r',
             standard=asset_dict['ref_standard'],
@@ -146,53 +258,34 @@ class StVmafFeatureExtractor(FeatureExtractor):
                 standard=asset_dict['dis_standard'],
                 width=asset_dict['width'], height=asset_dict['height']
             ) as v_dis:
-                y_scales_ref_prev = [None, None, None, None]
-                y_scales_dis_prev = [None, None, None, None]
                 for frame_ind, (frame_ref, frame_dis) in enumerate(zip(v_ref, v_dis)):
-                    if frame_ind % sample_interval:
+                    frame_vals = plan.run_frame({'yuv_ref': frame_ref.yuv, 'yuv_dis': frame_dis.yuv}, sampled=(frame_ind % sample_interval == 0))
+                    if frame_vals is None:
                         continue
+                    for node, val in frame_vals.items():
+                        node_vals[node].append(val)
 
-                    # VIF-Y features
-                    y_scale_ref = frame_ref.yuv[..., 0].copy()
-                    y_scale_dis = frame_dis.yuv[..., 0].copy()
-
-                    y_scales_ref_cur = []
-                    y_scales_dis_cur = []
-                    for scale in range(self.scales):
-                        # Compute VIF at current scale
-                        feats_dict[f'vif_channel_y_scale_{scale}'].append(vmaf_features.vif(y_scale_ref, y_scale_dis, self.vif_filters[scale]))
-
-                        # Compute T-SpEED at scales above 1
-                        if scale >= 1:
-                            t_speed = ens_vmaf_features.t_speed(y_scale_ref, y_scale_dis, y_scales_ref_prev[scale], y_scales_dis_prev[scale])
-                            feats_dict[f't_speed_channel_y_scale_{scale}'].append(t_speed)
-
-                        # Compute T-VIF
-                        t_vif_val = ens_vmaf_features.t_vif(y_scale_ref, y_scale_dis, y_scales_ref_prev[scale], y_scales_dis_prev[scale], self.vif_filters[scale])
-                        feats_dict[f't_vif_channel_y_scale_{scale}'].append(t_vif_val)
-
-                        y_scales_ref_cur.append(y_scale_ref)
-                        y_scales_dis_cur.append(y_scale_dis)
-
-                        # Filter and decimate
-                        if scale != self.scales-1:
-                            y_scale_ref = sp.ndimage.convolve1d(sp.ndimage.convolve1d(y_scale_ref, self.vif_filters[scale+1], 0), self.vif_filters[scale+1], 1)
-                            y_scale_dis = sp.ndimage.convolve1d(sp.ndimage.convolve1d(y_scale_dis, self.vif_filters[scale+1], 0), self.vif_filters[scale+1], 1)
-                            y_scale_ref = y_scale_ref[::2, ::2]
-                            y_scale_dis = y_scale_dis[::2, ::2]
-
-                    # DLM feature
-                    [pyr_ref, pyr_dis] = [pyr_features.custom_wavedec2(channel, self.wavelet, 'periodization', self.scales) for channel in (frame_ref.yuv[..., 0], frame_dis.yuv[..., 0])]
-
-                    dlm_val = pyr_features.dlm_pyr(pyr_ref, pyr_dis, csf='watson')
-                    feats_dict[f'dlm_channel_y'].append(dlm_val)
+        results = []
+        for fex in extractors:
+            feats = np.array([node_vals[node] for node in fex.feat_nodes.values()]).T
+            results.append(fex._to_result(asset_dict, feats, list(fex.feat_nodes.keys())))
+        print(f'Processed {asset_dict["dis_path"]}')
+        return results
 
-                    y_scales_ref_prev = y_scales_ref_cur
-                    y_scales_dis_prev = y_scales_dis_cur
 
-        feats = np.array(list(feats_dict.values())).T
-        print(f'Processed {asset_dict["dis_path"]}')
-        return self._to_result(asset_dict, feats, list(feats_dict.keys()))
+class StVmafFeatureExtractor(VmafFamilyFeatureExtractor):
+    '''
+    A feature extractor that implements ST-VMAF.
+    '''
+    NAME = 'STVMAF_fex'
+    VERSION = '1.0'
+    feat_nodes = {
+        **{f'vif_channel_y_scale_{scale}': f'vif_y_scale_{scale}' for scale in range(4)},
+        **{f't_vif_channel_y_scale_{scale}': f't_vif_sampled_y_scale_{scale}' for scale in range(4)},
+        **{f't_speed_channel_y_scale_{scale}': f't_speed_sampled_y_scale_{scale}' for scale in range(1, 4)},
+        'dlm_channel_y': 'dlm_pyr_y'
+    }
+    feat_names = list(feat_nodes)
 
 
 class MsSsimFeatureExtractor(FeatureExtractor):
@@ -219,7 +312,7 @@ class MsSsimFeatureExtractor(FeatureExtractor):
                 for frame_ind, (frame_ref, frame_dis) in enumerate(zip(v_ref, v_dis)):
                     if frame_ind % sample_interval:
                         continue
-                    ms_ssim = measure.msssim(frame_ref.yuv[..., :1], frame_dis[..., :1])
+                    ms_ssim = measure.msssim(frame_ref.yuv[..., :1], frame_dis.yuv[..., :1])
                     feats_dict['ms_ssim_channel_y'].append(ms_ssim)
 
         feats = np.array(list(feats_dict.values())).T
@@ -227,27 +320,30 @@ class MsSsimFeatureExtractor(FeatureExtractor):
         return self._to_result(asset_dict, feats, list(feats_dict.keys()))
 
 
-class EnsVmafM1FeatureExtractor(FeatureExtractor):
+class MsSsimFastFeatureExtractor(FeatureExtractor):
     '''
-    A feature extractor that implements model 1 of Ensemble VMAF.
+    A fast variant of MS-SSIM, computed in the Haar wavelet domain using pyr_features.ms_ssim_pyr.
+    The mean, CoV and Minkowski pools are obtained from one pyramid per frame.
+    If arithmetic is 'fixed', integer Haar pyramids of code values are used (pyr_features.ms_ssim_pyr_int),
+    and results are cached under NAME + '_fixed'.
     '''
-    NAME = 'EnsVMAF_M1_fex'
+    NAME = 'MS_SSIM_fast_fex'
     VERSION = '1.0'
-    feat_names = \
-        [f'vif_channel_y_scale_{scale}' for scale in range(4)] + \
-        ['dlm_channel_y', 'ti_channel_y_scale_2']
+    feat_names = [f'ms_ssim_{pool}_channel_y' for pool in ('mean', 'cov', 'mink')]
 
-    def __init__(self, use_cache: bool = True, sample_rate: Optional[int] = None) -> None:
+    def __init__(self, use_cache: bool = True, sample_rate: Optional[int] = None, arithmetic: str = 'float') -> None:
+        self._arithmetic = _check_arithmetic(self, arithmetic)
         super().__init__(use_cache, sample_rate)
-        self.scales = 4
-        self.vif_filters = [
-            np.array([0.00745626912, 0.0142655009, 0.0250313189, 0.0402820669, 0.0594526194, 0.0804751068, 0.0999041125, 0.113746084, 0.118773937, 0.113746084, 0.0999041125, 0.0804751068, 0.0594526194, 0.0402820669, 0.0250313189, 0.0142655009, 0.00745626912]),
-            np.array([0.0189780835, 0.0558981746, 0.120920904, 0.192116052, 0.224173605, 0.192116052, 0.120920904, 0.0558981746, 0.0189780835]),
-            np.array([0.054488685, 0.244201347, 0.402619958, 0.244201347, 0.054488685]),
-            np.array([0.166378498, 0.667243004, 0.166378498])
-        ]
+        self.wavelet = 'haar'
+        self.wavelet_levels = 5
+
+    @property
+    def arithmetic(self) -> str:
+        return self._arithmetic
 
     def _run_on_asset(self, asset_dict: Dict[str, Any]) -> Result:
+        if self.arithmetic == 'fixed' and asset_dict['ref_standard'].range != asset_dict['dis_standard'].range:
+            raise ValueError('Fixed-point arithmetic requires reference and distorted videos of the same range')
         sample_interval = self._get_sample_interval(asset_dict)
         feats_dict = {key: [] for key in self.feat_names}
         with Video(
@@ -260,644 +356,133 @@ class EnsVmafM1FeatureExtractor(FeatureExtractor):
                 standard=asset_dict['dis_standard'],
                 width=asset_dict['width'], height=asset_dict['height']
             ) as v_dis:
-                y_scales_ref_prev = [None, None, None, None]
                 for frame_ind, (frame_ref, frame_dis) in enumerate(zip(v_ref, v_dis)):
-                    y_scale_ref = frame_ref.yuv[..., 0].copy()
-                    y_scale_dis = frame_dis.yuv[..., 0].copy()
-
-                    y_scales_ref_cur = []
-                    y_scales_dis_cur = []
-                    for scale in range(self.scales):
-                        y_scales_ref_cur.append(y_scale_ref)
-                        y_scales_dis_cur.append(y_scale_dis)
-                        # Filter and decimate
-                        if scale != self.scales-1:
-                            y_scale_ref = sp.ndimage.convolve1d(sp.ndimage.convolve1d(y_scale_ref, self.vif_filters[scale+1], 0), self.vif_filters[scale+1], 1)
-                            y_scale_dis = sp.ndimage.convolve1d(sp.ndimage.convolve1d(y_scale_dis, self.vif_filters[scale+1], 0), self.vif_filters[scale+1], 1)
-                            y_scale_ref = y_scale_ref[::2, ::2]
-                            y_scale_dis = y_scale_dis[::2, ::2]
-
                     if frame_ind % sample_interval:
-                        y_scales_ref_prev = y_scales_ref_cur
                         continue
-
-                    for scale, (y_scale_ref, y_scale_dis) in enumerate(zip(y_scales_ref_cur, y_scales_dis_cur)):
-                        # Compute VIF at current scale
-                        feats_dict[f'vif_channel_y_scale_{scale}'].append(vmaf_features.vif(y_scale_ref, y_scale_dis, self.vif_filters[scale]))
-
-                        # Compute TI-Y feature at scale 2
-                        if scale == 2:
-                            if y_scales_ref_prev[2] is None:
-                                motion_val = 0
-                            else:
-                                motion_val = np.mean(np.abs(y_scale_ref - y_scales_ref_prev[2]))
-                            feats_dict['ti_channel_y_scale_2'].append(motion_val)
-
-                    # Compute DLM
-                    [pyr_ref, pyr_dis] = [pyr_features.custom_wavedec2(channel, self.wavelet, 'periodization', self.scales) for channel in (frame_ref.yuv[..., 0], frame_dis.yuv[..., 0])]
-
-                    dlm_val = pyr_features.dlm_pyr(pyr_ref, pyr_dis, csf='watson')
-                    feats_dict[f'dlm_channel_y'].append(dlm_val)
-
-                    y_scales_ref_prev = y_scales_ref_cur
+                    # Crop so that every level of the pyramid has even dimensions
+                    h_crop = (frame_ref.yuv.shape[0] >> self.wavelet_levels) << self.wavelet_levels
+                    w_crop = (frame_ref.yuv.shape[1] >> self.wavelet_levels) << self.wavelet_levels
+                    if self.arithmetic == 'fixed':
+                        pyr_ref, pyr_dis = [pyr_features.haar_wavedec2_int(np.rint(frame.yuv[:h_crop, :w_crop, 0]), self.wavelet_levels) for frame in (frame_ref, frame_dis)]
+                        pools = pyr_features.ms_ssim_pyr_int(pyr_ref, pyr_dis, max_val=asset_dict['ref_standard'].range, pool='all')
+                    else:
+                        y_ref = frame_ref.yuv[:h_crop, :w_crop, 0] / asset_dict['ref_standard'].range
+                        y_dis = frame_dis.yuv[:h_crop, :w_crop, 0] / asset_dict['dis_standard'].range
+                        pyr_ref, pyr_dis = [pyr_features.custom_wavedec2(y, self.wavelet, 'periodization', self.wavelet_levels) for y in (y_ref, y_dis)]
+                        pools = pyr_features.ms_ssim_pyr(pyr_ref, pyr_dis, max_val=1, pool='all')
+                    for pool, (ms_ssim_scales, _) in zip(('mean', 'cov', 'mink'), pools):
+                        feats_dict[f'ms_ssim_{pool}_channel_y'].append(ms_ssim_scales[-1])
 
         feats = np.array(list(feats_dict.values())).T
         print(f'Processed {asset_dict["dis_path"]}')
         return self._to_result(asset_dict, feats, list(feats_dict.keys()))
 
 
-class EnsVmafM2FeatureExtractor(FeatureExtractor):
+class EnsVmafM1FeatureExtractor(VmafFamilyFeatureExtractor):
     '''
-    A feature extractor that implements model 2 of Ensemble VMAF.
+    A feature extractor that implements model 1 of Ensemble VMAF.
     '''
-    NAME = 'EnsVMAF_fex'
+    NAME = 'EnsVMAF_M1_fex'
     VERSION = '1.0'
-    feat_names = \
-        [f's_speed_channel_y_scale_{scale}' for scale in range(1, 4)] + \
-        [f't_speed_channel_y_scale_{scale}' for scale in range(1, 4)]
-
-    def __init__(self, use_cache: bool = True, sample_rate: Optional[int] = None) -> None:
-        super().__init__(use_cache, sample_rate)
-        self.scales = 4
-        self.vif_filters = [
-            np.array([0.00745626912, 0.0142655009, 0.0250313189, 0.0402820669, 0.0594526194, 0.0804751068, 0.0999041125, 0.113746084, 0.118773937, 0.113746084, 0.0999041125, 0.0804751068, 0.0594526194, 0.0402820669, 0.0250313189, 0.0142655009, 0.00745626912]),
-            np.array([0.0189780835, 0.0558981746, 0.120920904, 0.192116052, 0.224173605, 0.192116052, 0.120920904, 0.0558981746, 0.0189780835]),
-            np.array([0.054488685, 0.244201347, 0.402619958, 0.244201347, 0.054488685]),
-            np.array([0.166378498, 0.667243004, 0.166378498])
-        ]
+    feat_nodes = {
+        **{f'vif_channel_y_scale_{scale}': f'vif_y_scale_{scale}' for scale in range(4)},
+        'dlm_channel_y': 'dlm_pyr_y',
+        'ti_channel_y_scale_2': 'ti_y_scale_2'
+    }
+    feat_names = list(feat_nodes)
 
-    def _run_on_asset(self, asset_dict: Dict[str, Any]) -> Result:
-        sample_interval = self._get_sample_interval(asset_dict)
-        feats_dict = {key: [] for key in self.feat_names}
-        with Video(
-            asset_dict['ref_path'], mode='r',
-            standard=asset_dict['ref_standard'],
-            width=asset_dict['width'], height=asset_dict['height']
-        ) as v_ref:
-            with Video(
-                asset_dict['dis_path'], mode='r',
-                standard=asset_dict['dis_standard'],
-                width=asset_dict['width'], height=asset_dict['height']
-            ) as v_dis:
-                y_scales_ref_prev = [None, None, None, None]
-                y_scales_dis_prev = [None, None, None, None]
-                for frame_ind, (frame_ref, frame_dis) in enumerate(zip(v_ref, v_dis)):
-                    y_scale_ref = frame_ref.yuv[..., 0].copy()
-                    y_scale_dis = frame_dis.yuv[..., 0].copy()
-
-                    y_scales_ref_cur = []
-                    y_scales_dis_cur = []
-                    for scale in range(self.scales):
-                        y_scales_ref_cur.append(y_scale_ref)
-                        y_scales_dis_cur.append(y_scale_dis)
-                        # Filter and decimate
-                        if scale != self.scales-1:
-                            y_scale_ref = sp.ndimage.convolve1d(sp.ndimage.convolve1d(y_scale_ref, self.vif_filters[scale+1], 0), self.vif_filters[scale+1], 1)
-                            y_scale_dis = sp.ndimage.convolve1d(sp.ndimage.convolve1d(y_scale_dis, self.vif_filters[scale+1], 0), self.vif_filters[scale+1], 1)
-                            y_scale_ref = y_scale_ref[::2, ::2]
-                            y_scale_dis = y_scale_dis[::2, ::2]
-
-                    if frame_ind % sample_interval:
-                        y_scales_ref_prev = y_scales_ref_cur
-                        y_scales_dis_prev = y_scales_dis_cur
-                        continue
-
-                    for scale, (y_scale_ref, y_scale_dis) in enumerate(zip(y_scales_ref_cur, y_scales_dis_cur)):
-                        # Compute S-SpEED and T-SpEED at scales above 1
-                        if scale >= 1:
-                            s_speed, t_speed = ens_vmaf_features.speed(y_scale_ref, y_scale_dis, y_scales_ref_prev[scale], y_scales_dis_prev[scale])
-                            feats_dict[f's_speed_channel_y_scale_{scale}'].append(s_speed)
-                            feats_dict[f't_speed_channel_y_scale_{scale}'].append(t_speed)
-
-                    y_scales_ref_prev = y_scales_ref_cur
-                    y_scales_dis_prev = y_scales_dis_cur
 
-        feats = np.array(list(feats_dict.values())).T
-        print(f'Processed {asset_dict["dis_path"]}')
-        return self._to_result(asset_dict, feats, list(feats_dict.keys()))
+class EnsVmafM2FeatureExtractor(VmafFamilyFeatureExtractor):
+    '''
+    A feature extractor that implements model 2 of Ensemble VMAF.
+    '''
+    NAME = 'EnsVMAF_fex'
+    VERSION = '1.0'
+    feat_nodes = {
+        **{f's_speed_channel_y_scale_{scale}': f's_speed_y_scale_{scale}' for scale in range(1, 4)},
+        **{f't_speed_channel_y_scale_{scale}': f't_speed_y_scale_{scale}' for scale in range(1, 4)}
+    }
+    feat_names = list(feat_nodes)
 
 
-class EnsVmafFeatureExtractor(FeatureExtractor):
+class EnsVmafFeatureExtractor(VmafFamilyFeatureExtractor):
     '''
     A feature extractor that implements Ensemble VMAF.
     '''
     NAME = 'EnsVMAF_fex'
     VERSION = '1.0'
-    feat_names = \
-        [f'vif_channel_y_scale_{scale}' for scale in range(4)] + \
-        [f's_speed_channel_y_scale_{scale}' for scale in range(1, 4)] + \
-        [f't_speed_channel_y_scale_{scale}' for scale in range(1, 4)] + \
-        ['dlm_channel_y', 'ti_channel_y_scale_2']
+    feat_nodes = {
+        **{f'vif_channel_y_scale_{scale}': f'vif_y_scale_{scale}' for scale in range(4)},
+        **{f's_speed_channel_y_scale_{scale}': f's_speed_y_scale_{scale}' for scale in range(1, 4)},
+        **{f't_speed_channel_y_scale_{scale}': f't_speed_y_scale_{scale}' for scale in range(1, 4)},
+        'dlm_channel_y': 'dlm_pyr_y',
+        'ti_channel_y_scale_2': 'ti_y_scale_2'
+    }
+    feat_names = list(feat_nodes)
 
-    def __init__(self, use_cache: bool = True, sample_rate: Optional[int] = None) -> None:
-        super().__init__(use_cache, sample_rate)
-        self.scales = 4
-        self.vif_filters = [
-            np.array([0.00745626912, 0.0142655009, 0.0250313189, 0.0402820669, 0.0594526194, 0.0804751068, 0.0999041125, 0.113746084, 0.118773937, 0.113746084, 0.0999041125, 0.0804751068, 0.0594526194, 0.0402820669, 0.0250313189, 0.0142655009, 0.00745626912]),
-            np.array([0.0189780835, 0.0558981746, 0.120920904, 0.192116052, 0.224173605, 0.192116052, 0.120920904, 0.0558981746, 0.0189780835]),
-            np.array([0.054488685, 0.244201347, 0.402619958, 0.244201347, 0.054488685]),
-            np.array([0.166378498, 0.667243004, 0.166378498])
-        ]
 
-    def _run_on_asset(self, asset_dict: Dict[str, Any]) -> Result:
-        sample_interval = self._get_sample_interval(asset_dict)
-        feats_dict = {key: [] for key in self.feat_names}
-        with Video(
-            asset_dict['ref_path'], mode='r',
-            standard=asset_dict['ref_standard'],
-            width=asset_dict['width'], height=asset_dict['height']
-        ) as v_ref:
-            with Video(
-                asset_dict['dis_path'], mode='r',
-                standard=asset_dict['dis_standard'],
-                width=asset_dict['width'], height=asset_dict['height']
-            ) as v_dis:
-                y_scales_ref_prev = [None, None, None, None]
-                y_scales_dis_prev = [None, None, None, None]
-                for frame_ind, (frame_ref, frame_dis) in enumerate(zip(v_ref, v_dis)):
-                    y_scale_ref = frame_ref.yuv[..., 0].copy()
-                    y_scale_dis = frame_dis.yuv[..., 0].copy()
-
-                    y_scales_ref_cur = []
-                    y_scales_dis_cur = []
-                    for scale in range(self.scales):
-                        y_scales_ref_cur.append(y_scale_ref)
-                        y_scales_dis_cur.append(y_scale_dis)
-                        # Filter and decimate
-                        if scale != self.scales-1:
-                            y_scale_ref = sp.ndimage.convolve1d(sp.ndimage.convolve1d(y_scale_ref, self.vif_filters[scale+1], 0), self.vif_filters[scale+1], 1)
-                            y_scale_dis = sp.ndimage.convolve1d(sp.ndimage.convolve1d(y_scale_dis, self.vif_filters[scale+1], 0), self.vif_filters[scale+1], 1)
-                            y_scale_ref = y_scale_ref[::2, ::2]
-                            y_scale_dis = y_scale_dis[::2, ::2]
-
-                    if frame_ind % sample_interval:
-                        y_scales_ref_prev = y_scales_ref_cur
-                        y_scales_dis_prev = y_scales_dis_cur
-                        continue
-
-                    for scale, (y_scale_ref, y_scale_dis) in enumerate(zip(y_scales_ref_cur, y_scales_dis_cur)):
-                        # Compute VIF at current scale
-                        feats_dict[f'vif_channel_y_scale_{scale}'].append(vmaf_features.vif(y_scale_ref, y_scale_dis, self.vif_filters[scale]))
-
-                        # Compute TI-Y feature at scale 2
-                        if scale == 2:
-                            if y_scales_ref_prev[2] is None:
-                                motion_val = 0
-                            else:
-                                motion_val = np.mean(np.abs(y_scale_ref - y_scales_ref_prev[2]))
-                            feats_dict['ti_channel_y_scale_2'].append(motion_val)
-
-                        # Compute S-SpEED and T-SpEED at scales above 1
-                        if scale >= 1:
-                            s_speed, t_speed = ens_vmaf_features.speed(y_scale_ref, y_scale_dis, y_scales_ref_prev[scale], y_scales_dis_prev[scale])
-                            feats_dict[f's_speed_channel_y_scale_{scale}'].append(s_speed)
-                            feats_dict[f't_speed_channel_y_scale_{scale}'].append(t_speed)
-
-                    # Compute DLM
-                    [pyr_ref, pyr_dis] = [pyr_features.custom_wavedec2(channel, self.wavelet, 'periodization', self.scales) for channel in (frame_ref.yuv[..., 0], frame_dis.yuv[..., 0])]
-
-                    dlm_val = pyr_features.dlm_pyr(pyr_ref, pyr_dis, csf='watson')
-                    feats_dict[f'dlm_channel_y'].append(dlm_val)
-
-                    y_scales_ref_prev = y_scales_ref_cur
-                    y_scales_dis_prev = y_scales_dis_cur
-
-        feats = np.array(list(feats_dict.values())).T
-        print(f'Processed {asset_dict["dis_path"]}')
-        return self._to_result(asset_dict, feats, list(feats_dict.keys()))
-
-
-class VmafFeatureExtractor(FeatureExtractor):
+class VmafFeatureExtractor(VmafFamilyFeatureExtractor):
     '''
     A feature extractor that implements VMAF.
     '''
     NAME = 'VMAF_fex'
     VERSION = '1.0'
-    feat_names = \
-        [f'vif_channel_y_scale_{scale}' for scale in range(4)] + \
-        ['dlm_channel_y', 'motion_channel_y']
+    feat_nodes = {
+        **{f'vif_channel_y_scale_{scale}': f'vif_y_scale_{scale}' for scale in range(4)},
+        'dlm_channel_y': 'vmaf_dlm_y',
+        'motion_channel_y': 'motion_y'
+    }
+    feat_names = list(feat_nodes)
 
-    def __init__(self, use_cache: bool = True, sample_rate: Optional[int] = None) -> None:
-        super().__init__(use_cache, sample_rate)
-        self.scales = 4
-        self.vif_filters = [
-            np.array([0.00745626912, 0.0142655009, 0.0250313189, 0.0402820669, 0.0594526194, 0.0804751068, 0.0999041125, 0.113746084, 0.118773937, 0.113746084, 0.0999041125, 0.0804751068, 0.0594526194, 0.0402820669, 0.0250313189, 0.0142655009, 0.00745626912]),
-            np.array([0.0189780835, 0.0558981746, 0.120920904, 0.192116052, 0.224173605, 0.192116052, 0.120920904, 0.0558981746, 0.0189780835]),
-            np.array([0.054488685, 0.244201347, 0.402619958, 0.244201347, 0.054488685]),
-            np.array([0.166378498, 0.667243004, 0.166378498])
-        ]
 
-    def _run_on_asset(self, asset_dict: Dict[str, Any]) -> Result:
-        sample_interval = self._get_sample_interval(asset_dict)
-        feats_dict = {key: [] for key in self.feat_names}
-        with Video(
-            asset_dict['ref_path'], mode='r',
-            standard=asset_dict['ref_standard'],
-            width=asset_dict['width'], height=asset_dict['height']
-        ) as v_ref:
-            with Video(
-                asset_dict['dis_path'], mode='r',
-                standard=asset_dict['dis_standard'],
-                width=asset_dict['width'], height=asset_dict['height']
-            ) as v_dis:
-                y_ref_prev = None
-                for frame_ind, (frame_ref, frame_dis) in enumerate(zip(v_ref, v_dis)):
-                    if frame_ind % sample_interval:
-                        y_ref_prev = frame_ref.yuv[..., 0]
-                        continue
-
-                    y_scale_ref = frame_ref.yuv[..., 0].copy()
-                    y_scale_dis = frame_dis.yuv[..., 0].copy()
-
-                    y_scales_ref_cur = []
-                    y_scales_dis_cur = []
-                    for scale in range(self.scales):
-                        y_scales_ref_cur.append(y_scale_ref)
-                        y_scales_dis_cur.append(y_scale_dis)
-                        # Filter and decimate
-                        if scale != self.scales-1:
-                            y_scale_ref = sp.ndimage.convolve1d(sp.ndimage.convolve1d(y_scale_ref, self.vif_filters[scale+1], 0), self.vif_filters[scale+1], 1)
-                            y_scale_dis = sp.ndimage.convolve1d(sp.ndimage.convolve1d(y_scale_dis, self.vif_filters[scale+1], 0), self.vif_filters[scale+1], 1)
-                            y_scale_ref = y_scale_ref[::2, ::2]
-                            y_scale_dis = y_scale_dis[::2, ::2]
-
-                    for scale, (y_scale_ref, y_scale_dis) in enumerate(zip(y_scales_ref_cur, y_scales_dis_cur)):
-                        # Compute VIF at current scale
-                        feats_dict[f'vif_channel_y_scale_{scale}'].append(vmaf_features.vif(y_scale_ref, y_scale_dis, self.vif_filters[scale]))
-
-                    # DLM feature
-                    feats_dict[f'dlm_channel_y'].append(vmaf_features.dlm(frame_ref.yuv[..., 0], frame_dis.yuv[..., 0]))
-
-                    # Motion feature
-                    if y_ref_prev is not None:
-                        feats_dict[f'motion_channel_y'].append(vmaf_features.motion(frame_ref.yuv[..., 0], y_ref_prev, self.vif_filters[2]))
-                    else:
-                        feats_dict[f'motion_channel_y'].append(0)
-
-                    y_ref_prev = frame_ref.yuv[..., 0]
-
-        feats = np.array(list(feats_dict.values())).T
-        print(f'Processed {asset_dict["dis_path"]}')
-        return self._to_result(asset_dict, feats, list(feats_dict.keys()))
-
-
-class EnhVmafM1FeatureExtractor(FeatureExtractor):
+class EnhVmafM1FeatureExtractor(VmafFamilyFeatureExtractor):
     '''
     A feature extractor that implements model 1 of Enhanced VMAF.
     '''
     NAME = 'EnhVMAF_M1_fex'
-    VERSION = '1.0'
-    feat_names = \
-        [f'vif_channel_y_scale_{scale}' for scale in range(4)] + \
-        ['e_dlm_channel_y_alpha_20', 'ti_channel_y_scale_2', 'blur_channel_y_scale_1', 'edge_channel_y_scale_3']
-
-    def __init__(self, use_cache: bool = True, sample_rate: Optional[int] = None) -> None:
-        super().__init__(use_cache, sample_rate)
-        self.scales = 4
-        self.vif_filters = [
-            np.array([0.00745626912, 0.0142655009, 0.0250313189, 0.0402820669, 0.0594526194, 0.0804751068, 0.0999041125, 0.113746084, 0.118773937, 0.113746084, 0.0999041125, 0.0804751068, 0.0594526194, 0.0402820669, 0.0250313189, 0.0142655009, 0.00745626912]),
-            np.array([0.0189780835, 0.0558981746, 0.120920904, 0.192116052, 0.224173605, 0.192116052, 0.120920904, 0.0558981746, 0.0189780835]),
-            np.array([0.054488685, 0.244201347, 0.402619958, 0.244201347, 0.054488685]),
-            np.array([0.166378498, 0.667243004, 0.166378498])
-        ]
-
-    def _run_on_asset(self, asset_dict: Dict[str, Any]) -> Result:
-        sample_interval = self._get_sample_interval(asset_dict)
-        feats_dict = {key: [] for key in self.feat_names}
-        with Video(
-            asset_dict['ref_path'], mode='r',
-            standard=asset_dict['ref_standard'],
-            width=asset_dict['width'], height=asset_dict['height']
-        ) as v_ref:
-            with Video(
-                asset_dict['dis_path'], mode='r',
-                standard=asset_dict['dis_standard'],
-                width=asset_dict['width'], height=asset_dict['height']
-            ) as v_dis:
-                y_scales_ref_prev = [None, None, None, None]
-
-                for frame_ind, (frame_ref, frame_dis) in enumerate(zip(v_ref, v_dis)):
-                    y_scale_ref = frame_ref.yuv[..., 0].copy()
-                    y_scale_dis = frame_dis.yuv[..., 0].copy()
-
-                    y_scales_ref_cur = []
-                    y_scales_dis_cur = []
-                    for scale in range(self.scales):
-                        y_scales_ref_cur.append(y_scale_ref)
-                        y_scales_dis_cur.append(y_scale_dis)
-                        # Filter and decimate
-                        if scale != self.scales-1:
-                            y_scale_ref = sp.ndimage.convolve1d(sp.ndimage.convolve1d(y_scale_ref, self.vif_filters[scale+1], 0), self.vif_filters[scale+1], 1)
-                            y_scale_dis = sp.ndimage.convolve1d(sp.ndimage.convolve1d(y_scale_dis, self.vif_filters[scale+1], 0), self.vif_filters[scale+1], 1)
-                            y_scale_ref = y_scale_ref[::2, ::2]
-                            y_scale_dis = y_scale_dis[::2, ::2]
-
-                    if frame_ind % sample_interval:
-                        y_scales_ref_prev = y_scales_ref_cur
-                        continue
-
-                    for scale, (y_scale_ref, y_scale_dis) in enumerate(zip(y_scales_ref_cur, y_scales_dis_cur)):
-                        # Compute VIF at current scale
-                        feats_dict[f'vif_channel_y_scale_{scale}'].append(vmaf_features.vif(y_scale_ref, y_scale_dis, self.vif_filters[scale]))
-
-                        # TI-Y feature
-                        if scale == 2:
-                            if y_scales_ref_prev[2] is None:
-                                motion_val = 0
-                            else:
-                                motion_val = np.mean(np.abs(y_scale_ref - y_scales_ref_prev[2]))
-                            feats_dict['ti_channel_y_scale_2'].append(motion_val)
-
-                    # E-DLM feature
-                    [pyr_ref, pyr_dis] = [pyr_features.custom_wavedec2(channel, self.wavelet, 'periodization', self.scales) for channel in (frame_ref.yuv[..., 0], frame_dis.yuv[..., 0])]
-                    if y_scales_ref_prev[0] is None:
-                        dtf = np.zeros_like(frame_ref.yuv[..., 0])
-                    else:
-                        dtf = flow_utils.compensated_diff(frame_ref.yuv[..., 0], y_scales_ref_prev[0])
-                    pyr_dtf = pyr_features.custom_wavedec2(dtf, self.wavelet, 'periodization', self.scales)
-
-                    exp = 20
-                    dlm_val = evmaf_features.e_dlm_pyr(pyr_dtf, pyr_ref, pyr_dis, [exp])[0]
-                    feats_dict[f'e_dlm_channel_y_alpha_{exp}'].append(dlm_val)
-
-                    # Blur-Y feature
-                    blur_scales = pyr_features.blur_edge_pyr(([None], [pyr_ref[1][1]]), ([None], [pyr_dis[1][1]]), mode='blur')
-                    feats_dict['blur_channel_y_scale_1'].append(blur_scales[0])
-                    # Edge-Y feature
-                    edge_scales = pyr_features.blur_edge_pyr(([None], [pyr_ref[1][3]]), ([None], [pyr_dis[1][3]]), mode='edge')
-                    feats_dict['edge_channel_y_scale_3'].append(edge_scales[0])
-
-                    y_scales_ref_prev = y_scales_ref_cur
-
-        feats = np.array(list(feats_dict.values())).T
-        print(f'Processed {asset_dict["dis_path"]}')
-        return self._to_result(asset_dict, feats, list(feats_dict.keys()))
-
-
-class EnhVmafM2FeatureExtractor(FeatureExtractor):
+    VERSION = '1.1'
+    feat_nodes = {
+        **{f'vif_channel_y_scale_{scale}': f'vif_y_scale_{scale}' for scale in range(4)},
+        'e_dlm_channel_y_alpha_20': 'e_dlm_y_alpha_20',
+        'ti_channel_y_scale_2': 'ti_y_scale_2',
+        'blur_channel_y_scale_1': 'blur_y_scale_1',
+        'edge_channel_y_scale_3': 'edge_y_scale_3'
+    }
+    feat_names = list(feat_nodes)
+
+
+class EnhVmafM2FeatureExtractor(VmafFamilyFeatureExtractor):
     '''
     A feature extractor that implements model 2 of Enhanced VMAF.
     '''
     NAME = 'EnhVMAF_M2_fex'
-    VERSION = '1.0'
-    feat_names = \
-        ['e_dlm_channel_y_alpha_20', 'ti_channel_y_scale_2'] + \
-        ['psnr_channel_y_scale_3', 'vif_channel_u_scale_0', 'delta_ti_channel_u_scale_3', 'delta_si_channel_v_scale_0']
-
-    def __init__(self, use_cache: bool = True, sample_rate: Optional[int] = None) -> None:
-        super().__init__(use_cache, sample_rate)
-        self.scales = 4
-        self.vif_filters = [
-            np.array([0.00745626912, 0.0142655009, 0.0250313189, 0.0402820669, 0.0594526194, 0.0804751068, 0.0999041125, 0.113746084, 0.118773937, 0.113746084, 0.0999041125, 0.0804751068, 0.0594526194, 0.0402820669, 0.0250313189, 0.0142655009, 0.00745626912]),
-            np.array([0.0189780835, 0.0558981746, 0.120920904, 0.192116052, 0.224173605, 0.192116052, 0.120920904, 0.0558981746, 0.0189780835]),
-            np.array([0.054488685, 0.244201347, 0.402619958, 0.244201347, 0.054488685]),
-            np.array([0.166378498, 0.667243004, 0.166378498])
-        ]
-
-    def _run_on_asset(self, asset_dict: Dict[str, Any]) -> Result:
-        sample_interval = self._get_sample_interval(asset_dict)
-        feats_dict = {key: [] for key in self.feat_names}
-        with Video(
-            asset_dict['ref_path'], mode='r',
-            standard=asset_dict['ref_standard'],
-            width=asset_dict['width'], height=asset_dict['height']
-        ) as v_ref:
-            with Video(
-                asset_dict['dis_path'], mode='r',
-                standard=asset_dict['dis_standard'],
-                width=asset_dict['width'], height=asset_dict['height']
-            ) as v_dis:
-                y_scales_ref_prev = [None, None, None, None]
-                u_scale_ref_prev = None
-                u_scale_dis_prev = None
-
-                for frame_ind, (frame_ref, frame_dis) in enumerate(zip(v_ref, v_dis)):
-                    y_scale_ref = frame_ref.yuv[..., 0].copy()
-                    y_scale_dis = frame_dis.yuv[..., 0].copy()
-
-                    y_scales_ref_cur = []
-                    y_scales_dis_cur = []
-                    for scale in range(self.scales):
-                        y_scales_ref_cur.append(y_scale_ref)
-                        y_scales_dis_cur.append(y_scale_dis)
-                        # Filter and decimate
-                        if scale != self.scales-1:
-                            y_scale_ref = sp.ndimage.convolve1d(sp.ndimage.convolve1d(y_scale_ref, self.vif_filters[scale+1], 0), self.vif_filters[scale+1], 1)
-                            y_scale_dis = sp.ndimage.convolve1d(sp.ndimage.convolve1d(y_scale_dis, self.vif_filters[scale+1], 0), self.vif_filters[scale+1], 1)
-                            y_scale_ref = y_scale_ref[::2, ::2]
-                            y_scale_dis = y_scale_dis[::2, ::2]
-
-                    u_scale_ref = frame_ref.yuv[..., 1].copy()
-                    u_scale_dis = frame_dis.yuv[..., 1].copy()
-                    for scale in range(self.scales-1):
-                        # Filter and decimate
-                        u_scale_ref = sp.ndimage.convolve1d(sp.ndimage.convolve1d(u_scale_ref, self.vif_filters[scale+1], 0), self.vif_filters[scale+1], 1)
-                        u_scale_dis = sp.ndimage.convolve1d(sp.ndimage.convolve1d(u_scale_dis, self.vif_filters[scale+1], 0), self.vif_filters[scale+1], 1)
-                        u_scale_ref = u_scale_ref[::2, ::2]
-                        u_scale_dis = u_scale_dis[::2, ::2]
-
-                    if frame_ind % sample_interval:
-                        y_scales_ref_prev = y_scales_ref_cur
-                        u_scale_ref_prev = u_scale_ref
-                        u_scale_dis_prev = u_scale_dis
-                        continue
-
-                    for scale, (y_scale_ref, y_scale_dis) in enumerate(zip(y_scales_ref_cur, y_scales_dis_cur)):
-                        # TI-Y feature
-                        if scale == 2:
-                            if y_scales_ref_prev[2] is None:
-                                motion_val = 0
-                            else:
-                                motion_val = np.mean(np.abs(y_scale_ref - y_scales_ref_prev[2]))
-                            feats_dict['ti_channel_y_scale_2'].append(motion_val)
-
-                        # PSNR-Y feature
-                        if scale == 3:
-                            mse_val = np.mean((y_scale_ref - y_scale_dis)**2)
-                            psnr_val = -10*np.log10(mse_val)
-                            if np.isinf(psnr_val) or np.isnan(psnr_val):
-                                psnr_val = 100
-                            feats_dict['psnr_channel_y_scale_3'].append(psnr_val)
-
-                    # E-DLM feature
-                    [pyr_ref, pyr_dis] = [pyr_features.custom_wavedec2(channel, self.wavelet, 'periodization', self.scales) for channel in (frame_ref.yuv[..., 0], frame_dis.yuv[..., 0])]
-                    if y_scales_ref_prev[0] is None:
-                        dtf = np.zeros_like(frame_ref.yuv[..., 0])
-                    else:
-                        dtf = flow_utils.compensated_diff(frame_ref.yuv[..., 0], y_scales_ref_prev[0])
-                    pyr_dtf = pyr_features.custom_wavedec2(dtf, self.wavelet, 'periodization', self.scales)
-
-                    exp = 20
-                    dlm_val = evmaf_features.e_dlm_pyr(pyr_dtf, pyr_ref, pyr_dis, [exp])[0]
-                    feats_dict[f'e_dlm_channel_y_alpha_{exp}'].append(dlm_val)
-
-                    # VIF-U feature
-                    feats_dict['vif_channel_u_scale_0'].append(vmaf_features.vif(frame_ref.yuv[..., 1], frame_dis.yuv[..., 1], self.vif_filters[0]))
-
-                    # deltaTI-U feature
-                    if u_scale_ref_prev is None:
-                        ref_motion_val = 0
-                    else:
-                        ref_motion_val = np.mean(np.abs(u_scale_ref - u_scale_ref_prev))
-
-                    if u_scale_dis_prev is None:
-                        dis_motion_val = 0
-                    else:
-                        dis_motion_val = np.mean(np.abs(u_scale_dis - u_scale_dis_prev))
-
-                    feats_dict['delta_ti_channel_u_scale_3'].append(dis_motion_val - ref_motion_val)
-
-                    # deltaSI-V feature
-                    grad_ref = np.sqrt(sp.ndimage.sobel(v_ref, axis=0)**2 + sp.ndimage.sobel(v_ref, axis=1)**2)
-                    si_ref_val = np.std(grad_ref[1:-1, 1:-1])
-                    grad_dis = np.sqrt(sp.ndimage.sobel(v_dis, axis=0)**2 + sp.ndimage.sobel(v_dis, axis=1)**2)
-                    si_dis_val = np.std(grad_dis[1:-1, 1:-1])
-                    feats_dict['delta_si_channel_v_scale_0'].append(si_dis_val - si_ref_val)
-
-                    y_scales_ref_prev = y_scales_ref_cur
-                    u_scale_ref_prev = u_scale_ref
-                    u_scale_dis_prev = u_scale_dis
-
-        feats = np.array(list(feats_dict.values())).T
-        print(f'Processed {asset_dict["dis_path"]}')
-        return self._to_result(asset_dict, feats, list(feats_dict.keys()))
-
-
-class EnhVmafFeatureExtractor(FeatureExtractor):
+    VERSION = '1.1'
+    feat_nodes = {
+        'e_dlm_channel_y_alpha_20': 'e_dlm_y_alpha_20',
+        'ti_channel_y_scale_2': 'ti_y_scale_2',
+        'psnr_channel_y_scale_3': 'psnr_y_scale_3',
+        'vif_channel_u_scale_0': 'vif_u_scale_0',
+        'delta_ti_channel_u_scale_3': 'delta_ti_u_scale_3',
+        'delta_si_channel_v_scale_0': 'delta_si_v_scale_0'
+    }
+    feat_names = list(feat_nodes)
+
+
+class EnhVmafFeatureExtractor(VmafFamilyFeatureExtractor):
     '''
     A feature extractor that implements Enhanced VMAF.
     '''
     NAME = 'EnhVMAF_fex'
-    VERSION = '1.0'
-    feat_names = \
-        [f'vif_channel_y_scale_{scale}' for scale in range(4)] + \
-        ['e_dlm_channel_y_alpha_20', 'ti_channel_y_scale_2', 'blur_channel_y_scale_1', 'edge_channel_y_scale_3'] + \
-        ['psnr_channel_y_scale_3', 'vif_channel_u_scale_0', 'delta_ti_channel_u_scale_3', 'delta_si_channel_v_scale_0']
-
-    def __init__(self, use_cache: bool = True, sample_rate: Optional[int] = None) -> None:
-        super().__init__(use_cache, sample_rate)
-        self.scales = 4
-        self.vif_filters = [
-            np.array([0.00745626912, 0.0142655009, 0.0250313189, 0.0402820669, 0.0594526194, 0.0804751068, 0.0999041125, 0.113746084, 0.118773937, 0.113746084, 0.0999041125, 0.0804751068, 0.0594526194, 0.0402820669, 0.0250313189, 0.0142655009, 0.00745626912]),
-            np.array([0.0189780835, 0.0558981746, 0.120920904, 0.192116052, 0.224173605, 0.192116052, 0.120920904, 0.0558981746, 0.0189780835]),
-            np.array([0.054488685, 0.244201347, 0.402619958, 0.244201347, 0.054488685]),
-            np.array([0.166378498, 0.667243004, 0.166378498])
-        ]
-
-    def _run_on_asset(self, asset_dict: Dict[str, Any]) -> Result:
-        sample_interval = self._get_sample_interval(asset_dict)
-        feats_dict = {key: [] for key in self.feat_names}
-        with Video(
-            asset_dict['ref_path'], mode='r',
-            standard=asset_dict['ref_standard'],
-            width=asset_dict['width'], height=asset_dict['height']
-        ) as v_ref:
-            with Video(
-                asset_dict['dis_path'], mode='r',
-                standard=asset_dict['dis_standard'],
-                width=asset_dict['width'], height=asset_dict['height']
-            ) as v_dis:
-                y_scales_ref_prev = [None, None, None, None]
-                u_scale_ref_prev = None
-                u_scale_dis_prev = None
-
-                for frame_ind, (frame_ref, frame_dis) in enumerate(zip(v_ref, v_dis)):
-                    y_scale_ref = frame_ref.yuv[..., 0].copy()
-                    y_scale_dis = frame_dis.yuv[..., 0].copy()
-
-                    y_scales_ref_cur = []
-                    y_scales_dis_cur = []
-                    for scale in range(self.scales):
-                        y_scales_ref_cur.append(y_scale_ref)
-                        y_scales_dis_cur.append(y_scale_dis)
-                        # Filter and decimate
-                        if scale != self.scales-1:
-                            y_scale_ref = sp.ndimage.convolve1d(sp.ndimage.convolve1d(y_scale_ref, self.vif_filters[scale+1], 0), self.vif_filters[scale+1], 1)
-                            y_scale_dis = sp.ndimage.convolve1d(sp.ndimage.convolve1d(y_scale_dis, self.vif_filters[scale+1], 0), self.vif_filters[scale+1], 1)
-                            y_scale_ref = y_scale_ref[::2, ::2]
-                            y_scale_dis = y_scale_dis[::2, ::2]
-
-                    u_scale_ref = frame_ref.yuv[..., 1].copy()
-                    u_scale_dis = frame_dis.yuv[..., 1].copy()
-                    for scale in range(self.scales-1):
-                        # Filter and decimate
-                        u_scale_ref = sp.ndimage.convolve1d(sp.ndimage.convolve1d(u_scale_ref, self.vif_filters[scale+1], 0), self.vif_filters[scale+1], 1)
-                        u_scale_dis = sp.ndimage.convolve1d(sp.ndimage.convolve1d(u_scale_dis, self.vif_filters[scale+1], 0), self.vif_filters[scale+1], 1)
-                        u_scale_ref = u_scale_ref[::2, ::2]
-                        u_scale_dis = u_scale_dis[::2, ::2]
-
-                    if frame_ind % sample_interval:
-                        y_scales_ref_prev = y_scales_ref_cur
-                        u_scale_ref_prev = u_scale_ref
-                        u_scale_dis_prev = u_scale_dis
-                        continue
-
-                    for scale, (y_scale_ref, y_scale_dis) in enumerate(zip(y_scales_ref_cur, y_scales_dis_cur)):
-                        # Compute VIF at current scale
-                        feats_dict[f'vif_channel_y_scale_{scale}'].append(vmaf_features.vif(y_scale_ref, y_scale_dis, self.vif_filters[scale]))
-
-                        # TI-Y feature
-                        if scale == 2:
-                            if y_scales_ref_prev[2] is None:
-                                motion_val = 0
-                            else:
-                                motion_val = np.mean(np.abs(y_scale_ref - y_scales_ref_prev[2]))
-                            feats_dict['ti_channel_y_scale_2'].append(motion_val)
-
-                        # PSNR-Y feature
-                        if scale == 3:
-                            mse_val = np.mean((y_scale_ref - y_scale_dis)**2)
-                            psnr_val = -10*np.log10(mse_val)
-                            if np.isinf(psnr_val) or np.isnan(psnr_val):
-                                psnr_val = 100
-                            feats_dict['psnr_channel_y_scale_3'].append(psnr_val)
-
-                    # E-DLM feature
-                    [pyr_ref, pyr_dis] = [pyr_features.custom_wavedec2(channel, self.wavelet, 'periodization', self.scales) for channel in (frame_ref.yuv[..., 0], frame_dis.yuv[..., 0])]
-                    if y_scales_ref_prev[0] is None:
-                        dtf = np.zeros_like(frame_ref.yuv[..., 0])
-                    else:
-                        dtf = flow_utils.compensated_diff(frame_ref.yuv[..., 0], y_scales_ref_prev[0])
-                    pyr_dtf = pyr_features.custom_wavedec2(dtf, self.wavelet, 'periodization', self.scales)
-
-                    exp = 20
-                    dlm_val = evmaf_features.e_dlm_pyr(pyr_dtf, pyr_ref, pyr_dis, [exp])[0]
-                    feats_dict[f'e_dlm_channel_y_alpha_{exp}'].append(dlm_val)
-
-                    # Blur-Y feature
-                    blur_scales = pyr_features.blur_edge_pyr(([None], [pyr_ref[1][1]]), ([None], [pyr_dis[1][1]]), mode='blur')
-                    feats_dict['blur_channel_y_scale_1'].append(blur_scales[0])
-                    # Edge-Y feature
-                    edge_scales = pyr_features.blur_edge_pyr(([None], [pyr_ref[1][3]]), ([None], [pyr_dis[1][3]]), mode='edge')
-                    feats_dict['edge_channel_y_scale_3'].append(edge_scales[0])
-
-                    # VIF-U feature
-                    feats_dict['vif_channel_u_scale_0'].append(vmaf_features.vif(frame_ref.yuv[..., 1], frame_dis.yuv[..., 1], self.vif_filters[0]))
-
-                    # deltaTI-U feature
-                    if u_scale_ref_prev is None:
-                        ref_motion_val = 0
-                    else:
-                        ref_motion_val = np.mean(np.abs(u_scale_ref - u_scale_ref_prev))
-
-                    if u_scale_dis_prev is None:
-                        dis_motion_val = 0
-                    else:
-                        dis_motion_val = np.mean(np.abs(u_scale_dis - u_scale_dis_prev))
-
-                    feats_dict['delta_ti_channel_u_scale_3'].append(dis_motion_val - ref_motion_val)
-
-                    # deltaSI-V feature
-                    grad_ref = np.sqrt(sp.ndimage.sobel(v_ref, axis=0)**2 + sp.ndimage.sobel(v_ref, axis=1)**2)
-                    si_ref_val = np.std(grad_ref[1:-1, 1:-1])
-                    grad_dis = np.sqrt(sp.ndimage.sobel(v_dis, axis=0)**2 + sp.ndimage.sobel(v_dis, axis=1)**2)
-                    si_dis_val = np.std(grad_dis[1:-1, 1:-1])
-                    feats_dict['delta_si_channel_v_scale_0'].append(si_dis_val - si_ref_val)
-
-                    y_scales_ref_prev = y_scales_ref_cur
-                    u_scale_ref_prev = u_scale_ref
-                    u_scale_dis_prev = u_scale_dis
-
-        feats = np.array(list(feats_dict.values())).T
-        print(f'Processed {asset_dict["dis_path"]}')
-        return self._to_result(asset_dict, feats, list(feats_dict.keys()))
+    VERSION = '1.1'
+    feat_nodes = {
+        **{f'vif_channel_y_scale_{scale}': f'vif_y_scale_{scale}' for scale in range(4)},
+        'e_dlm_channel_y_alpha_20': 'e_dlm_y_alpha_20',
+        'ti_channel_y_scale_2': 'ti_y_scale_2',
+        'blur_channel_y_scale_1': 'blur_y_scale_1',
+        'edge_channel_y_scale_3': 'edge_y_scale_3',
+        'psnr_channel_y_scale_3': 'psnr_y_scale_3',
+        'vif_channel_u_scale_0': 'vif_u_scale_0',
+        'delta_ti_channel_u_scale_3': 'delta_ti_u_scale_3',
+        'delta_si_channel_v_scale_0': 'delta_si_v_scale_0'
+    }
+    feat_names = list(feat_nodes)
@@ -1,67 +1,98 @@
 import numpy as np
-from scipy import ndimage
+from ..funque_atoms import conv_utils
 from ..funque_atoms.gsm_utils import gsm_model
 from ..funque_atoms.rred_utils import rred_entropies_and_scales
 from . import vmaf_features
 
 
-def speed(img_ref, img_dis, img_ref_prev, img_dis_prev, block_size=5):
-    img_ref_ms = img_ref - ndimage.gaussian_filter(img_ref, 7/6, truncate=3) 
-    img_dis_ms = img_dis - ndimage.gaussian_filter(img_dis, 7/6, truncate=3) 
+class SpeedState:
+    '''
+    Mean-subtracted reference and distorted frames at one scale, along with their spatial GSM entropies and scales.
+    Carrying the state of the previous frame avoids filtering it again for T-SpEED, and the spatial terms,
+    computed on first use, are shared by S-SpEED and T-SpEED.
+    '''
+    def __init__(self, img_ref, img_dis, block_size=5):
+        self.block_size = block_size
+        self.img_ref_ms = img_ref - conv_utils.gaussian_filter(img_ref, 7/6, truncate=3)
+        self.img_dis_ms = img_dis - conv_utils.gaussian_filter(img_dis, 7/6, truncate=3)
+        self._spatial = None
 
-    entropies_ref, scales_ref = rred_entropies_and_scales(img_ref_ms, block_size=block_size)
-    entropies_dis, scales_dis = rred_entropies_and_scales(img_dis_ms, block_size=block_size)
+    @property
+    def spatial(self):
+        # ((entropies_ref, scales_ref), (entropies_dis, scales_dis))
+        if self._spatial is None:
+            self._spatial = (
+                rred_entropies_and_scales(self.img_ref_ms, block_size=self.block_size),
+                rred_entropies_and_scales(self.img_dis_ms, block_size=self.block_size),
+            )
+        return self._spatial
 
-    s_speed = np.mean(np.abs(scales_ref*entropies_ref - scales_dis*entropies_dis))
 
-    if img_ref_prev is None or img_dis_prev is None:
-        t_speed = 0
-    else:
-        img_ref_diff_ms = img_ref_ms - (img_ref_prev - ndimage.gaussian_filter(img_ref_prev, 7/6, truncate=3))
-        img_dis_diff_ms = img_dis_ms - (img_dis_prev - ndimage.gaussian_filter(img_dis_prev, 7/6, truncate=3))
+def speed_state(img_ref, img_dis, block_size=5):
+    return SpeedState(img_ref, img_dis, block_size=block_size)
 
-        entropies_ref_diff, scales_ref_diff = rred_entropies_and_scales(img_ref_diff_ms, block_size=block_size)
-        entropies_dis_diff, scales_dis_diff = rred_entropies_and_scales(img_dis_diff_ms, block_size=block_size)
 
-        t_speed = np.mean(np.abs(scales_ref*scales_ref_diff*entropies_ref_diff - scales_dis*scales_dis_diff*entropies_dis_diff))
+def s_speed_from_state(state):
+    (entropies_ref, scales_ref), (entropies_dis, scales_dis) = state.spatial
+    return np.mean(np.abs(scales_ref*entropies_ref - scales_dis*entropies_dis))
 
-    return s_speed, t_speed
 
+def speed_diffs(state, state_prev):
+    # Temporal differences of the mean-subtracted frames. By linearity, these equal the mean-subtracted frame differences.
+    if state_prev is None:
+        return None
+    assert state.block_size == state_prev.block_size, 'States must use the same block size'
+    return state.img_ref_ms - state_prev.img_ref_ms, state.img_dis_ms - state_prev.img_dis_ms
+
+
+def t_speed_from_diffs(state, diffs_ms):
+    if diffs_ms is None:
+        return 0
+    img_ref_diff_ms, img_dis_diff_ms = diffs_ms
+    (_, scales_ref), (_, scales_dis) = state.spatial
+
+    entropies_ref_diff, scales_ref_diff = rred_entropies_and_scales(img_ref_diff_ms, block_size=state.block_size)
+    entropies_dis_diff, scales_dis_diff = rred_entropies_and_scales(img_dis_diff_ms, block_size=state.block_size)
+
+    return np.mean(np.abs(scales_ref*scales_ref_diff*entropies_ref_diff - scales_dis*scales_dis_diff*entropies_dis_diff))
 
-def t_speed(img_ref, img_dis, img_ref_prev, img_dis_prev, block_size=5):
-    img_ref_ms = img_ref - ndimage.gaussian_filter(img_ref, 7/6, truncate=3) 
-    img_dis_ms = img_dis - ndimage.gaussian_filter(img_dis, 7/6, truncate=3) 
 
-    _, scales_ref = rred_entropies_and_scales(img_ref_ms, block_size=block_size)
-    _, scales_dis = rred_entropies_and_scales(img_dis_ms, block_size=block_size)
+def t_speed_from_states(state, state_prev):
+    return t_speed_from_diffs(state, speed_diffs(state, state_prev))
 
+
+def _prev_state(img_ref_prev, img_dis_prev, block_size):
     if img_ref_prev is None or img_dis_prev is None:
-        t_speed = 0
-    else:
-        img_ref_diff_ms = img_ref_ms - (img_ref_prev - ndimage.gaussian_filter(img_ref_prev, 7/6, truncate=3))
-        img_dis_diff_ms = img_dis_ms - (img_dis_prev - ndimage.gaussian_filter(img_dis_prev, 7/6, truncate=3))
+        return None
+    return SpeedState(img_ref_prev, img_dis_prev, block_size=block_size)
+
 
-        entropies_ref_diff, scales_ref_diff = rred_entropies_and_scales(img_ref_diff_ms, block_size=block_size)
-        entropies_dis_diff, scales_dis_diff = rred_entropies_and_scales(img_dis_diff_ms, block_size=block_size)
+def speed(img_ref, img_dis, img_ref_prev, img_dis_prev, block_size=5):
+    state = SpeedState(img_ref, img_dis, block_size)
+    state_prev = _prev_state(img_ref_prev, img_dis_prev, block_size)
+    return s_speed_from_state(state), t_speed_from_states(state, state_prev)
 
-        t_speed = np.mean(np.abs(scales_ref*scales_ref_diff*entropies_ref_diff - scales_dis*scales_dis_diff*entropies_dis_diff))
 
-    return t_speed
+def t_speed(img_ref, img_dis, img_ref_prev, img_dis_prev, block_size=5):
+    state = SpeedState(img_ref, img_dis, block_size)
+    return t_speed_from_states(state, _prev_state(img_ref_prev, img_dis_prev, block_size))
 
 
 def s_speed(img_ref, img_dis, block_size=5):
-    img_ref_ms = img_ref - ndimage.gaussian_filter(img_ref, 7/6, truncate=3) 
-    img_dis_ms = img_dis - ndimage.gaussian_filter(img_dis, 7/6, truncate=3) 
+    return s_speed_from_state(SpeedState(img_ref, img_dis, block_size))
 
-    entropies_ref, scales_ref = rred_entropies_and_scales(img_ref_ms, block_size=block_size)
-    entropies_dis, scales_dis = rred_entropies_and_scales(img_dis_ms, block_size=block_size)
 
-    s_speed = np.mean(np.abs(scales_ref*entropies_ref - scales_dis*entropies_dis))
+def frame_diff(img, img_prev):
+    if img_prev is None:
+        return None
+    return img - img_prev
 
-    return s_speed
+
+def t_vif_from_diffs(img_ref_diff, img_dis_diff, kernel):
+    if img_ref_diff is None or img_dis_diff is None:
+        return 0
+    return vmaf_features.vif(img_ref_diff, img_dis_diff, kernel)
 
 
 def t_vif(img_ref, img_dis, img_ref_prev, img_dis_prev, kernel):
-    if img_ref_prev is None or img_dis_prev is None:
-        return 0
-    return vmaf_features.vif(img_ref - img_ref_prev, img_dis - img_dis_prev, kernel)
\ No newline at end of file
+    return t_vif_from_diffs(frame_diff(img_ref, img_ref_prev), frame_diff(img_dis, img_dis_prev), kernel)
@@ -0,0 +1,277 @@
+import numpy as np
+from scipy import ndimage
+
+from ..funque_atoms import pyr_features, conv_utils
+from . import vmaf_features, ens_vmaf_features, evmaf_features, flow_utils
+
+# A declarative graph of per-frame intermediates and features.
+# Each node is computed from named inputs, which may be
+#   - other nodes of the current frame, e.g. 'y_ref_scale_2',
+#   - sources supplied for every frame ('yuv_ref', 'yuv_dis'),
+#   - the value of a node on the previous frame, e.g. 'prev:y_ref_scale_2', or
+#   - the value of a node on the previous sampled frame, e.g. 'prev_sampled:y_ref_scale_2'.
+# Temporal inputs are None on the first frame.
+# A plan computes each node required by the requested outputs at most once per frame.
+# On frames that are not sampled, only the nodes needed to carry 'prev:' inputs to the next frame are computed.
+SOURCES = ('yuv_ref', 'yuv_dis')
+PREV = 'prev:'
+PREV_SAMPLED = 'prev_sampled:'
+
+
+def _split_input(name):
+    for prefix in (PREV, PREV_SAMPLED):
+        if name.startswith(prefix):
+            return prefix, name[len(prefix):]
+    return None, name
+
+
+class FeatureNode:
+    def __init__(self, name, funct, inputs=(), stateful=False):
+        self.name = name
+        self.funct = funct
+        self.inputs = tuple(inputs)
+        self.stateful = stateful  # Stateful nodes receive a per-run dict as their first argument
+
+    def __repr__(self):
+        return f'FeatureNode({self.name!r}, inputs={self.inputs})'
+
+
+class FeatureGraph:
+    def __init__(self):
+        self.nodes = {}
+
+    def add(self, name, funct, inputs=(), stateful=False):
+        if name in self.nodes or name in SOURCES:
+            raise ValueError(f'Node {name} already exists')
+        self.nodes[name] = FeatureNode(name, funct, inputs, stateful)
+        return name
+
+    def plan(self, outputs):
+        return FeaturePlan(self, outputs)
+
+
+class FeaturePlan:
+    '''
+    Execution plan for a set of outputs of a feature graph.
+    '''
+    def __init__(self, graph, outputs):
+        self.graph = graph
+        self.outputs = list(dict.fromkeys(outputs))
+        for name in self.outputs:
+            if name not in graph.nodes and name not in SOURCES:
+                raise KeyError(f'Unknown node {name}')
+
+        # Nodes whose values are read on the next frame (prev:) or on the next sampled frame (prev_sampled:).
+        # Iterate until the temporal dependencies of carried nodes are also carried.
+        self.prev_names = set()
+        self.prev_sampled_names = set()
+        while True:
+            n_temporal = (len(self.prev_names), len(self.prev_sampled_names))
+            self.carry_order = self._order(sorted(self.prev_names))
+            self.sampled_order = self._order(self.outputs + sorted(self.prev_names | self.prev_sampled_names))
+            if n_temporal == (len(self.prev_names), len(self.prev_sampled_names)):
+                break
+        self.reset()
+
+    def _order(self, names):
+        # Depth-first topological sort. Temporal inputs do not create dependencies on the current frame,
+        # but register the referenced nodes so that their values are kept.
+        order = []
+        visiting = set()
+        visited = set()
+
+        def visit(name):
+            if name in visited or name in SOURCES:
+                return
+            if name in visiting:
+                raise ValueError(f'Cycle in feature graph at node {name}')
+            if name not in self.graph.nodes:
+                raise KeyError(f'Unknown node {name}')
+            visiting.add(name)
+            for input_name in self.graph.nodes[name].inputs:
+                prefix, dep = _split_input(input_name)
+                if prefix == PREV:
+                    self.prev_names.add(dep)
+                elif prefix == PREV_SAMPLED:
+                    self.prev_sampled_names.add(dep)
+                else:
+                    visit(dep)
+            visiting.discard(name)
+            visited.add(name)
+            order.append(self.graph.nodes[name])
+
+        for name in names:
+            visit(name)
+        return order
+
+    @property
+    def n_nodes(self):
+        return len(self.sampled_order)
+
+    def reset(self):
+        '''
+        Clears temporal and node state. Must be called before each new video.
+        '''
+        self.prev = {}
+        self.prev_sampled = {}
+        self.states = {node.name: {} for node in self.graph.nodes.values() if node.stateful}
+
+    def _resolve(self, values, input_name):
+        prefix, name = _split_input(input_name)
+        if prefix == PREV:
+            return self.prev.get(name)
+        if prefix == PREV_SAMPLED:
+            return self.prev_sampled.get(name)
+        return values[name]
+
+    def run_frame(self, sources, sampled=True):
+        '''
+        Evaluates the plan on one frame. Returns a dict of output values if sampled, else None.
+        '''
+        values = dict(sources)
+        for node in (self.sampled_order if sampled else self.carry_order):
+            args = [self._resolve(values, input_name) for input_name in node.inputs]
+            if node.stateful:
+                values[node.name] = node.funct(self.states[node.name], *args)
+            else:
+                values[node.name] = node.funct(*args)
+
+        self.prev = {name: values[name] for name in self.prev_names}
+        if sampled:
+            self.prev_sampled = {name: values[name] for name in self.prev_sampled_names}
+            return {name: values[name] for name in self.outputs}
+        return None
+
+
+def _mean_abs(diff):
+    if diff is None:
+        return 0
+    return np.mean(np.abs(diff))
+
+
+def _psnr(img_ref, img_dis):
+    mse_val = np.mean((img_ref - img_dis)**2)
+    psnr_val = -10*np.log10(mse_val)
+    if np.isinf(psnr_val) or np.isnan(psnr_val):
+        psnr_val = 100
+    return psnr_val
+
+
+def _spatial_information(img):
+    grad = np.sqrt(ndimage.sobel(img, axis=0)**2 + ndimage.sobel(img, axis=1)**2)
+    return np.std(grad[1:-1, 1:-1])
+
+
+def _dtf(state, img, img_prev, flow_method='skimage'):
+    if img_prev is None:
+        return np.zeros_like(img)
+    if flow_method == 'skimage':
+        return flow_utils.compensated_diff(img, img_prev)
+    if 'engine' not in state:
+        state['engine'] = flow_utils.FlowEngine()
+    return state['engine'].compensated_diff(img, img_prev)
+
+
+def vmaf_family_graph(vif_filters, wavelet='db2', scales=4, flow_method='skimage', arithmetic='float'):
+    '''
+    Builds the graph of all features used by the VMAF, ST-VMAF, Ensemble VMAF and Enhanced VMAF extractors.
+    flow_method selects the motion-compensated difference used by E-DLM: 'skimage' uses flow_utils.compensated_diff,
+    'fast' uses flow_utils.FlowEngine, started from the flow of the previous frame.
+    arithmetic selects the implementation of VIF and motion: 'float', or 'fixed' for the fixed-point implementations
+    in vmaf_features, which operate on the integer code values of 8- and 10-bit frames. Other features are unaffected.
+    '''
+    if flow_method not in ('fast', 'skimage'):
+        raise ValueError(f'Invalid flow method {flow_method}')
+    if arithmetic not in ('float', 'fixed'):
+        raise ValueError(f'Invalid arithmetic {arithmetic}')
+    graph = FeatureGraph()
+    for ch_ind, ch in enumerate('yuv'):
+        for which in ('ref', 'dis'):
+            graph.add(f'{ch}_{which}', lambda yuv, ch_ind=ch_ind: yuv[..., ch_ind].copy(), [f'yuv_{which}'])
+
+    # Gaussian pyramids used by VIF and the temporal features
+    for ch in 'yu':
+        for which in ('ref', 'dis'):
+            graph.add(f'{ch}_{which}_scale_0', lambda img: img, [f'{ch}_{which}'])
+            for scale in range(1, scales):
+                graph.add(f'{ch}_{which}_scale_{scale}', lambda img, filt=vif_filters[scale]: conv_utils.sep_filter(img, filt, decimate=True), [f'{ch}_{which}_scale_{scale-1}'])
+
+    # Integer pyramids used by fixed-point VIF. Levels below scale 0 have FIXED_FRAC_BITS fractional bits.
+    qfilters = [conv_utils.quantize_kernel(filt) for filt in vif_filters]
+    frac_bits = [0] + [vmaf_features.FIXED_FRAC_BITS]*(scales-1)
+    for ch_ind, ch in enumerate('yu'):
+        for which in ('ref', 'dis'):
+            graph.add(f'{ch}_{which}_fixed_scale_0', lambda yuv, ch_ind=ch_ind: vmaf_features.to_fixed(yuv[..., ch_ind]), [f'yuv_{which}'])
+            for scale in range(1, scales):
+                graph.add(f'{ch}_{which}_fixed_scale_{scale}', lambda img, qfilt=qfilters[scale], frac=frac_bits[scale-1]: vmaf_features.downsample_fixed(img, qfilt, frac), [f'{ch}_{which}_fixed_scale_{scale-1}'])
+
+    # Wavelet pyramids used by the DLM family
+    for which in ('ref', 'dis'):
+        graph.add(f'{wavelet}_pyr_{which}', lambda img: pyr_features.custom_wavedec2(img, wavelet, 'periodization', scales), [f'y_{which}'])
+
+    # Frame-difference pyramids, derived from the cached per-scale frames without further filtering.
+    # Differences with respect to the previous frame and to the previous sampled frame are shared by all temporal features.
+    for ch, ch_scales in (('y', range(scales)), ('u', [scales-1])):
+        for which in ('ref', 'dis'):
+            for scale in ch_scales:
+                graph.add(f'{ch}_{which}_diff_scale_{scale}', ens_vmaf_features.frame_diff, [f'{ch}_{which}_scale_{scale}', f'{PREV}{ch}_{which}_scale_{scale}'])
+                graph.add(f'{ch}_{which}_diff_sampled_scale_{scale}', ens_vmaf_features.frame_diff, [f'{ch}_{which}_scale_{scale}', f'{PREV_SAMPLED}{ch}_{which}_scale_{scale}'])
+
+    for scale in range(scales):
+        if arithmetic == 'fixed':
+            graph.add(f'vif_y_scale_{scale}', lambda img_ref, img_dis, qfilt=qfilters[scale], frac=frac_bits[scale]: vmaf_features.vif_fixed(img_ref, img_dis, qfilt, frac), [f'y_ref_fixed_scale_{scale}', f'y_dis_fixed_scale_{scale}'])
+        else:
+            graph.add(f'vif_y_scale_{scale}', lambda img_ref, img_dis, filt=vif_filters[scale]: vmaf_features.vif(img_ref, img_dis, filt), [f'y_ref_scale_{scale}', f'y_dis_scale_{scale}'])
+        graph.add(f't_vif_sampled_y_scale_{scale}', lambda *diffs, filt=vif_filters[scale]: ens_vmaf_features.t_vif_from_diffs(*diffs, filt), [f'y_ref_diff_sampled_scale_{scale}', f'y_dis_diff_sampled_scale_{scale}'])
+        graph.add(f'ti_y_scale_{scale}', _mean_abs, [f'y_ref_diff_scale_{scale}'])
+
+    # SpEED states hold the mean-subtracted frames and spatial GSM terms of each scale, shared by S-SpEED and
+    # T-SpEED and carried to the next frame. Mean-subtracted differences are taken between carried states.
+    for scale in range(1, scales):
+        state_node = graph.add(f'speed_state_y_scale_{scale}', ens_vmaf_features.speed_state, [f'y_ref_scale_{scale}', f'y_dis_scale_{scale}'])
+        graph.add(f's_speed_y_scale_{scale}', ens_vmaf_features.s_speed_from_state, [state_node])
+        graph.add(f't_speed_y_scale_{scale}', ens_vmaf_features.t_speed_from_diffs, [
+            state_node, graph.add(f'speed_diffs_y_scale_{scale}', ens_vmaf_features.speed_diffs, [state_node, f'{PREV}{state_node}'])
+        ])
+        graph.add(f't_speed_sampled_y_scale_{scale}', ens_vmaf_features.t_speed_from_diffs, [
+            state_node, graph.add(f'speed_diffs_sampled_y_scale_{scale}', ens_vmaf_features.speed_diffs, [state_node, f'{PREV_SAMPLED}{state_node}'])
+        ])
+
+    graph.add('dlm_pyr_y', lambda pyr_ref, pyr_dis: pyr_features.dlm_pyr(pyr_ref, pyr_dis, csf='watson'), [f'{wavelet}_pyr_ref', f'{wavelet}_pyr_dis'])
+    graph.add('vmaf_dlm_y', lambda pyr_ref, pyr_dis: vmaf_features.dlm(None, None, wavelet, pyr_ref=pyr_ref, pyr_dist=pyr_dis), [f'{wavelet}_pyr_ref', f'{wavelet}_pyr_dis'])
+    # The filtered reference is carried to the next frame, so that each frame is filtered only once
+    if arithmetic == 'fixed':
+        graph.add('y_ref_motion_filtered', lambda img, qfilt=qfilters[2]: vmaf_features.motion_filter_fixed(img, qfilt), ['y_ref_fixed_scale_0'])
+        graph.add('motion_y', vmaf_features.motion_filtered_fixed, ['y_ref_motion_filtered', f'{PREV}y_ref_motion_filtered'])
+    else:
+        graph.add('y_ref_motion_filtered', lambda img, filt=vif_filters[2]: vmaf_features.motion_filter(img, filt), ['y_ref'])
+        graph.add('motion_y', vmaf_features.motion_filtered, ['y_ref_motion_filtered', f'{PREV}y_ref_motion_filtered'])
+
+    # The flow engine is kept in the node state, so that flow is warm-started from the previous frame
+    graph.add('dtf_y', lambda state, img, img_prev: _dtf(state, img, img_prev, flow_method), ['y_ref', f'{PREV}y_ref'], stateful=True)
+    graph.add(f'{wavelet}_pyr_dtf', lambda img: pyr_features.custom_wavedec2(img, wavelet, 'periodization', scales), ['dtf_y'])
+    graph.add('e_dlm_y_alpha_20', lambda *pyrs: evmaf_features.e_dlm_pyr(*pyrs, [20])[0], [f'{wavelet}_pyr_dtf', f'{wavelet}_pyr_ref', f'{wavelet}_pyr_dis'])
+    graph.add('blur_y_scale_1', lambda pyr_ref, pyr_dis: pyr_features.blur_edge_pyr(([None], [pyr_ref[1][1]]), ([None], [pyr_dis[1][1]]), mode='blur')[0], [f'{wavelet}_pyr_ref', f'{wavelet}_pyr_dis'])
+    graph.add('edge_y_scale_3', lambda pyr_ref, pyr_dis: pyr_features.blur_edge_pyr(([None], [pyr_ref[1][3]]), ([None], [pyr_dis[1][3]]), mode='edge')[0], [f'{wavelet}_pyr_ref', f'{wavelet}_pyr_dis'])
+
+    graph.add(f'psnr_y_scale_{scales-1}', _psnr, [f'y_ref_scale_{scales-1}', f'y_dis_scale_{scales-1}'])
+    if arithmetic == 'fixed':
+        graph.add('vif_u_scale_0', lambda img_ref, img_dis, qfilt=qfilters[0]: vmaf_features.vif_fixed(img_ref, img_dis, qfilt), ['u_ref_fixed_scale_0', 'u_dis_fixed_scale_0'])
+    else:
+        graph.add('vif_u_scale_0', lambda img_ref, img_dis, filt=vif_filters[0]: vmaf_features.vif(img_ref, img_dis, filt), ['u_ref', 'u_dis'])
+    graph.add(f'delta_ti_u_scale_{scales-1}', lambda ref_ti, dis_ti: dis_ti - ref_ti, [
+        graph.add(f'ti_u_ref_scale_{scales-1}', _mean_abs, [f'u_ref_diff_scale_{scales-1}']),
+        graph.add(f'ti_u_dis_scale_{scales-1}', _mean_abs, [f'u_dis_diff_scale_{scales-1}']),
+    ])
+    graph.add('delta_si_v_scale_0', lambda si_ref, si_dis: si_dis - si_ref, [
+        graph.add('si_v_ref', _spatial_information, ['v_ref']),
+        graph.add('si_v_dis', _spatial_information, ['v_dis']),
+    ])
+    return graph
+
+
+def union_outputs(*feat_node_maps):
+    '''
+    Union of the nodes required by several {feature name: node name} maps, preserving order.
+    '''
+    return list(dict.fromkeys(node for feat_nodes in feat_node_maps for node in feat_nodes.values()))
@@ -7,16 +7,22 @@ from skimage.transform import warp
 from ..funque_atoms.vif_utils import im2col
 
 def block_sums(img, k, stride=1):
-    # Parameters
-    m, n = img.shape
-    s0, s1 = img.strides
-    nrows = m - k + 1
-    ncols = n - k + 1
-    shape = (k, k, nrows, ncols)
-    arr_stride = (s0, s1, s0, s1)
+    # Sums over all k x k blocks that lie inside the image, using running sums along each axis,
+    # so that the cost per pixel does not depend on k. img may be a stack of images of shape (..., H, W).
+    dtype = img.dtype if img.dtype.kind == 'f' else np.float64
+    lead = img.shape[:-2]
+    m, n = img.shape[-2:]
 
-    block_img = np.lib.stride_tricks.as_strided(img, shape=shape, strides=arr_stride)
-    return block_img[..., ::stride, ::stride].sum(0).sum(0)
+    cum_rows = np.empty(lead + (m+1, n), dtype=dtype)
+    cum_rows[..., 0, :] = 0
+    np.cumsum(img, axis=-2, out=cum_rows[..., 1:, :])
+
+    cum_cols = np.empty(lead + (m-k+1, n+1), dtype=dtype)
+    cum_cols[..., 0] = 0
+    np.subtract(cum_rows[..., k:, :], cum_rows[..., :-k, :], out=cum_cols[..., 1:])
+    np.cumsum(cum_cols[..., 1:], axis=-1, out=cum_cols[..., 1:])
+
+    return cum_cols[..., ::stride, k::stride] - cum_cols[..., ::stride, :-k:stride]
 
 
 def optical_flow(img, img_prev, window_size, tau=1e-2):
@@ -29,11 +35,14 @@ def optical_flow(img, img_prev, window_size, tau=1e-2):
     fy = ndimage.convolve1d(ndimage.convolve1d(img, k_hi, axis=0), k_lo, axis=1)
     ft = ndimage.convolve1d(ndimage.convolve1d(img - img_prev, k_lo, axis=0), k_lo, axis=1)
 
-    sum_fx_2 = block_sums(fx*fx, window_size, stride=1)
-    sum_fy_2 = block_sums(fy*fy, window_size, stride=1)
-    sum_fxy = block_sums(fx*fy, window_size, stride=1)
-    sum_fxt = block_sums(fx*ft, window_size, stride=1)
-    sum_fyt = block_sums(fy*ft, window_size, stride=1)
+    # Entries of the Lucas-Kanade tensor, summed over windows in one pass
+    prods = np.empty((5,) + fx.shape, dtype=fx.dtype)
+    np.multiply(fx, fx, out=prods[0])
+    np.multiply(fy, fy, out=prods[1])
+    np.multiply(fx, fy, out=prods[2])
+    np.multiply(fx, ft, out=prods[3])
+    np.multiply(fy, ft, out=prods[4])
+    sum_fx_2, sum_fy_2, sum_fxy, sum_fxt, sum_fyt = block_sums(prods, window_size, stride=1)
 
     # x direction velocity
     u = (sum_fxy*sum_fyt - sum_fy_2*sum_fxt) / (sum_fx_2*sum_fy_2 - sum_fxy**2)
@@ -60,4 +69,103 @@ def compensated_diff(img, img_prev):
     img_warp = warp(img, np.array([row_coords + v, col_coords + u]),
                     mode='edge')
 
-    return np.abs(img_prev - img_warp)
\ No newline at end of file
+    return np.abs(img_prev - img_warp)
+
+
+class FlowEngine:
+    '''
+    Coarse-to-fine iterative Lucas-Kanade flow, following skimage.registration.optical_flow_ilk,
+    for motion-compensated differences between consecutive frames.
+    Flow is estimated on a pyramid built using cv2.pyrDown and warps use cv2.remap with coordinate grids cached per shape.
+    Every call solves all levels. The flow from the previous call, downsampled to the coarsest level, is only used as
+    the initial guess, so that changes of motion and scene cuts are recovered from as by a cold solve.
+    The pyramid of the last moving image is reused as the next reference pyramid.
+    '''
+    def __init__(self, radius=4, num_warp=4, min_size=16):
+        self.radius = radius
+        self.num_warp = num_warp
+        self.min_size = min_size
+        self._grids = {}
+        self.reset()
+
+    def reset(self):
+        self.flow = None
+        self._last_img = None
+        self._last_pyr = None
+
+    def _grid(self, shape):
+        if shape not in self._grids:
+            rows, cols = np.meshgrid(np.arange(shape[0], dtype='float32'), np.arange(shape[1], dtype='float32'), indexing='ij')
+            self._grids[shape] = (rows, cols)
+        return self._grids[shape]
+
+    def _warp(self, img, flow):
+        rows, cols = self._grid(img.shape)
+        return cv2.remap(img, cols + flow[1], rows + flow[0], cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+    def _pyramid(self, img):
+        if img is self._last_img:
+            return self._last_pyr
+        pyr = [np.asarray(img, dtype='float32')]
+        while min(pyr[-1].shape) > 2*self.min_size:
+            pyr.append(cv2.pyrDown(pyr[-1]))
+        return pyr[::-1]
+
+    @staticmethod
+    def _resize_flow(flow, shape):
+        # Nearest-neighbour upsampling or area downsampling, scaling each component by the change in size along its axis
+        interpolation = cv2.INTER_NEAREST if shape[0] >= flow[0].shape[0] else cv2.INTER_AREA
+        rflow = []
+        for comp, (n, o) in zip(flow, zip(shape, flow[0].shape)):
+            rflow.append(cv2.resize(comp, shape[::-1], interpolation=interpolation) * np.float32(n / o))
+        return rflow
+
+    def _ilk(self, ref, mov, flow):
+        size = (2*self.radius + 1,)*2
+        box = lambda x: cv2.boxFilter(x, -1, size, borderType=cv2.BORDER_REFLECT_101)
+        for _ in range(self.num_warp):
+            mov_warp = self._warp(mov, flow)
+            grad_r, grad_c = np.gradient(mov_warp)
+            err = grad_r*flow[0] + grad_c*flow[1] + ref - mov_warp
+
+            a_rr = box(grad_r*grad_r)
+            a_rc = box(grad_r*grad_c)
+            a_cc = box(grad_c*grad_c)
+            b_r = box(grad_r*err)
+            b_c = box(grad_c*err)
+
+            # Closed-form solution of the 2x2 systems, ignoring badly conditioned ones
+            det = a_rr*a_cc - a_rc*a_rc
+            bad = np.abs(det) < 1e-14
+            det[bad] = 1
+            flow_r = (a_cc*b_r - a_rc*b_c) / det
+            flow_c = (a_rr*b_c - a_rc*b_r) / det
+            flow_r[bad] = 0
+            flow_c[bad] = 0
+            flow = [flow_r, flow_c]
+        return flow
+
+    def estimate(self, img, img_prev):
+        '''
+        Returns the (row, col) flow that registers img to img_prev.
+        '''
+        pyr_prev = self._pyramid(img_prev)
+        pyr = self._pyramid(img)
+        self._last_img, self._last_pyr = img, pyr
+
+        if self.flow is not None and self.flow[0].shape == img.shape:
+            flow = self._resize_flow(self.flow, pyr[0].shape)
+        else:
+            flow = [np.zeros(pyr[0].shape, dtype='float32') for _ in range(2)]
+
+        for level in range(len(pyr)):
+            if flow[0].shape != pyr[level].shape:
+                flow = self._resize_flow(flow, pyr[level].shape)
+            flow = self._ilk(pyr_prev[level], pyr[level], flow)
+
+        self.flow = flow
+        return flow
+
+    def compensated_diff(self, img, img_prev):
+        flow = self.estimate(img, img_prev)
+        return np.abs(img_prev - self._warp(img, flow))
\ No newline at end of file
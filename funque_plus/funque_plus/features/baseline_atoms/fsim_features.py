@@ -0,0 +1,208 @@
+import numpy as np
+import cv2
+from scipy import fft as sp_fft
+
+from ..funque_atoms import conv_utils, numba_utils
+
+# Optional FFTW backend. Transforms are planned once per shape and reused.
+try:
+    import pyfftw
+    import pyfftw.builders
+except ImportError:
+    pyfftw = None
+
+# Phase congruency parameters used by image_similarity_measures.quality_metrics.fsim (Kovesi's phasecong).
+NSCALE = 4
+NORIENT = 6
+MIN_WAVELENGTH = 6
+MULT = 2
+SIGMA_ONF = 0.5978
+K = 2.0
+CUTOFF = 0.5
+G = 10.0
+EPS = 1e-4
+
+_filter_banks = {}
+_fft_plans = {}
+
+
+def _freq_grid(n):
+    if n % 2:
+        return np.arange(-(n - 1) / 2, (n - 1) / 2 + 1) / (n - 1)
+    return np.arange(-n / 2, n / 2) / n
+
+
+def _half(x):
+    return np.ascontiguousarray(x[..., :x.shape[-1]//2 + 1])
+
+
+def _negate_freqs(x):
+    # Value at frequency -k, for arrays with the frequency origin at the corner
+    return np.roll(x[::-1, ::-1], 1, axis=(0, 1))
+
+
+def log_gabor_bank(shape):
+    '''
+    Returns the radial log-Gabor filters of each scale, and the even and odd parts of the angular spread
+    of each orientation, on the half spectrum of a real FFT. Banks are cached per shape.
+    The response of filter (orient, scale) is irfft2(F * radial[scale] * even[orient]) + 1j*irfft2(-1j * F * radial[scale] * odd[orient]).
+    '''
+    if shape in _filter_banks:
+        return _filter_banks[shape]
+
+    rows, cols = shape
+    x, y = np.meshgrid(_freq_grid(cols), _freq_grid(rows), sparse=True)
+    radius = np.fft.ifftshift(np.sqrt(x*x + y*y))
+    theta = np.fft.ifftshift(np.arctan2(-y, x))
+    lowpass = 1 / (1 + (radius / 0.45)**30)
+    radius[0, 0] = 1
+    sintheta = np.sin(theta)
+    costheta = np.cos(theta)
+
+    radial = np.empty((NSCALE, rows, cols//2 + 1))
+    for ss in range(NSCALE):
+        log_rad = np.log(radius / (1 / (MIN_WAVELENGTH * MULT**ss)))
+        log_gabor = np.exp(-(log_rad*log_rad) / (2 * np.log(SIGMA_ONF)**2)) * lowpass
+        log_gabor[0, 0] = 0
+        radial[ss] = _half(log_gabor)
+
+    # Radial filters are symmetric, so the even and odd parts of each filter are those of its angular spread.
+    even = np.empty((NORIENT, rows, cols//2 + 1))
+    odd = np.empty((NORIENT, rows, cols//2 + 1))
+    for oo in range(NORIENT):
+        angl = oo * np.pi / NORIENT
+        ds = sintheta * np.cos(angl) - costheta * np.sin(angl)
+        dc = costheta * np.cos(angl) + sintheta * np.sin(angl)
+        dtheta = np.minimum(np.abs(np.arctan2(ds, dc)) * NORIENT / 2, np.pi)
+        spread = (np.cos(dtheta) + 1) / 2
+        spread_neg = _negate_freqs(spread)
+        even[oo] = _half((spread + spread_neg) / 2)
+        odd[oo] = _half((spread - spread_neg) / 2)
+
+    _filter_banks[shape] = (radial, even, odd)
+    return _filter_banks[shape]
+
+
+def _rfft2(x):
+    if pyfftw is None:
+        return sp_fft.rfft2(x, workers=conv_utils.NUM_THREADS)
+    key = ('rfft2', x.shape)
+    if key not in _fft_plans:
+        _fft_plans[key] = pyfftw.builders.rfft2(pyfftw.empty_aligned(x.shape, dtype='float64'), threads=conv_utils.NUM_THREADS, planner_effort='FFTW_MEASURE')
+    return _fft_plans[key](x).copy()
+
+
+def _irfft2(x, shape, out):
+    if pyfftw is None:
+        out[...] = sp_fft.irfft2(x, s=shape, workers=conv_utils.NUM_THREADS)
+        return out
+    key = ('irfft2', x.shape, shape)
+    if key not in _fft_plans:
+        _fft_plans[key] = pyfftw.builders.irfft2(pyfftw.empty_aligned(x.shape, dtype='complex128'), s=shape, threads=conv_utils.NUM_THREADS, planner_effort='FFTW_MEASURE')
+    out[...] = _fft_plans[key](x)
+    return out
+
+
+def _phase_congruency_orient(eo, thresh, pc_sum):
+    an = np.empty(pc_sum.shape)
+    tmp = np.empty(pc_sum.shape)
+    sum_an = np.zeros(pc_sum.shape)
+    max_an = np.zeros(pc_sum.shape)
+    for e, o in eo:
+        np.multiply(e, e, out=an)
+        an += np.multiply(o, o, out=tmp)
+        np.sqrt(an, out=an)
+        sum_an += an
+        np.maximum(max_an, an, out=max_an)
+    sum_e, sum_o = eo.sum(0)
+
+    # Energy along the mean phase. Summed over scales, the projections onto the mean phase vector
+    # reduce to |sum of responses|^2 / x_energy.
+    x_energy = np.sqrt(sum_e*sum_e + sum_o*sum_o)
+    energy = x_energy * x_energy
+    x_energy += EPS
+    energy /= x_energy
+    mean_e = np.divide(sum_e, x_energy, out=sum_e)
+    mean_o = np.divide(sum_o, x_energy, out=sum_o)
+    for e, o in eo:
+        np.multiply(e, mean_o, out=an)
+        an -= np.multiply(o, mean_e, out=tmp)
+        energy -= np.abs(an, out=an)
+    energy -= thresh[:, None, None]
+    np.maximum(energy, 0, out=energy)
+
+    # Sigmoidal weighting by the spread of responses over scales
+    max_an += EPS
+    width = np.divide(sum_an, max_an, out=max_an)
+    width -= 1
+    width *= G / (NSCALE - 1)
+    np.subtract(G * CUTOFF, width, out=width)
+    weight = np.exp(width, out=width)
+    weight += 1
+    energy /= weight
+    energy /= sum_an
+    pc_sum += energy
+
+
+def phase_congruency(imgs):
+    '''
+    Phase congruency of a stack of images of shape (..., H, W), summed over orientations.
+    Follows phasepack.phasecong(img, nscale=4, minWaveLength=6, mult=2, sigmaOnf=0.5978).
+    '''
+    imgs = np.asarray(imgs, dtype='float64')
+    shape = imgs.shape[-2:]
+    lead_shape = imgs.shape[:-2]
+    imgs = imgs.reshape((-1,) + shape)
+    radial, even, odd = log_gabor_bank(shape)
+
+    spec = _rfft2(imgs)
+    spec_odd = -1j * spec
+    eo_spec = np.empty((2,) + spec.shape, dtype=spec.dtype)
+    filt = np.empty(spec.shape[-2:])
+    eo = np.empty((NSCALE, 2) + imgs.shape)
+    pc_sum = np.zeros(imgs.shape)
+    for oo in range(NORIENT):
+        for ss in range(NSCALE):
+            np.multiply(radial[ss], even[oo], out=filt)
+            np.multiply(spec, filt, out=eo_spec[0])
+            np.multiply(radial[ss], odd[oo], out=filt)
+            np.multiply(spec_odd, filt, out=eo_spec[1])
+            _irfft2(eo_spec, shape, out=eo[ss])
+
+        # Noise threshold of each image, estimated from the median response of the smallest scale
+        an = np.sqrt(eo[0, 0]**2 + eo[0, 1]**2)
+        tau = np.median(an.reshape(len(imgs), -1), axis=-1) / np.sqrt(np.log(4))
+        total_tau = tau * (1 - (1 / MULT)**NSCALE) / (1 - (1 / MULT))
+        noise_mean = total_tau * np.sqrt(np.pi / 2)
+        noise_sigma = total_tau * np.sqrt((4 - np.pi) / 2)
+        thresh = np.maximum(noise_mean + K*noise_sigma, EPS)
+
+        if numba_utils.ENABLED:
+            numba_utils.phase_congruency_orient(eo, thresh, pc_sum, CUTOFF, G, EPS)
+        else:
+            _phase_congruency_orient(eo, thresh, pc_sum)
+    return pc_sum.reshape(lead_shape + shape)
+
+
+def gradient_magnitude(img):
+    # Scharr gradients saturated to uint16, as in image_similarity_measures. The squares and their sum
+    # are also taken in uint16, to match the reference values.
+    scharr_x = cv2.Scharr(img, cv2.CV_16U, 1, 0)
+    scharr_y = cv2.Scharr(img, cv2.CV_16U, 0, 1)
+    return np.sqrt(scharr_x**2 + scharr_y**2)
+
+
+def _similarity_measure(x, y, constant):
+    return (2*x*y + constant) / (x*x + y*y + constant)
+
+
+def fsim(img_ref, img_dis, T1=0.85, T2=160):
+    '''
+    FSIM of a pair of single-channel images, processing both images together.
+    Matches image_similarity_measures.quality_metrics.fsim.
+    '''
+    pc_ref, pc_dis = phase_congruency(np.stack([img_ref, img_dis]))
+    s_pc = _similarity_measure(pc_ref, pc_dis, T1)
+    s_g = _similarity_measure(gradient_magnitude(img_ref), gradient_magnitude(img_dis), T2)
+    pc_max = np.maximum(pc_ref, pc_dis)
+    return np.sum(s_pc * s_g * pc_max) / np.sum(pc_max)
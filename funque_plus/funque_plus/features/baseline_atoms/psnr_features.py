@@ -0,0 +1,127 @@
+import os
+
+import numpy as np
+
+from ..funque_atoms import hdr_clipping
+
+# PU21 encoding parameters ('banding_glare' variant), from Mantiuk and Azimi, "PU21: A novel perceptually
+# uniform encoding for adapting existing quality metrics for HDR", PCS 2021.
+PU21_PARAMS = (0.353487901, 0.3734658629, 8.277049286e-05, 0.9062562627, 0.09150303166, 0.9099517204, 596.3148142)
+PU21_L_MIN = 0.005
+PU21_L_MAX = 10000.0
+
+
+def is_raw_yuv(path):
+    return os.path.splitext(path)[1].lower() == '.yuv'
+
+
+def code_dtype(bit_depth):
+    return np.dtype('uint8') if bit_depth <= 8 else np.dtype('uint16')
+
+
+def open_yuv420(path, width, height, bit_depth=8):
+    '''
+    Memory-maps a raw planar YUV 4:2:0 file as an array of integer codes of shape (n_frames, frame_size).
+    Raises a ValueError if the file is not a whole number of frames of this layout.
+    '''
+    dtype = code_dtype(bit_depth)
+    frame_size = width*height + 2*((width + 1) >> 1)*((height + 1) >> 1)
+    n_frames, rem = divmod(os.path.getsize(path), frame_size * dtype.itemsize)
+    if rem:
+        raise ValueError(f'{path} is not a whole number of {width}x{height} {bit_depth}-bit YUV 4:2:0 frames')
+    return np.memmap(path, dtype=dtype, mode='r', shape=(n_frames, frame_size))
+
+
+def split_planes(frames, width, height):
+    '''
+    Returns views of the Y, U and V planes of frames read using open_yuv420.
+    '''
+    c_width = (width + 1) >> 1
+    c_height = (height + 1) >> 1
+    y_size = width*height
+    c_size = c_width*c_height
+    y = frames[:, :y_size].reshape(-1, height, width)
+    u = frames[:, y_size:y_size+c_size].reshape(-1, c_height, c_width)
+    v = frames[:, y_size+c_size:y_size+2*c_size].reshape(-1, c_height, c_width)
+    return y, u, v
+
+
+def plane_sse(ref, dis, bit_depth=8):
+    # Per-frame sums of squared errors of integer codes. Squared differences fit in int32 for up to 15-bit codes.
+    diff = ref.astype('int32' if bit_depth <= 15 else 'int64')
+    diff -= dis
+    np.square(diff, out=diff)
+    return diff.reshape(len(diff), -1).sum(axis=-1, dtype='int64')
+
+
+def lut_sse(ref, dis, lut):
+    # Per-frame sums of squared errors after mapping codes through a lookup table
+    diff = np.take(lut, ref)
+    diff -= np.take(lut, dis)
+    np.square(diff, out=diff)
+    return diff.reshape(len(diff), -1).sum(axis=-1, dtype='float64')
+
+
+def psnr_from_sse(sse, n_pixels, peak=1):
+    '''
+    PSNR of each frame from its sum of squared errors. Identical frames are assigned a PSNR of 100.
+    '''
+    with np.errstate(divide='ignore', invalid='ignore'):
+        psnr = -10*np.log10(np.asarray(sse, dtype='float64') / n_pixels)
+    if peak != 1:
+        psnr += 20*np.log10(peak)
+    psnr[~np.isfinite(psnr)] = 100
+    return psnr
+
+
+def pu21_encode(lum):
+    '''
+    PU21 encoding of absolute luminance in nits.
+    '''
+    p = PU21_PARAMS
+    lum_p = np.clip(lum, PU21_L_MIN, PU21_L_MAX)**p[3]
+    return np.maximum(p[6] * (((p[0] + p[1]*lum_p) / (1 + p[2]*lum_p))**p[4] - p[5]), 0)
+
+
+def pu21_lut(bit_depth=10):
+    '''
+    Maps full-range PQ codes to PU21 values.
+    '''
+    return pu21_encode(hdr_clipping.eotf_table('pq', bit_depth).astype('float64') * hdr_clipping.PQ_PEAK_NITS)
+
+
+def yuv420_psnr(ref_path, dis_path, width, height, bit_depth=8, sample_interval=1, chunk_frames=16, lut=None, lut_peak=None):
+    '''
+    Bulk PSNR of raw YUV 4:2:0 videos. Both files are memory-mapped and squared errors of integer codes are summed
+    over chunks of frames, so that no float copies of frames are made. PSNR follows PsnrFeatureExtractor,
+    i.e., -10*log10(MSE) of code values.
+    If a lookup table from codes to another domain (e.g., pu21_lut) is given, the PSNR of the Y plane in that domain,
+    using lut_peak as the peak value, is computed in the same pass.
+    Returns a dict of per-frame PSNR arrays with keys 'y', 'u', 'v' and, if lut is given, 'y_lut'.
+    '''
+    ref_frames = open_yuv420(ref_path, width, height, bit_depth)
+    dis_frames = open_yuv420(dis_path, width, height, bit_depth)
+    n_frames = min(len(ref_frames), len(dis_frames))
+    ref_frames = ref_frames[:n_frames:sample_interval]
+    dis_frames = dis_frames[:n_frames:sample_interval]
+
+    keys = ['y', 'u', 'v'] + (['y_lut'] if lut is not None else [])
+    sse = {key: [] for key in keys}
+    for start in range(0, len(ref_frames), chunk_frames):
+        ref_planes = split_planes(ref_frames[start:start+chunk_frames], width, height)
+        dis_planes = split_planes(dis_frames[start:start+chunk_frames], width, height)
+        for key, plane_ref, plane_dis in zip('yuv', ref_planes, dis_planes):
+            sse[key].append(plane_sse(plane_ref, plane_dis, bit_depth))
+        if lut is not None:
+            sse['y_lut'].append(lut_sse(ref_planes[0], dis_planes[0], lut))
+
+    y_pixels = width*height
+    c_pixels = ((width + 1) >> 1)*((height + 1) >> 1)
+    psnr = {}
+    for key in keys:
+        vals = np.concatenate(sse[key]) if sse[key] else np.zeros((0,))
+        if key == 'y_lut':
+            psnr[key] = psnr_from_sse(vals, y_pixels, lut_peak if lut_peak is not None else lut.max())
+        else:
+            psnr[key] = psnr_from_sse(vals, y_pixels if key == 'y' else c_pixels)
+    return psnr
@@ -0,0 +1,82 @@
+import numpy as np
+
+from ..funque_atoms import conv_utils
+
+
+class SsimEngine:
+    '''
+    SSIM using an 11-tap Gaussian window with sigma 1.5, matching
+    skimage.metrics.structural_similarity(img_ref, img_dis, win_size=11, gaussian_weights=True, data_range=data_range).
+    The moments [x, y, x^2, y^2, xy] are filtered together as one stack, and scratch buffers are reused across calls.
+    Stacks of frames of shape (K, H, W) are processed in one call, returning one value per frame.
+    '''
+    def __init__(self, data_range=1, K1=0.01, K2=0.03, sigma=1.5):
+        self.kernel = conv_utils.gaussian_kernel(sigma, truncate=3.5)
+        win_size = len(self.kernel)
+        self.pad = (win_size - 1) // 2
+        self.cov_norm = win_size**2 / (win_size**2 - 1)  # Sample covariance
+        self.C1 = (K1 * data_range)**2
+        self.C2 = (K2 * data_range)**2
+        self._buffers = {}
+
+    def _buffer(self, name, shape):
+        key = (name, shape)
+        if key not in self._buffers:
+            self._buffers[key] = np.empty(shape)
+        return self._buffers[key]
+
+    def ssim_map(self, img_ref, img_dis):
+        '''
+        Returns the SSIM map, excluding a border of the size of the window radius. The map is a reused buffer.
+        '''
+        img_ref = np.asarray(img_ref, dtype='float64')
+        img_dis = np.asarray(img_dis, dtype='float64')
+        if img_ref.shape != img_dis.shape:
+            raise ValueError('Reference and distorted images must have the same shape')
+        shape = img_ref.shape
+        if min(shape[-2:]) < len(self.kernel):
+            raise ValueError('Images must be at least as large as the SSIM window')
+
+        moments = self._buffer('moments', (5,) + shape)
+        moments[0] = img_ref
+        moments[1] = img_dis
+        np.multiply(img_ref, img_ref, out=moments[2])
+        np.multiply(img_dis, img_dis, out=moments[3])
+        np.multiply(img_ref, img_dis, out=moments[4])
+        mu = conv_utils.sep_filter(moments, self.kernel, out=self._buffer('mu', (5,) + shape))
+
+        # Only the interior is pooled, so the remaining terms are evaluated on the interior alone
+        p = self.pad
+        mu_x, mu_y, mu_xx, mu_yy, mu_xy = mu[..., p:-p, p:-p]
+        crop_shape = mu_x.shape
+        a1, a2, b1, b2, tmp = [self._buffer(name, crop_shape) for name in ('a1', 'a2', 'b1', 'b2', 'tmp')]
+
+        np.multiply(mu_x, 2, out=a1)
+        a1 *= mu_y
+        a1 += self.C1
+
+        np.multiply(mu_x, mu_y, out=tmp)
+        np.subtract(mu_xy, tmp, out=a2)
+        a2 *= self.cov_norm
+        a2 *= 2
+        a2 += self.C2
+
+        np.multiply(mu_x, mu_x, out=b1)
+        b1 += np.multiply(mu_y, mu_y, out=tmp)
+        b1 += self.C1
+
+        np.multiply(mu_x, mu_x, out=tmp)
+        np.subtract(mu_xx, tmp, out=b2)
+        b2 *= self.cov_norm
+        np.multiply(mu_y, mu_y, out=tmp)
+        np.subtract(mu_yy, tmp, out=tmp)
+        tmp *= self.cov_norm
+        b2 += tmp
+        b2 += self.C2
+
+        a1 *= a2
+        b1 *= b2
+        return np.divide(a1, b1, out=a1)
+
+    def __call__(self, img_ref, img_dis):
+        return self.ssim_map(img_ref, img_dis).mean(axis=(-2, -1), dtype='float64')
@@ -1,26 +1,35 @@
 import numpy as np
-import scipy as sp
 
 from pywt import wavedec2
 
 from ..funque_atoms import dlm_utils
 from ..funque_atoms import pyr_features
+from ..funque_atoms import numba_utils
+from ..funque_atoms import conv_utils
 from ..funque_atoms.filter_utils import filter_pyr
 
 
 def vif(img_ref, img_dist, kernel):
     sigma_nsq = 0.1
 
-    mu_x = sp.ndimage.convolve1d(sp.ndimage.convolve1d(img_ref, kernel, 0), kernel, 1)
-    mu_y = sp.ndimage.convolve1d(sp.ndimage.convolve1d(img_dist, kernel, 0), kernel, 1)
-    mu2_x = sp.ndimage.convolve1d(sp.ndimage.convolve1d(img_ref*img_ref, kernel, 0), kernel, 1)
-    mu2_y = sp.ndimage.convolve1d(sp.ndimage.convolve1d(img_dist*img_dist, kernel, 0), kernel, 1)
-    mu_xy = sp.ndimage.convolve1d(sp.ndimage.convolve1d(img_ref*img_dist, kernel, 0), kernel, 1)
+    mu_x = conv_utils.sep_filter(img_ref, kernel)
+    mu_y = conv_utils.sep_filter(img_dist, kernel)
+    mu2_x = conv_utils.sep_filter(img_ref*img_ref, kernel)
+    mu2_y = conv_utils.sep_filter(img_dist*img_dist, kernel)
+    mu_xy = conv_utils.sep_filter(img_ref*img_dist, kernel)
 
     var_x = mu2_x - mu_x*mu_x
     var_y = mu2_y - mu_y*mu_y
     cov_xy = mu_xy - mu_x*mu_y
 
+    return _vif_pool(var_x, var_y, cov_xy, sigma_nsq)
+
+
+def _vif_pool(var_x, var_y, cov_xy, sigma_nsq):
+    if numba_utils.ENABLED:
+        num, den = numba_utils.vif_pool(var_x, var_y, cov_xy, sigma_nsq)
+        return num/den
+
     g = cov_xy / (var_x + 1e-10)
     sv_sq = var_y - g * cov_xy
 
@@ -39,17 +48,66 @@ def vif(img_ref, img_dist, kernel):
     return vif_val
 
 
+# Fixed-point VIF and motion operate on integer images, i.e., code values of 8- and 10-bit frames, or pyramid levels
+# with FIXED_FRAC_BITS fractional bits. Kernels are quantized using conv_utils.quantize_kernel, and local sums are
+# exact int64 values, so the only deviations from the float path are due to coefficient quantization,
+# the rounding of pyramid levels and motion-filtered frames, and the float64 arithmetic that follows.
+# The rounding of pyramid levels dominates at coarse scales, where variances are small. On synthetic frames, VIF at
+# scale 0 and motion differ from the float path by under 1e-5, while VIF at scales 1-3 differs by up to 1.1e-3 on
+# 128x96 8-bit frames, 4.5e-4 at 480x270 and 1.5e-4 at 1920x1080, and by roughly 4x less on 10-bit frames.
+FIXED_FRAC_BITS = 5
+MOTION_FRAC_BITS = 16
+
+
+def to_fixed(img):
+    return np.rint(img).astype('int32')
+
+
+def vif_fixed(img_ref, img_dist, qkernel, frac_bits=0):
+    '''
+    Fixed-point counterpart of vif for integer images with frac_bits fractional bits.
+    '''
+    sigma_nsq = 0.1
+
+    img_ref = img_ref.astype('int64')
+    img_dist = img_dist.astype('int64')
+    sums = conv_utils.int_sep_filter(np.stack([img_ref, img_dist, img_ref*img_ref, img_dist*img_dist, img_ref*img_dist]), qkernel)
+    scale = 2.0**-(2*conv_utils.COEFF_BITS + frac_bits)
+    scale_sq = 2.0**-(2*conv_utils.COEFF_BITS + 2*frac_bits)
+
+    mu_x = sums[0] * scale
+    mu_y = sums[1] * scale
+    var_x = sums[2] * scale_sq - mu_x*mu_x
+    var_y = sums[3] * scale_sq - mu_y*mu_y
+    cov_xy = sums[4] * scale_sq - mu_x*mu_y
+
+    return _vif_pool(var_x, var_y, cov_xy, sigma_nsq)
+
+
+def downsample_fixed(img, qkernel, frac_bits=0):
+    '''
+    Fixed-point counterpart of conv_utils.sep_filter(img, kernel, decimate=True). Returns an integer image with FIXED_FRAC_BITS fractional bits.
+    '''
+    shift = 2*conv_utils.COEFF_BITS + frac_bits - FIXED_FRAC_BITS
+    img_filtered = conv_utils.int_sep_filter(img, qkernel, decimate=True)
+    img_filtered += 1 << (shift - 1)
+    img_filtered >>= shift
+    return img_filtered.astype('int32')
+
+
 # Masks pyr_1 using pyr_2
 def vmaf_dlm_contrast_mask_one_way(pyr_1, pyr_2):
-    kernel = np.array([[1, 1, 1], [1, 2, 1], [1, 1, 1]])
-
+    # Equivalent to summing the zero-padded 'same' convolutions of |subband| / 30 with [[1, 1, 1], [1, 2, 1], [1, 1, 1]].
+    # By linearity, the subband energies are summed first, and the kernel is applied as a 3x3 box sum plus the center.
     n_levels = len(pyr_1)
     masked_pyr = []
     for level in range(n_levels):
-        masking_threshold = 0
-        for i in range(3):
-            masking_signal = np.abs(pyr_2[level][i]) / 30
-            masking_threshold += sp.signal.convolve2d(masking_signal, kernel, mode='same')
+        masking_signal = np.abs(pyr_2[level][0])
+        for i in range(1, 3):
+            masking_signal += np.abs(pyr_2[level][i])
+        masking_threshold = dlm_utils.integral_image_sums(masking_signal, 3, mode='constant')
+        masking_threshold += masking_signal
+        masking_threshold /= 30
         masked_level = []
         for i in range(3):
             masked_level.append(np.clip(np.abs(pyr_1[level][i]) - masking_threshold, 0, None))
@@ -57,11 +115,17 @@ def vmaf_dlm_contrast_mask_one_way(pyr_1, pyr_2):
     return masked_pyr
 
 
-def dlm(img_ref, img_dist, wavelet='db2', border_size=0.2, csf='watson'):
+def dlm(img_ref, img_dist, wavelet='db2', border_size=0.2, csf='watson', pyr_ref=None, pyr_dist=None):
+    '''
+    VMAF's DLM. Precomputed pyramids, obtained using pyr_features.custom_wavedec2(img, wavelet, 'periodization', 4),
+    may be passed as pyr_ref and pyr_dist, in which case img_ref and img_dist are not used.
+    '''
     n_levels = 4
 
-    pyr_ref = pyr_features.custom_wavedec2(img_ref, wavelet, 'periodization', n_levels)
-    pyr_dist = pyr_features.custom_wavedec2(img_dist, wavelet, 'periodization', n_levels)
+    if pyr_ref is None:
+        pyr_ref = pyr_features.custom_wavedec2(img_ref, wavelet, 'periodization', n_levels)
+    if pyr_dist is None:
+        pyr_dist = pyr_features.custom_wavedec2(img_dist, wavelet, 'periodization', n_levels)
 
     # Ignore approximation coefficients
     approxs_ref, details_ref = pyr_ref
@@ -107,9 +171,34 @@ def dlm(img_ref, img_dist, wavelet='db2', border_size=0.2, csf='watson'):
     return dlm_ret
 
 
+def motion_filter(img, kernel):
+    return conv_utils.sep_filter(img, kernel)
+
+
+# Motion between frames that have already been filtered using motion_filter.
+# Keeping the filtered previous frame avoids filtering every frame twice.
+def motion_filtered(mu_x, mu_y):
+    if mu_x is None or mu_y is None:
+        return 0
+    return np.mean(np.abs(mu_x - mu_y))
+
+
+def motion_filter_fixed(img, qkernel):
+    # Integer images of code values are filtered to MOTION_FRAC_BITS fractional bits
+    shift = 2*conv_utils.COEFF_BITS - MOTION_FRAC_BITS
+    img_filtered = conv_utils.int_sep_filter(img, qkernel)
+    img_filtered += 1 << (shift - 1)
+    img_filtered >>= shift
+    return img_filtered.astype('int32')
+
+
+def motion_filtered_fixed(mu_x, mu_y):
+    if mu_x is None or mu_y is None:
+        return 0
+    return np.abs(mu_x.astype('int64') - mu_y).sum() / (mu_x.size * 2.0**MOTION_FRAC_BITS)
+
+
 def motion(img_ref, img_dist, kernel):
     if img_ref is None or img_dist is None:
         return 0
-    mu_x = sp.ndimage.convolve1d(sp.ndimage.convolve1d(img_ref, kernel, 0), kernel, 1)
-    mu_y = sp.ndimage.convolve1d(sp.ndimage.convolve1d(img_dist, kernel, 0), kernel, 1)
-    return np.mean(np.abs(mu_x - mu_y))
+    return motion_filtered(motion_filter(img_ref, kernel), motion_filter(img_dist, kernel))
@@ -0,0 +1,380 @@
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from scipy import ndimage, signal
+
+from . import numba_utils
+
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+# Separable filtering with a choice of backend per (kernel length, image shape, dtype).
+# All backends implement scipy.ndimage.convolve1d semantics with mode='reflect' (half-sample symmetric),
+# the boundary handling used by every separable filter in this codebase.
+# By default, the 'direct' backend is always used. Autotuning is opt-in, either by setting FUNQUE_CONV_TUNING_FILE
+# or FUNQUE_CONV_AUTOTUNE, or by calling autotune(). The fastest backend is then chosen by a one-time micro-benchmark,
+# and persisted in the tuning file if one is set, so later runs start with the fastest backend.
+# The 'tiled' backend spreads the work over FUNQUE_CONV_THREADS threads (default: all cores) and can fuse
+# decimation by 2 into the filtering.
+TUNING_FILE = os.environ.get('FUNQUE_CONV_TUNING_FILE', '')
+AUTOTUNE = os.environ.get('FUNQUE_CONV_AUTOTUNE', '1' if TUNING_FILE else '0') not in ('', '0')
+NUM_THREADS = int(os.environ.get('FUNQUE_CONV_THREADS', '0')) or os.cpu_count() or 1
+
+_tuning = None
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _axis_shape(ndim, axis, k):
+    shape = [1]*ndim
+    shape[axis] = k
+    return tuple(shape)
+
+
+def _pad_axis(img, r, axis):
+    pad_width = [(0, 0)]*img.ndim
+    pad_width[axis] = (r, r)
+    return np.pad(img, pad_width, mode='symmetric')  # Equivalent to ndimage's 'reflect' mode
+
+
+def _direct_1d(img, filt, axis):
+    return ndimage.convolve1d(img, filt, axis=axis)
+
+
+def _fft_1d(img, filt, axis):
+    img_pad = _pad_axis(img, len(filt) >> 1, axis)
+    return signal.oaconvolve(img_pad, filt.reshape(_axis_shape(img.ndim, axis, len(filt))), mode='valid', axes=axis)
+
+
+def _box_1d(img, filt, axis):
+    # Running sums, O(1) per pixel irrespective of the kernel length. Only valid for box kernels.
+    k = len(filt)
+    n = img.shape[axis]
+    img_pad = _pad_axis(img, k >> 1, axis)
+    cum = np.cumsum(img_pad, axis=axis)
+    cum = np.concatenate([np.zeros_like(np.take(cum, [0], axis=axis)), cum], axis=axis)
+    sums = np.take(cum, np.arange(k, k+n), axis=axis) - np.take(cum, np.arange(n), axis=axis)
+    return sums * filt[0]
+
+
+def _cv2_1d(img, filt, axis):
+    # OpenCV correlates, so flip the kernel. BORDER_REFLECT matches ndimage's 'reflect' mode.
+    kernel = np.ascontiguousarray(filt[::-1], dtype=img.dtype)
+    ident = np.ones((1,), dtype=img.dtype)
+    axis = axis % img.ndim
+    if axis == img.ndim - 1:
+        kernel_x, kernel_y = kernel, ident
+    elif axis == img.ndim - 2:
+        kernel_x, kernel_y = ident, kernel
+    else:
+        raise ValueError('OpenCV backend only filters along the last two axes')
+    if img.ndim == 2:
+        return cv2.sepFilter2D(img, -1, kernel_x, kernel_y, borderType=cv2.BORDER_REFLECT)
+    out = np.empty_like(img)
+    for ind in np.ndindex(img.shape[:-2]):
+        out[ind] = cv2.sepFilter2D(img[ind], -1, kernel_x, kernel_y, borderType=cv2.BORDER_REFLECT)
+    return out
+
+
+def get_thread_pool():
+    # A single pool shared by all filtering calls in the process
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=NUM_THREADS, thread_name_prefix='funque_conv')
+    return _pool
+
+
+def _row_tiles(n_rows, min_rows=32):
+    n_tiles = max(1, min(NUM_THREADS, n_rows // min_rows))
+    bounds = np.linspace(0, n_rows, n_tiles+1).astype('int')
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _map_tiles(funct, tiles):
+    if len(tiles) == 1:
+        funct(*tiles[0])
+        return
+    # Both ndimage and NumPy release the GIL in their inner loops, so tiles run concurrently.
+    # Consuming the iterator re-raises any exception from the workers.
+    list(get_thread_pool().map(lambda tile: funct(*tile), tiles))
+
+
+def _strided_taps(x_pad, filt, n_out, axis, out):
+    # out[i] = sum_j filt[j] * x_pad[2i + 2r - j] along axis, i.e., convolution of the padded signal
+    # evaluated only at the even output positions retained by decimation.
+    r = len(filt) >> 1
+    sl = [slice(None)]*x_pad.ndim
+    tmp = np.empty_like(out)
+    for j in range(len(filt)):
+        sl[axis] = slice(2*r - j, 2*r - j + 2*n_out - 1, 2)
+        if j == 0:
+            np.multiply(x_pad[tuple(sl)], filt[j], out=out)
+        else:
+            np.multiply(x_pad[tuple(sl)], filt[j], out=tmp)
+            out += tmp
+    return out
+
+
+def tiled_sep_filter(img, filt, decimate=False, out=None):
+    '''
+    Separable filtering along the last two axes, split into bands of rows that are processed on a shared thread pool.
+    Each band reads its halo from a padded copy of the input and writes into the corresponding rows of out.
+    If decimate is True, returns the result decimated by 2 along both axes, without computing discarded pixels.
+    '''
+    filt = np.asarray(filt, dtype='float64')
+    if img.dtype not in (np.float32, np.float64):
+        img = img.astype('float64')
+    r = len(filt) >> 1
+    h, w = img.shape[-2:]
+    out_shape = img.shape[:-2] + (((h + 1) // 2, (w + 1) // 2) if decimate else (h, w))
+    if out is None:
+        out = np.empty(out_shape, dtype=img.dtype)
+    elif out.shape != out_shape:
+        raise ValueError(f'Output buffer has shape {out.shape}, expected {out_shape}')
+    img_pad = _pad_axis(img, r, img.ndim-2)
+
+    def filter_band(start, stop):
+        if decimate:
+            band_pad = img_pad[..., 2*start:2*stop + 2*r - 1, :]
+            band = _strided_taps(band_pad, filt, stop - start, -2, np.empty(img.shape[:-2] + (stop - start, w), dtype=img.dtype))
+            _strided_taps(_pad_axis(band, r, band.ndim-1), filt, out_shape[-1], -1, out[..., start:stop, :])
+        else:
+            band = ndimage.convolve1d(img_pad[..., start:stop + 2*r, :], filt, axis=-2)[..., r:r + stop - start, :]
+            ndimage.convolve1d(band, filt, axis=-1, output=out[..., start:stop, :])
+
+    _map_tiles(filter_band, _row_tiles(out_shape[-2]))
+    return out
+
+
+BACKENDS = {
+    'direct': _direct_1d,
+    'fft': _fft_1d,
+    'box': _box_1d,
+    'cv2': _cv2_1d,
+}
+
+# Backends that filter along the last two axes at once
+SEP_BACKENDS = {
+    'tiled': tiled_sep_filter,
+}
+
+
+def _is_last_two(img, axes):
+    return tuple(sorted(ax % img.ndim for ax in axes)) == (img.ndim-2, img.ndim-1)
+
+
+def _candidate_backends(img, filt, axes):
+    if img.dtype not in (np.float32, np.float64) or len(filt) % 2 == 0 or len(filt) > min(img.shape[ax] for ax in axes):
+        return ['direct']
+    candidates = ['direct', 'fft']
+    if np.all(filt == filt[0]):
+        candidates.append('box')
+    if cv2 is not None and all(ax % img.ndim >= img.ndim - 2 for ax in axes):
+        candidates.append('cv2')
+    if _is_last_two(img, axes):
+        candidates.append('tiled')
+    return candidates
+
+
+def _run(backend, img, filt, axes, decimate=False):
+    if backend in SEP_BACKENDS:
+        return SEP_BACKENDS[backend](img, filt, decimate=decimate)
+    funct = BACKENDS[backend]
+    for axis in axes:
+        img = funct(img, filt, axis)
+    if decimate:
+        img = img[..., ::2, ::2]
+    return img
+
+
+def autotune(enable=True, tuning_file=None):
+    '''
+    Enables or disables benchmark-based backend selection in this process.
+    If tuning_file is given, selections are read from and persisted to it.
+    '''
+    global AUTOTUNE, TUNING_FILE, _tuning
+    AUTOTUNE = enable
+    if tuning_file is not None:
+        TUNING_FILE = tuning_file
+        _tuning = None
+
+
+def _load_tuning():
+    global _tuning
+    if _tuning is None:
+        _tuning = {}
+        if TUNING_FILE and os.path.isfile(TUNING_FILE):
+            try:
+                with open(TUNING_FILE, 'r') as f:
+                    _tuning = json.load(f)
+            except (OSError, ValueError):
+                _tuning = {}
+    return _tuning
+
+
+def _save_tuning(key, backend):
+    # Merge with entries written by other processes in the meantime, then replace atomically.
+    if not TUNING_FILE:
+        return
+    try:
+        os.makedirs(os.path.dirname(TUNING_FILE) or '.', exist_ok=True)
+        saved = {}
+        if os.path.isfile(TUNING_FILE):
+            with open(TUNING_FILE, 'r') as f:
+                saved = json.load(f)
+        saved[key] = backend
+        tmp_file = f'{TUNING_FILE}.{os.getpid()}.tmp'
+        with open(tmp_file, 'w') as f:
+            json.dump(saved, f, indent=2, sort_keys=True)
+        os.replace(tmp_file, TUNING_FILE)
+    except (OSError, ValueError):
+        pass
+
+
+def _tuning_key(img, filt, axes, decimate=False):
+    kind = 'box' if np.all(filt == filt[0]) else 'gen'
+    axes = tuple(sorted(ax % img.ndim for ax in axes))
+    key = f'k{len(filt)}_{kind}_{"x".join(map(str, img.shape))}_{img.dtype}_axes{"".join(map(str, axes))}_threads{NUM_THREADS}'
+    return key + '_dec' if decimate else key
+
+
+def _benchmark(img, filt, axes, candidates, decimate=False, repeats=3):
+    ref = _run('direct', img, filt, axes, decimate)
+    tol = 1e-6 * (np.max(np.abs(ref)) + 1e-12) if img.dtype == np.float32 else 1e-10 * (np.max(np.abs(ref)) + 1e-12)
+    timings = {}
+    for backend in candidates:
+        try:
+            out = _run(backend, img, filt, axes, decimate)
+            if out.shape != ref.shape or np.max(np.abs(out - ref)) > tol:
+                continue
+            times = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                _run(backend, img, filt, axes, decimate)
+                times.append(time.perf_counter() - start)
+            timings[backend] = np.median(times)
+        except Exception:
+            continue
+    return min(timings, key=timings.get) if timings else 'direct'
+
+
+def select_backend(img, filt, axes=(-2, -1), decimate=False):
+    candidates = _candidate_backends(img, filt, axes)
+    if len(candidates) == 1 or not AUTOTUNE:
+        return 'direct'
+    tuning = _load_tuning()
+    key = _tuning_key(img, filt, axes, decimate)
+    backend = tuning.get(key)
+    if backend not in candidates:
+        backend = _benchmark(img, filt, axes, candidates, decimate)
+        tuning[key] = backend
+        _save_tuning(key, backend)
+    return backend
+
+
+def filter1d(img, filt, axis=-1, backend=None):
+    '''
+    Equivalent to scipy.ndimage.convolve1d(img, filt, axis=axis) (mode='reflect'), using the fastest backend.
+    '''
+    filt = np.asarray(filt, dtype='float64')
+    if backend is None:
+        backend = select_backend(img, filt, (axis,))
+    return _run(backend, img, filt, (axis,))
+
+
+def sep_filter(img, filt, axes=(-2, -1), backend=None, decimate=False, out=None):
+    '''
+    Filters img separably along each of the given axes (by default, the last two) using the same 1D kernel.
+    If decimate is True, the result is decimated by 2 along the last two axes, i.e., sep_filter(img, filt)[..., ::2, ::2].
+    If out is given, the result is written into it.
+    '''
+    filt = np.asarray(filt, dtype='float64')
+    if decimate and not _is_last_two(img, axes):
+        raise ValueError('Decimation is only supported when filtering along the last two axes')
+    if backend is None:
+        backend = select_backend(img, filt, axes, decimate)
+    if backend in SEP_BACKENDS and out is not None:
+        return SEP_BACKENDS[backend](img, filt, decimate=decimate, out=out)
+    img_filtered = _run(backend, img, filt, axes, decimate)
+    if out is None:
+        return img_filtered
+    out[...] = img_filtered
+    return out
+
+
+def gaussian_kernel(sigma, truncate=4.0):
+    # Same kernel as scipy.ndimage.gaussian_filter
+    radius = int(truncate * float(sigma) + 0.5)
+    x = np.arange(-radius, radius+1)
+    phi_x = np.exp(-0.5 / (sigma * sigma) * x ** 2)
+    return phi_x / phi_x.sum()
+
+
+def gaussian_filter(img, sigma, truncate=4.0):
+    '''
+    Equivalent to scipy.ndimage.gaussian_filter(img, sigma, truncate=truncate) for 2D images.
+    '''
+    return sep_filter(img, gaussian_kernel(sigma, truncate), axes=(-2, -1))
+
+
+# Fixed-point separable filtering. Kernels are quantized to integers that sum to exactly 1 << COEFF_BITS, so that
+# integer images are filtered without rounding using int64 accumulators, and constant images are filtered exactly.
+COEFF_BITS = 16
+
+
+def quantize_kernel(filt, bits=COEFF_BITS):
+    '''
+    Rounds a kernel that sums to 1 to integer coefficients that sum to 1 << bits.
+    The rounding residual is assigned to the central tap, which preserves symmetry.
+    '''
+    qfilt = np.rint(np.asarray(filt, dtype='float64') * (1 << bits)).astype('int64')
+    qfilt[len(qfilt) >> 1] += (1 << bits) - qfilt.sum()
+    return qfilt
+
+
+def quantization_error_bound(filt, qfilt, bits=COEFF_BITS):
+    '''
+    L1 norm of the difference between the 2D kernels of filt and qfilt. The error of int_sep_filter with respect to
+    sep_filter, after scaling by 4^-bits, is at most this bound times the maximum absolute value of the image.
+    '''
+    filt = np.asarray(filt, dtype='float64')
+    qfilt = np.asarray(qfilt, dtype='float64') / (1 << bits)
+    return np.abs(np.outer(filt, filt) - np.outer(qfilt, qfilt)).sum()
+
+
+def _int_taps(x_pad, qfilt, n_out, axis, step):
+    # out[i] = sum_j qfilt[j] * x_pad[step*i + 2r - j] along axis, accumulated in int64
+    r = len(qfilt) >> 1
+    sl = [slice(None)]*x_pad.ndim
+    out = None
+    for j, q in enumerate(qfilt):
+        sl[axis] = slice(2*r - j, 2*r - j + step*(n_out - 1) + 1, step)
+        if out is None:
+            out = x_pad[tuple(sl)] * q
+        else:
+            out += x_pad[tuple(sl)] * q
+    return out
+
+
+def int_sep_filter(img, qfilt, decimate=False):
+    '''
+    Integer counterpart of sep_filter along the last two axes, for integer images and kernels from quantize_kernel.
+    Returns the exact int64 result of filtering with the integer coefficients, i.e., 4^bits times the result of
+    filtering with the quantized kernel. If decimate is True, only every other row and column is computed.
+    '''
+    step = 2 if decimate else 1
+    if numba_utils.ENABLED:
+        return numba_utils.int_sep_filter(img, qfilt, step)
+    qfilt = np.asarray(qfilt, dtype='int64')
+    r = len(qfilt) >> 1
+    h, w = img.shape[-2:]
+    img = _pad_axis(img.astype('int64'), r, img.ndim-2)
+    img = _int_taps(img, qfilt, (h + step - 1) // step, img.ndim-2, step)
+    img = _pad_axis(img, r, img.ndim-1)
+    return _int_taps(img, qfilt, (w + step - 1) // step, img.ndim-1, step)
@@ -1,15 +1,19 @@
 import numpy as np
-from .vif_utils import integral_image
+from .vif_utils import integral_image, pad_2d
+from . import numba_utils
 
 
-def integral_image_sums(x, k, stride=1):
-    x_pad = np.pad(x, int((k - stride)/2), mode='reflect')
+def integral_image_sums(x, k, stride=1, mode='reflect'):
+    # mode is the padding mode of np.pad. Use 'constant' for zero padding.
+    x_pad = pad_2d(x, int((k - stride)/2), mode=mode)
     int_x = integral_image(x_pad)
-    ret = (int_x[:-k:stride, :-k:stride] - int_x[:-k:stride, k::stride] - int_x[k::stride, :-k:stride] + int_x[k::stride, k::stride])
+    ret = (int_x[..., :-k:stride, :-k:stride] - int_x[..., :-k:stride, k::stride] - int_x[..., k::stride, :-k:stride] + int_x[..., k::stride, k::stride])
     return ret
 
 
 def dlm_decouple(level_ref, level_dist):
+    if numba_utils.ENABLED:
+        return numba_utils.dlm_decouple(level_ref, level_dist)
     eps = 1e-30
     psi_ref = np.arctan(level_ref[1] / (level_ref[0] + eps)) + np.pi*(level_ref[0] <= 0)
     psi_dist = np.arctan(level_dist[1] / (level_dist[0] + eps)) + np.pi*(level_dist[0] <= 0)
@@ -31,6 +35,8 @@ def dlm_decouple(level_ref, level_dist):
 
 # Masks level_2 using level_1
 def dlm_contrast_mask_one_way(level_1, level_2):
+    if numba_utils.ENABLED:
+        return numba_utils.dlm_contrast_mask_one_way(level_1, level_2)
     masking_threshold = 0
     for subband in level_1:
         masking_signal = np.abs(subband)
@@ -1,6 +1,6 @@
 import numpy as np
-from scipy.ndimage import convolve1d
 from .csf_utils import csf_dict, ngan, nadenau, mannos
+from . import conv_utils
 from pywt import wavedec2, waverec2
 
 
@@ -71,11 +71,12 @@ def filter_img(img, filter_key, wavelet=None, channel=0, **kwargs):
         else:
             filt = filt_funct(d2h)
 
-        img_filtered = convolve1d(img, filt, axis=0)
+        # Filter along the spatial axes, so that stacks of frames of shape (K, H, W) are supported
+        img_filtered = conv_utils.filter1d(img, filt, axis=-2)
         if 'clipped' in filter_key:
             img_filtered = np.clip(img_filtered, 0, None)
 
-        img_filtered = convolve1d(img_filtered, filt, axis=1)
+        img_filtered = conv_utils.filter1d(img_filtered, filt, axis=-1)
         if 'clipped' in filter_key:
             img_filtered = np.clip(img_filtered, 0, None)
 
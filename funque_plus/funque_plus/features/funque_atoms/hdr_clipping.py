@@ -2,6 +2,7 @@
 # Detects luminance saturation ("clipping") in HDR (PQ) or SDR frames.
 # ------------------------------------------------------------
 from __future__ import annotations
+import csv
 import numpy as np
 import cv2
 from typing import Dict, List
@@ -12,21 +13,240 @@ C2 = 2413.0 / 128.0
 C3 = 2392.0 / 128.0
 M1 = 2610.0 / 16384.0
 M2 = 2523.0 / 32.0
+PQ_PEAK_NITS = 10000.0  # pq_eotf returns luminance relative to this peak
 
 
 def pq_eotf(v_norm: np.ndarray) -> np.ndarray:
-    """Convert PQ (ST-2084) normalized code values [0,1] → absolute luminance (nits)."""
+    """Convert PQ (ST-2084) normalized code values [0,1] → linear luminance relative to PQ_PEAK_NITS."""
     V = np.clip(v_norm, 0.0, 1.0).astype(np.float32)
     V_m1 = np.power(V, 1.0 / M2)
     num = np.maximum(V_m1 - C1, 0.0)
     den = C2 - C3 * V_m1
     L = np.power(num / np.maximum(den, 1e-9), 1.0 / M1)
-    return L  # in nits
+    return L  # multiply by PQ_PEAK_NITS for nits
+
+
+# HLG (ARIB STD-B67 / BT.2100) constants
+HLG_A = 0.17883277
+HLG_B = 1.0 - 4.0 * HLG_A
+HLG_C = 0.5 - HLG_A * np.log(4.0 * HLG_A)
+
+
+def hlg_eotf(v_norm: np.ndarray, peak_nits: float = 1000.0) -> np.ndarray:
+    """Convert HLG normalized code values [0,1] → display luminance relative to PQ_PEAK_NITS, as returned by pq_eotf.
+    The BT.2100 OOTF is applied to the signal as if it were luminance, with the system gamma of peak_nits."""
+    V = np.clip(v_norm, 0.0, 1.0).astype(np.float32)
+    E = np.where(V <= 0.5, V * V / 3.0, (np.exp((V - HLG_C) / HLG_A) + HLG_B) / 12.0)
+    gamma = 1.2 + 0.42 * np.log10(peak_nits / 1000.0)
+    return (peak_nits / PQ_PEAK_NITS * np.power(E, gamma)).astype(np.float32)
+
+
+# ------------------------------------------------------------
+# Code-value lookup tables
+# ------------------------------------------------------------
+# Integer code values have only 2^bit_depth distinct values, so the EOTF is evaluated once per code and
+# frames are mapped with np.take. Tables are built from the same float32 normalization (code / max_code)
+# used by the readers, so table lookups are bitwise equal to evaluating the EOTF on normalized frames.
+_eotf_tables = {}
+
+
+def eotf_table(transfer: str = "pq", bit_depth: int = 10, peak_nits: float = 1000.0) -> np.ndarray:
+    """Cached table of the luminance of each full-range code value, relative to PQ_PEAK_NITS,
+    for transfer 'pq' or 'hlg'. peak_nits is only used by HLG. Tables are read-only."""
+    key = (transfer, bit_depth, peak_nits if transfer == "hlg" else None)
+    if key not in _eotf_tables:
+        v_norm = np.arange(1 << bit_depth, dtype=np.float32) / float((1 << bit_depth) - 1)
+        if transfer == "pq":
+            table = pq_eotf(v_norm)
+        elif transfer == "hlg":
+            table = hlg_eotf(v_norm, peak_nits)
+        else:
+            raise ValueError(f"Unsupported transfer {transfer}")
+        table = np.ascontiguousarray(table, dtype=np.float32)
+        table.flags.writeable = False
+        _eotf_tables[key] = table
+    return _eotf_tables[key]
+
+
+def codes_to_luminance(codes: np.ndarray, transfer: str = "pq", bit_depth: int = 10, peak_nits: float = 1000.0) -> np.ndarray:
+    """Map integer code values to luminance relative to PQ_PEAK_NITS using eotf_table. Out-of-range codes are clipped."""
+    return np.take(eotf_table(transfer, bit_depth, peak_nits), codes, mode="clip")
+
+
+# ------------------------------------------------------------
+# Percentiles
+# ------------------------------------------------------------
+# Follow np.percentile's default 'linear' method exactly: the two order statistics around the virtual index
+# (n - 1) * q / 100 are interpolated using numpy's lerp, which switches form at gamma = 0.5.
+def _percentile_index(n: int, q: float):
+    virtual = (n - 1) * (q / 100.0)
+    lo = int(np.floor(virtual))
+    return lo, min(lo + 1, n - 1), virtual - lo
+
+
+def _lerp(lo, hi, gamma: float):
+    diff = hi - lo
+    return hi - diff * (1 - gamma) if gamma >= 0.5 else lo + diff * gamma
+
+
+def code_histogram(codes: np.ndarray, bit_depth: int = 10) -> np.ndarray:
+    """Histogram of integer code values with one bin per code. Out-of-range codes are counted in the last bin,
+    matching codes_to_luminance."""
+    n_codes = 1 << bit_depth
+    hist = np.bincount(codes.ravel(), minlength=n_codes)
+    if len(hist) > n_codes:
+        hist[n_codes - 1] += hist[n_codes:].sum()
+        hist = hist[:n_codes]
+    return hist
+
+
+def histogram_percentile(hist: np.ndarray, table: np.ndarray, q: float):
+    """Exact percentile of the values table[code] given a histogram of codes. table must be non-decreasing,
+    as EOTF tables are, so that the order of codes is the order of values. Equal to np.percentile(table[codes], q)."""
+    cum = np.cumsum(hist)
+    lo, hi, gamma = _percentile_index(int(cum[-1]), q)
+    code_lo, code_hi = np.searchsorted(cum, [lo, hi], side="right")
+    return _lerp(table[code_lo], table[code_hi], gamma)
+
+
+def partition_percentile(x: np.ndarray, q: float):
+    """Percentile of continuous values using a partial sort. Equal to np.percentile(x, q)."""
+    x = x.ravel()
+    lo, hi, gamma = _percentile_index(x.size, q)
+    part = np.partition(x, [lo, hi])
+    return _lerp(part[lo], part[hi], gamma)
 
 
 # ------------------------------------------------------------
 # Frame-level brightness clipping detector
 # ------------------------------------------------------------
+SOBEL_HALO = 1  # 3x3 Sobel
+# OpenCV filters rows in SIMD blocks with a scalar tail, which can round differently. Crops start at multiples of
+# SIMD_ALIGN columns and end either at a multiple of SIMD_ALIGN or at the frame edge, so that every column is
+# filtered by the same code path as in the full frame.
+SIMD_ALIGN = 16
+
+# Candidate tile screening. The 3x3 blur never exceeds the maximum of its neighbourhood (up to rounding, covered
+# by BLUR_MARGIN), so pixels of the closed mask lie within CLOSE_REACH pixels of a pixel of a candidate tile.
+# The blurred, closed mask of a crop is exact at pixels at least CLOSE_HALO pixels from the crop edge.
+CLIP_TILE = 64
+BLUR_MARGIN = 1e-6
+CLOSE_REACH = 2  # blur + dilation
+CLOSE_HALO = 3  # blur + dilation + erosion
+DENSE_TILE_RATIO = 0.25  # above this fraction of candidate tiles, the full frame is processed at once
+
+
+def _aligned_cols(x0: int, x1: int, W: int):
+    x0 = x0 - x0 % SIMD_ALIGN
+    x1 = x1 + (-x1) % SIMD_ALIGN
+    return x0, (x1 if x1 <= W - W % SIMD_ALIGN else W)
+
+
+def _tile_max(img: np.ndarray, tile: int) -> np.ndarray:
+    """Maximum of each tile x tile block of img. Partial tiles at the bottom and right edges are included."""
+    H, W = img.shape[:2]
+    nty, ntx = H // tile, W // tile
+    hb, wb = nty * tile, ntx * tile
+    out = np.empty((-(-H // tile), -(-W // tile)), dtype=img.dtype)
+    out[:nty, :ntx] = img[:hb, :wb].reshape(nty, tile, ntx, tile).max(axis=(1, 3))
+    if wb < W:
+        out[:nty, ntx] = img[:hb, wb:].reshape(nty, tile, W - wb).max(axis=(1, 2))
+    if hb < H:
+        out[nty, :ntx] = img[hb:, :wb].reshape(H - hb, ntx, tile).max(axis=(0, 2))
+        if wb < W:
+            out[nty, ntx] = img[hb:, wb:].max()
+    return out
+
+
+def _candidate_crops(candidates: np.ndarray, tile: int, H: int, W: int) -> List:
+    """Crops covering each 8-connected group of candidate tiles, with the context needed for exact results.
+    Each crop is returned with the mask of pixels within CLOSE_REACH of the group's tiles. Groups are at least
+    one tile apart, so these masks do not overlap and no clipped region spans two groups."""
+    n_groups, tile_labels, tile_stats, _ = cv2.connectedComponentsWithStats(candidates.astype(np.uint8), connectivity=8)
+    pad = CLOSE_REACH + CLOSE_HALO
+    reach_kernel = np.ones((2 * CLOSE_REACH + 1, 2 * CLOSE_REACH + 1), np.uint8)
+    crops = []
+    for g in range(1, n_groups):
+        tx, ty, tw, th = tile_stats[g, :4]
+        y0, y1 = max(ty * tile - pad, 0), min((ty + th) * tile + pad, H)
+        x0, x1 = _aligned_cols(max(tx * tile - pad, 0), min((tx + tw) * tile + pad, W), W)
+        own = (tile_labels == g)[np.ix_(np.arange(y0, y1) // tile, np.arange(x0, x1) // tile)]
+        own = cv2.dilate(own.astype(np.uint8), reach_kernel)
+        crops.append(((slice(y0, y1), slice(x0, x1)), own))
+    return crops
+
+
+def _region_gradients(y_blur: np.ndarray, region_stats: np.ndarray, grad_mag: np.ndarray) -> None:
+    """Write the Sobel gradient magnitude of y_blur into grad_mag inside the bounding boxes of the regions,
+    computing gradients only inside the boxes padded by SOBEL_HALO. Values equal the full-frame gradient."""
+    H, W = y_blur.shape[:2]
+    for x, y, w, h in region_stats[:, :4]:
+        y0, y1 = max(y - SOBEL_HALO, 0), min(y + h + SOBEL_HALO, H)
+        x0, x1 = _aligned_cols(max(x - SOBEL_HALO, 0), min(x + w + SOBEL_HALO, W), W)
+        box = y_blur[y0:y1, x0:x1]
+        gx = cv2.Sobel(box, cv2.CV_32F, 1, 0, ksize=3)
+        gy = cv2.Sobel(box, cv2.CV_32F, 0, 1, ksize=3)
+        # Only the unpadded box is written, since gradients in the halo see the box edge as a frame border
+        inner = (slice(y - y0, y - y0 + h), slice(x - x0, x - x0 + w))
+        grad_mag[y:y+h, x:x+w] = np.sqrt(gx[inner]**2 + gy[inner]**2)
+
+
+def _prepare_luma(frame_y: np.ndarray, is_hdr: bool, is_pq_10bit: bool, bit_depth: int):
+    """Returns the array used for tile screening, the conversion of its crops to working luma (None if it is
+    already working luma), the code histogram (integer PQ input only) and the 99.99th percentile of PQ luminance
+    (None on the SDR path)."""
+    is_codes = np.issubdtype(frame_y.dtype, np.integer)
+
+    # Convert HDR PQ to nits if needed. Integer codes are converted crop by crop, and screened as codes,
+    # since the conversion is monotonic.
+    if is_hdr and is_pq_10bit:
+        if is_codes:
+            luma_hist = code_histogram(frame_y, bit_depth)
+            y_peak = histogram_percentile(luma_hist, eotf_table("pq", bit_depth), 99.99)
+            return frame_y, lambda codes: codes_to_luminance(codes, "pq", bit_depth), luma_hist, y_peak
+        y_nits = pq_eotf(frame_y)
+        return y_nits, None, None, partition_percentile(y_nits, 99.99)
+
+    # SDR path (0–1 normalized)
+    if is_codes:
+        return frame_y, lambda codes: codes.astype(np.float32) / float((1 << bit_depth) - 1), None, None
+    return frame_y.astype(np.float32), None, None, None
+
+
+def _close_mask(y_blur: np.ndarray, thr_val) -> np.ndarray:
+    # Threshold near max
+    clip_mask = y_blur >= thr_val
+    return cv2.morphologyEx(clip_mask.astype(np.uint8), cv2.MORPH_CLOSE, np.ones((3, 3), np.uint8))
+
+
+def _clip_features(kept_areas: np.ndarray, interior_grad, total_px: int, luma_hist=None) -> Dict[str, float]:
+    # compute region stats. Kept components are still the connected components of the refined mask,
+    # so their stats from the labeling pass are used as is.
+    area_ratio = float(kept_areas.sum()) / float(total_px)
+    num_regions = len(kept_areas)
+    if num_regions > 0:
+        max_region_ratio = float(kept_areas.max() / total_px)
+    else:
+        max_region_ratio = 0.0
+
+    # gradient-based flatness
+    flatness = 1.0 / (1.0 + interior_grad * 500.0)
+
+    # fused severity metric
+    severity = 0.6 * area_ratio + 0.2 * max_region_ratio + 0.2 * flatness
+
+    feats = {
+        "clip_area_ratio": area_ratio,
+        "clip_num_regions": num_regions,
+        "clip_max_region_ratio": max_region_ratio,
+        "clip_flatness": flatness,
+        "clip_severity": severity,
+    }
+    if luma_hist is not None:
+        feats["clip_luma_hist"] = luma_hist
+    return feats
+
+
 def brightness_clipping_features(
     frame_y: np.ndarray,
     *,
@@ -36,75 +256,132 @@ def brightness_clipping_features(
     area_min_px=64,
     thr_norm=0.99,
     thr_nits_ratio=0.98,
+    bit_depth=10,
+    tile_size=CLIP_TILE,
 ) -> Dict[str, float]:
     """
     Detect highlight clipping in one frame.
     frame_y: luma array
       - PQ HDR (10-bit → normalized [0,1]) if is_hdr=True
       - or SDR [0,1] if is_hdr=False
+      - or integer code values of the given bit_depth, e.g. from a P010 reader
+    For integer PQ input, the clipping threshold is read from a code histogram, which is returned
+    as 'clip_luma_hist' for video-level statistics (see aggregate_luminance_percentiles).
+    Tiles of tile_size pixels whose maximum is below the threshold are skipped (tile_size=0 disables screening).
+    Features are identical either way.
     """
     H, W = frame_y.shape[:2]
+    y_screen, to_work, luma_hist, y_peak = _prepare_luma(frame_y, is_hdr, is_pq_10bit, bit_depth)
+    thr_val = thr_nits_ratio * y_peak if y_peak is not None else thr_norm
 
-    # Convert HDR PQ to nits if needed
-    if is_hdr and is_pq_10bit:
-        y_nits = pq_eotf(frame_y)
-        y_work = y_nits
-        thr_val = thr_nits_ratio * np.percentile(y_work, 99.99)
+    if tile_size:
+        tile_max = _tile_max(y_screen, tile_size)
+        candidates = (to_work(tile_max) if to_work else tile_max) >= thr_val - BLUR_MARGIN * abs(thr_val)
+    if not tile_size or candidates.mean() > DENSE_TILE_RATIO:
+        crops = [((slice(0, H), slice(0, W)), None)]
     else:
-        # SDR path (0–1 normalized)
-        y_work = frame_y.astype(np.float32)
-        thr_val = thr_norm
+        crops = _candidate_crops(candidates, tile_size, H, W)
 
-    # Gaussian blur to smooth small peaks
-    y_blur = cv2.GaussianBlur(y_work, (3, 3), 0)
+    clip_mask = np.zeros((H, W), dtype=bool)
+    grad_mag = np.zeros((H, W), dtype=np.float32)
+    kept_areas = [np.zeros((0,), dtype=np.int32)]
+    for crop, own in crops:
+        y_work = to_work(y_screen[crop]) if to_work else y_screen[crop]
 
-    # Threshold near max
-    clip_mask = y_blur >= thr_val
-    clip_mask = cv2.morphologyEx(clip_mask.astype(np.uint8), cv2.MORPH_CLOSE, np.ones((3, 3), np.uint8))
-
-    # Remove tiny blobs
-    nlabels, labels, stats, _ = cv2.connectedComponentsWithStats(clip_mask, connectivity=8)
-    refined = np.zeros_like(clip_mask)
-    for i in range(1, nlabels):
-        if stats[i, cv2.CC_STAT_AREA] >= area_min_px:
-            refined[labels == i] = 255
-    clip_mask = refined > 0
-
-    total_px = H * W
-    area_ratio = float(clip_mask.sum()) / float(total_px)
-
-    # compute region stats
-    nlabels, labels, stats, _ = cv2.connectedComponentsWithStats(clip_mask.astype(np.uint8), connectivity=8)
-    num_regions = nlabels - 1
-    if num_regions > 0:
-        max_region_ratio = float(stats[1:, cv2.CC_STAT_AREA].max() / total_px)
-    else:
-        max_region_ratio = 0.0
+        # Gaussian blur to smooth small peaks
+        y_blur = cv2.GaussianBlur(y_work, (3, 3), 0)
 
-    # gradient-based flatness
-    gx = cv2.Sobel(y_blur, cv2.CV_32F, 1, 0, ksize=3)
-    gy = cv2.Sobel(y_blur, cv2.CV_32F, 0, 1, ksize=3)
-    grad_mag = np.sqrt(gx**2 + gy**2)
-    interior_grad = grad_mag[clip_mask].mean() if clip_mask.any() else 0.0
-    flatness = 1.0 / (1.0 + interior_grad * 500.0)
+        crop_mask = _close_mask(y_blur, thr_val)
+        if own is not None:
+            crop_mask &= own
+
+        # Remove tiny blobs with a per-label keep table (label 0 is background)
+        nlabels, labels, stats, _ = cv2.connectedComponentsWithStats(crop_mask, connectivity=8)
+        keep = stats[:, cv2.CC_STAT_AREA] >= area_min_px
+        keep[0] = False
+        if keep.any():
+            clip_mask[crop] |= keep[labels]
+            kept_areas.append(stats[keep, cv2.CC_STAT_AREA])
+            _region_gradients(y_blur, stats[keep], grad_mag[crop])
+
+    # gradient-based flatness, with gradients computed only around the kept regions
+    kept_areas = np.concatenate(kept_areas)
+    interior_grad = grad_mag[clip_mask].mean() if len(kept_areas) > 0 else 0.0
+    return _clip_features(kept_areas, interior_grad, H * W, luma_hist)
 
-    # fused severity metric
-    severity = 0.6 * area_ratio + 0.2 * max_region_ratio + 0.2 * flatness
+
+def brightness_clipping_sweep(
+    frame_y: np.ndarray,
+    *,
+    is_hdr: bool = True,
+    is_pq_10bit: bool = True,
+    thr_norms=(0.99,),
+    thr_nits_ratios=(0.98,),
+    area_mins=(64,),
+    bit_depth=10,
+    tile_size=CLIP_TILE,
+) -> Dict[tuple, Dict[str, float]]:
+    """
+    brightness_clipping_features for every (thr_norm, thr_nits_ratio, area_min_px) in the grid of the given values,
+    keyed by that tuple. The blurred luma and its gradient are computed once per frame, each threshold is labeled
+    once, restricted to tiles whose blurred maximum reaches it, and each area minimum only changes the keep table.
+    Grid points differing only in the threshold unused by the path (thr_norm on the HDR path, thr_nits_ratio
+    on the SDR path) share their features.
+    """
+    H, W = frame_y.shape[:2]
+    y_screen, to_work, luma_hist, y_peak = _prepare_luma(frame_y, is_hdr, is_pq_10bit, bit_depth)
+    y_work = to_work(y_screen) if to_work else y_screen
+    y_blur = cv2.GaussianBlur(y_work, (3, 3), 0)
+    blur_max = _tile_max(y_blur, tile_size) if tile_size else None
+    grad_mag = None
+
+    thresholds = thr_nits_ratios if y_peak is not None else thr_norms
+    feats = {}
+    for thr in sorted(set(thresholds), reverse=True):
+        thr_val = thr * y_peak if y_peak is not None else thr
+        if tile_size and (blur_max >= thr_val).mean() <= DENSE_TILE_RATIO:
+            crops = _candidate_crops(blur_max >= thr_val, tile_size, H, W)
+        else:
+            crops = [((slice(0, H), slice(0, W)), None)]
+        labeled = []
+        for crop, own in crops:
+            crop_mask = _close_mask(y_blur[crop], thr_val)
+            if own is not None:
+                crop_mask &= own
+            nlabels, labels, stats, _ = cv2.connectedComponentsWithStats(crop_mask, connectivity=8)
+            labeled.append((crop, labels, stats[:, cv2.CC_STAT_AREA]))
+
+        for area_min_px in set(area_mins):
+            clip_mask = np.zeros((H, W), dtype=bool)
+            kept_areas = [np.zeros((0,), dtype=np.int32)]
+            for crop, labels, areas in labeled:
+                keep = areas >= area_min_px
+                keep[0] = False
+                if keep.any():
+                    clip_mask[crop] |= keep[labels]
+                    kept_areas.append(areas[keep])
+            kept_areas = np.concatenate(kept_areas)
+            if len(kept_areas) > 0:
+                if grad_mag is None:
+                    gx = cv2.Sobel(y_blur, cv2.CV_32F, 1, 0, ksize=3)
+                    gy = cv2.Sobel(y_blur, cv2.CV_32F, 0, 1, ksize=3)
+                    grad_mag = np.sqrt(gx**2 + gy**2)
+                interior_grad = grad_mag[clip_mask].mean()
+            else:
+                interior_grad = 0.0
+            feats[thr, area_min_px] = _clip_features(kept_areas, interior_grad, H * W, luma_hist)
 
     return {
-        "clip_area_ratio": area_ratio,
-        "clip_num_regions": num_regions,
-        "clip_max_region_ratio": max_region_ratio,
-        "clip_flatness": flatness,
-        "clip_severity": severity,
+        (thr_norm, thr_nits_ratio, area_min_px): dict(feats[thr_nits_ratio if y_peak is not None else thr_norm, area_min_px])
+        for thr_norm in thr_norms for thr_nits_ratio in thr_nits_ratios for area_min_px in area_mins
     }
 
 
 # ------------------------------------------------------------
 # Video-level aggregation (returns numeric array, not dict)
 # ------------------------------------------------------------
-def aggregate_brightness_clipping(per_frame):
-    if not per_frame:
+def _aggregate_columns(area: np.ndarray, sev: np.ndarray) -> Dict[str, float]:
+    if len(area) == 0:
         return {
             "clip_area_ratio_mean": 0.0,
             "clip_area_ratio_p95": 0.0,
@@ -113,8 +390,8 @@ def aggregate_brightness_clipping(per_frame):
             "clip_severity_p95": 0.0,
         }
 
-    area = np.array([f["clip_area_ratio"] for f in per_frame], dtype=np.float32)
-    sev = np.array([f["clip_severity"] for f in per_frame], dtype=np.float32)
+    area = area.astype(np.float32)
+    sev = sev.astype(np.float32)
     frames_over = float(np.mean(area > 1e-3))
 
     return {
@@ -126,6 +403,119 @@ def aggregate_brightness_clipping(per_frame):
     }
 
 
+def aggregate_brightness_clipping(per_frame):
+    area = np.array([f["clip_area_ratio"] for f in per_frame], dtype=np.float32)
+    sev = np.array([f["clip_severity"] for f in per_frame], dtype=np.float32)
+    return _aggregate_columns(area, sev)
+
+
+def _luminance_percentiles(hist, q, bit_depth) -> Dict[str, float]:
+    table = eotf_table("pq", bit_depth)
+    return {f"luma_p{p:g}": float(histogram_percentile(hist, table, p)) for p in q}
+
+
+def aggregate_luminance_percentiles(per_frame, q=(50.0, 99.0, 99.99), bit_depth=10) -> Dict[str, float]:
+    """Video-level PQ luminance percentiles (relative to PQ_PEAK_NITS) from the per-frame code histograms
+    ('clip_luma_hist'), without revisiting any frames. Frames without a histogram are skipped."""
+    hists = [f["clip_luma_hist"] for f in per_frame if "clip_luma_hist" in f]
+    if not hists:
+        return {}
+    return _luminance_percentiles(np.sum(hists, axis=0), q, bit_depth)
+
+
+# ------------------------------------------------------------
+# Columnar accumulation
+# ------------------------------------------------------------
+CLIP_FEATURE_KEYS = ("clip_area_ratio", "clip_num_regions", "clip_max_region_ratio", "clip_flatness", "clip_severity")
+AGGREGATE_KEYS = ("clip_area_ratio", "clip_severity")  # per-frame columns needed by the aggregates
+
+
+class ClipFeatureAccumulator:
+    """
+    Per-frame clipping features stored as columns (in CLIP_FEATURE_KEYS order) of a growable float64 array,
+    with code histograms summed as frames arrive. If stream_path is given, rows are written to that CSV file instead.
+    If rows are streamed or keep_per_frame is False, only the AGGREGATE_KEYS columns (two floats per frame, needed for
+    the exact 95th percentiles) and the summed histogram are kept, so memory stays small for long videos.
+    aggregate() equals aggregate_brightness_clipping, and luminance_percentiles() equals aggregate_luminance_percentiles,
+    over the same frames.
+    """
+    def __init__(self, stream_path=None, keep_per_frame=True, capacity=256):
+        self.stream_path = stream_path
+        self.keep_per_frame = keep_per_frame and stream_path is None
+        self._keys = CLIP_FEATURE_KEYS if self.keep_per_frame else AGGREGATE_KEYS
+        self._cols = np.empty((capacity, len(self._keys)), dtype=np.float64)
+        self._n = 0
+        self.luma_hist = None
+        self._hists = [] if self.keep_per_frame else None  # per-frame histograms, returned by per_frame()
+        self._file = None
+        if stream_path is not None:
+            self._file = open(stream_path, "w", newline="")
+            self._writer = csv.writer(self._file)
+            self._writer.writerow(("frame",) + CLIP_FEATURE_KEYS)
+
+    def __len__(self):
+        return self._n
+
+    def append(self, feats: Dict[str, float], frame_ind: int) -> None:
+        luma_hists = feats["clip_luma_hist"][None] if "clip_luma_hist" in feats else None
+        self.append_rows(np.array([[feats[key] for key in CLIP_FEATURE_KEYS]], dtype=np.float64), [frame_ind], luma_hists)
+
+    def append_rows(self, rows: np.ndarray, frame_inds, luma_hists=None) -> None:
+        """Append rows of features in CLIP_FEATURE_KEYS order, with the indices of their frames in the video
+        (written to the CSV file) and their code histograms stacked along the first axis, if any."""
+        if self._file is not None:
+            for frame_ind, row in zip(frame_inds, rows.tolist()):
+                self._writer.writerow([int(frame_ind)] + row)
+        if not self.keep_per_frame:
+            rows = rows[:, [CLIP_FEATURE_KEYS.index(key) for key in AGGREGATE_KEYS]]
+        if self._n + len(rows) > len(self._cols):
+            cols = np.empty((max(2 * len(self._cols), self._n + len(rows)), len(self._keys)), dtype=np.float64)
+            cols[:self._n] = self._cols[:self._n]
+            self._cols = cols
+        self._cols[self._n:self._n + len(rows)] = rows
+        self._n += len(rows)
+        if luma_hists is not None:
+            hist = luma_hists.sum(axis=0)
+            self.luma_hist = hist if self.luma_hist is None else self.luma_hist + hist
+        if self._hists is not None:
+            self._hists.extend(luma_hists if luma_hists is not None else [None] * len(rows))
+
+    def column(self, key: str) -> np.ndarray:
+        return self._cols[:self._n, self._keys.index(key)]
+
+    def per_frame(self) -> List[Dict[str, float]]:
+        """Per-frame feature dicts, as returned by brightness_clipping_features. Only available when they are kept."""
+        if self.stream_path is not None:
+            raise ValueError("Per-frame features were streamed to " + str(self.stream_path))
+        if not self.keep_per_frame:
+            raise ValueError("Per-frame features were not kept")
+        per_frame = []
+        for row, hist in zip(self._cols[:self._n].tolist(), self._hists):
+            f = dict(zip(CLIP_FEATURE_KEYS, row[:1] + [int(row[1])] + row[2:]))
+            if hist is not None:
+                f["clip_luma_hist"] = hist
+            per_frame.append(f)
+        return per_frame
+
+    def aggregate(self) -> Dict[str, float]:
+        return _aggregate_columns(self.column("clip_area_ratio"), self.column("clip_severity"))
+
+    def luminance_percentiles(self, q=(50.0, 99.0, 99.99), bit_depth=10) -> Dict[str, float]:
+        if self.luma_hist is None:
+            return {}
+        return _luminance_percentiles(self.luma_hist, q, bit_depth)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
 
 # Optional feature names (for reference)
 FEATURE_NAMES = [
@@ -0,0 +1,306 @@
+# HDR Brightness Clipping Detector - video drivers
+# Reads luma from MP4 or raw YUV videos and runs the frame-level detector of hdr_clipping on sampled frames.
+# ------------------------------------------------------------
+import os
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+import cv2
+from . import numba_utils
+from .hdr_clipping import CLIP_FEATURE_KEYS, ClipFeatureAccumulator, brightness_clipping_features, brightness_clipping_sweep
+
+
+def _read_mp4_y_codes(path, stride=1):
+    """Read MP4 video frames and extract the 8-bit Y (luma) channel, sampling every stride frames."""
+    cap = cv2.VideoCapture(path)
+    if not cap.isOpened():
+        raise RuntimeError(f"OpenCV cannot open: {path}")
+
+    try:
+        idx = 0
+        while True:
+            ok, frame = cap.read()
+            if not ok:
+                break
+            if (idx % stride) == 0:
+                # BGR -> YUV, take Y channel
+                yield np.ascontiguousarray(cv2.cvtColor(frame, cv2.COLOR_BGR2YUV)[:, :, 0])
+            idx += 1
+    finally:
+        cap.release()
+
+
+def _read_mp4_y_frames(path, stride=1):
+    """Read MP4 video frames and extract Y (luma) channel in [0,1], sampling every stride frames."""
+    for Y in _read_mp4_y_codes(path, stride):
+        yield Y.astype(np.float32) / 255.0
+
+
+def _read_yuv420_8bit_luma(path, width, height, stride=1):
+    """Read 8-bit YUV420 video and extract Y (luma) plane, sampling every stride frames."""
+    frame_size_y = width * height
+    frame_size_uv = frame_size_y // 2  # U/2 + V/2 for 4:2:0
+    frame_size_total = frame_size_y + frame_size_uv
+    
+    with open(path, "rb") as f:
+        fi = 0
+        while True:
+            y = f.read(frame_size_y)
+            if len(y) < frame_size_y:
+                break
+            uv = f.read(frame_size_uv)
+            if len(uv) < frame_size_uv:
+                break
+            
+            if (fi % stride) == 0:
+                Y = np.frombuffer(y, dtype=np.uint8).reshape((height, width))
+                yield Y.astype(np.float32) / 255.0
+            fi += 1
+
+
+def _read_yuv420_p010_luma(path, width, height, stride=1):
+    """Read P010 (10-bit) YUV420 video and extract Y plane as uint16 code values, sampling every stride frames."""
+    # P010: 10-bit in 16-bit little-endian words. Luma plane first (width*height*2 bytes)
+    frame_size_y_bytes = width * height * 2
+    # UV plane also exists but we skip it (width*height*2 bytes for P010 4:2:0)
+    frame_size_uv_bytes = (width * height * 2) // 2
+    frame_size_total_bytes = frame_size_y_bytes + frame_size_uv_bytes
+    
+    with open(path, "rb") as f:
+        fi = 0
+        while True:
+            ybytes = f.read(frame_size_y_bytes)
+            if len(ybytes) < frame_size_y_bytes:
+                break
+            uvbytes = f.read(frame_size_uv_bytes)
+            if len(uvbytes) < frame_size_uv_bytes:
+                break
+            
+            if (fi % stride) == 0:
+                Yn = np.frombuffer(ybytes, dtype=np.uint16).reshape((height, width))
+                # 10-bit is in the most significant bits of the 16-bit word for P010.
+                # Codes are mapped to luminance by table lookup, so no float normalization is needed.
+                yield Yn >> 6  # keep top 10 bits
+            fi += 1
+
+def _input_format(path, input_type, width, height, treat_mp4_as_hdr, is_pq_10bit):
+    """Resolve input_type for path. Returns (input_type, is_hdr, pq_10)."""
+    ext = os.path.splitext(path)[1].lower()
+    if input_type == "auto":
+        if ext in (".mp4", ".mov", ".mkv"):
+            input_type = "mp4"
+        elif ext == ".yuv":
+            # you must also set width/height and know 8-bit vs P010
+            raise ValueError("For .yuv, set input_type='yuv8' or 'p010' and provide width/height.")
+        else:
+            raise ValueError(f"Unknown extension {ext}; set input_type explicitly.")
+
+    if input_type == "mp4":
+        is_hdr = bool(treat_mp4_as_hdr)  # usually False for OpenCV
+        pq_10 = False
+    elif input_type == "yuv8":
+        if not width or not height:
+            raise ValueError("yuv8 requires width and height.")
+        is_hdr = bool(is_pq_10bit)      # if your Y plane actually contains PQ codes (rare for yuv8)
+        pq_10 = bool(is_pq_10bit)
+    elif input_type == "p010":
+        if not width or not height:
+            raise ValueError("p010 requires width and height.")
+        is_hdr = True                   # P010 commonly used for HDR10 PQ content
+        pq_10 = True
+    else:
+        raise ValueError(f"Unsupported input_type {input_type}")
+    return input_type, is_hdr, pq_10
+
+
+def _open_luma_frames(path, input_type, width, height, frame_stride, treat_mp4_as_hdr, is_pq_10bit):
+    """Pick the reader for path. Returns (frames, is_hdr, pq_10)."""
+    input_type, is_hdr, pq_10 = _input_format(path, input_type, width, height, treat_mp4_as_hdr, is_pq_10bit)
+    if input_type == "mp4":
+        frames = _read_mp4_y_frames(path, stride=frame_stride)
+    elif input_type == "yuv8":
+        frames = _read_yuv420_8bit_luma(path, width, height, stride=frame_stride)
+    else:
+        frames = _read_yuv420_p010_luma(path, width, height, stride=frame_stride)
+    return frames, is_hdr, pq_10
+
+
+# ------------------------------------------------------------
+# Frame-parallel detection
+# ------------------------------------------------------------
+# Workers return compact rows (features in CLIP_FEATURE_KEYS order, plus their stacked luma histograms if any),
+# which are appended to the accumulator in frame order.
+MP4_CHUNK_FRAMES = 8
+
+
+def _init_worker():
+    # Frames are already processed in parallel, so OpenCV's and Numba's own threads would oversubscribe the cores
+    cv2.setNumThreads(1)
+    if numba_utils.ENABLED:
+        numba_utils.numba.set_num_threads(1)
+
+
+def _yuv_frame_bytes(input_type, width, height):
+    return width * height * (2 if input_type == "p010" else 1) * 3 // 2
+
+
+def _read_yuv420_luma_at(f, frame_ind, input_type, width, height):
+    """Random access to the Y plane of one frame, as returned by the sequential yuv8/p010 readers."""
+    f.seek(frame_ind * _yuv_frame_bytes(input_type, width, height))
+    if input_type == "p010":
+        Yn = np.frombuffer(f.read(width * height * 2), dtype=np.uint16).reshape((height, width))
+        return Yn >> 6
+    Y = np.frombuffer(f.read(width * height), dtype=np.uint8).reshape((height, width))
+    return Y.astype(np.float32) / 255.0
+
+
+def _feature_rows(frames, feat_kwargs):
+    rows, luma_hists = [], []
+    for Y in frames:
+        f = brightness_clipping_features(Y, **feat_kwargs)
+        rows.append([f[key] for key in CLIP_FEATURE_KEYS])
+        if "clip_luma_hist" in f:
+            luma_hists.append(f["clip_luma_hist"])
+    return np.array(rows, dtype=np.float64).reshape(-1, len(CLIP_FEATURE_KEYS)), np.stack(luma_hists) if luma_hists else None
+
+
+def _yuv_rows(frame_inds, path, input_type, width, height, feat_kwargs):
+    with open(path, "rb") as f:
+        frames = (_read_yuv420_luma_at(f, frame_ind, input_type, width, height) for frame_ind in frame_inds)
+        return _feature_rows(frames, feat_kwargs)
+
+
+def _mp4_rows(codes, feat_kwargs):
+    return _feature_rows((Y.astype(np.float32) / 255.0 for Y in codes), feat_kwargs)
+
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _mp4_tasks(path, frame_stride):
+    for chunk in _chunks(enumerate(_read_mp4_y_codes(path, stride=frame_stride)), MP4_CHUNK_FRAMES):
+        yield [frame_stride * k for k, _ in chunk], [Y for _, Y in chunk]
+
+
+def _detect_parallel(acc, path, input_type, width, height, frame_stride, workers, feat_kwargs):
+    """Per-frame features computed by a pool of workers and appended to acc. Raw YUV frames are read by random access and split into
+    chunks of frame indices. MP4 cannot be seeked frame-accurately, so it is decoded here and chunks of 8-bit luma are sent to workers."""
+    if input_type == "mp4":
+        tasks = _mp4_tasks(path, frame_stride)
+        funct = partial(_mp4_rows, feat_kwargs=feat_kwargs)
+    else:
+        n_frames = os.path.getsize(path) // _yuv_frame_bytes(input_type, width, height)
+        frame_inds = np.arange(0, n_frames, frame_stride)
+        tasks = [(chunk, chunk) for chunk in np.array_split(frame_inds, 4 * workers) if len(chunk)]
+        funct = partial(_yuv_rows, path=path, input_type=input_type, width=width, height=height, feat_kwargs=feat_kwargs)
+
+    # Workers are spawned, since forking a process whose Numba (TBB) or OpenCV thread pools have started can hang.
+    # As with any spawned pool, scripts calling this must guard their entry point with if __name__ == "__main__".
+    # At most 2 tasks per worker are in flight, which bounds the memory held by decoded MP4 frames.
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker) as pool:
+        pending = deque()
+        for frame_inds, task in tasks:
+            pending.append((frame_inds, pool.submit(funct, task)))
+            if len(pending) >= 2 * workers:
+                frame_inds, future = pending.popleft()
+                rows, luma_hists = future.result()
+                acc.append_rows(rows, frame_inds, luma_hists)
+        while pending:
+            frame_inds, future = pending.popleft()
+            rows, luma_hists = future.result()
+            acc.append_rows(rows, frame_inds, luma_hists)
+
+
+def detect_brightness_clipping_video(
+    path,
+    *,
+    input_type="auto",      # "auto", "mp4", "yuv8", "p010"
+    width=None,
+    height=None,
+    frame_stride=2,         # sample every Nth frame
+    treat_mp4_as_hdr=False, # OpenCV is usually tone-mapped SDR -> keep False
+    is_pq_10bit=False,      # True only if you feed PQ codes (P010 or PQ-10bit Y)
+    area_min_px=64,
+    thr_norm=0.96,          # a bit looser than 0.99 for SDR/tone-mapped
+    thr_nits_ratio=0.96,
+    peak_nits=None,
+    workers=1,              # >1 distributes frames over a process pool
+    per_frame_path=None,    # stream per-frame rows to this CSV file instead of returning them
+    keep_per_frame=True,    # False returns only the aggregates, keeping two floats per frame
+):
+    with ClipFeatureAccumulator(per_frame_path, keep_per_frame) as acc:
+        if workers > 1:
+            input_type, is_hdr, pq_10 = _input_format(path, input_type, width, height, treat_mp4_as_hdr, is_pq_10bit)
+            feat_kwargs = dict(
+                is_hdr=is_hdr,
+                is_pq_10bit=pq_10,
+                peak_nits=peak_nits,
+                area_min_px=area_min_px,
+                thr_norm=thr_norm,
+                thr_nits_ratio=thr_nits_ratio,
+            )
+            _detect_parallel(acc, path, input_type, width, height, frame_stride, workers, feat_kwargs)
+        else:
+            frames, is_hdr, pq_10 = _open_luma_frames(path, input_type, width, height, frame_stride, treat_mp4_as_hdr, is_pq_10bit)
+
+            # Readers yield every frame_stride-th frame, starting from the first
+            for k, Y in enumerate(frames):
+                f = brightness_clipping_features(
+                    Y,
+                    is_hdr=is_hdr,
+                    is_pq_10bit=pq_10,
+                    peak_nits=peak_nits,
+                    area_min_px=area_min_px,
+                    thr_norm=thr_norm,
+                    thr_nits_ratio=thr_nits_ratio,
+                )
+                acc.append(f, frame_stride * k)
+
+    # Video-level PQ luminance percentiles are only available for integer PQ input (see aggregate_luminance_percentiles)
+    per_frame = acc.per_frame() if acc.keep_per_frame else None
+    return {"per_frame": per_frame, "aggregate": acc.aggregate(), "luma_percentiles": acc.luminance_percentiles()}
+
+
+def sweep_brightness_clipping_video(
+    path,
+    *,
+    input_type="auto",
+    width=None,
+    height=None,
+    frame_stride=2,
+    treat_mp4_as_hdr=False,
+    is_pq_10bit=False,
+    area_mins=(64,),
+    thr_norms=(0.96,),
+    thr_nits_ratios=(0.96,),
+):
+    """Aggregate clipping features of detect_brightness_clipping_video for every (thr_norm, thr_nits_ratio, area_min_px)
+    in the grid of the given values, decoding the video once. Returns a dict from grid points to aggregates."""
+    frames, is_hdr, pq_10 = _open_luma_frames(path, input_type, width, height, frame_stride, treat_mp4_as_hdr, is_pq_10bit)
+
+    accs = {}
+    for k, Y in enumerate(frames):
+        sweep = brightness_clipping_sweep(
+            Y,
+            is_hdr=is_hdr,
+            is_pq_10bit=pq_10,
+            thr_norms=thr_norms,
+            thr_nits_ratios=thr_nits_ratios,
+            area_mins=area_mins,
+        )
+        for grid_point, f in sweep.items():
+            accs.setdefault(grid_point, ClipFeatureAccumulator(keep_per_frame=False)).append(f, frame_stride * k)
+
+    return {grid_point: acc.aggregate() for grid_point, acc in accs.items()}
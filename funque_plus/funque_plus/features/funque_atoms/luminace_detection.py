@@ -6,12 +6,15 @@ import sys
 import csv
 
 
-# Add the parent folder (so imports work)
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../../..")))
+# Add the project root (so imports work), and import the package as funque_plus like the extractors do
+root_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../.."))
+sys.path.append(root_dir)
 
 
-from funque_plus.datasets.HDR_VDC_dataset import dis_videos
-from funque_plus.funque_plus.features.funque_atoms.hdr_clip_test import detect_brightness_clipping_video
+from qualitylib.tools import import_python_file
+from funque_plus.features.funque_atoms.hdr_clipping_video import detect_brightness_clipping_video
+
+dis_videos = import_python_file(os.path.join(root_dir, "datasets", "HDR-VDC_dataset.py")).dis_videos
 
 
 # Output paths
@@ -41,6 +44,7 @@ for idx, video_info in dis_videos.items():
            height=1080,
            frame_stride=1,
            is_pq_10bit=True,
+           keep_per_frame=False,
        )
 
 
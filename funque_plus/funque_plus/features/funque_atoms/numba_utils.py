@@ -0,0 +1,266 @@
+import os
+import numpy as np
+
+# Optional Numba backend for the hottest per-pixel kernels.
+# Enabled automatically when numba is importable, unless FUNQUE_DISABLE_NUMBA is set.
+try:
+    if os.environ.get('FUNQUE_DISABLE_NUMBA', '0') not in ('', '0'):
+        raise ImportError('Numba backend disabled by FUNQUE_DISABLE_NUMBA')
+    import numba
+    from numba import prange
+except ImportError:
+    numba = None
+    prange = range
+
+ENABLED = numba is not None
+
+# Compiled kernels are only cached on disk if FUNQUE_NUMBA_CACHE_DIR is set.
+CACHE_DIR = os.environ.get('FUNQUE_NUMBA_CACHE_DIR', '')
+
+
+def _njit(funct, **kwargs):
+    # error_model='numpy' so that divisions by zero follow NumPy semantics (inf/nan) instead of raising.
+    if not CACHE_DIR:
+        return numba.njit(error_model='numpy', **kwargs)(funct)
+    # Cached kernels refer to this module by name, so each import root of the package
+    # (e.g., funque_plus.features and funque_plus.funque_plus.features) gets its own cache directory.
+    # Numba resolves the cache directory when the kernel is decorated.
+    default_dir = numba.config.CACHE_DIR
+    numba.config.CACHE_DIR = os.path.join(CACHE_DIR, __name__)
+    try:
+        return numba.njit(cache=True, error_model='numpy', **kwargs)(funct)
+    finally:
+        numba.config.CACHE_DIR = default_dir
+
+
+def _jit(funct):
+    if numba is None:
+        return funct
+    return _njit(funct, parallel=True)
+
+
+def _jit_helper(funct):
+    if numba is None:
+        return funct
+    return _njit(funct)
+
+
+def _as_stack(x):
+    # Kernels operate on stacks of bands of shape (n, H, W)
+    return np.ascontiguousarray(x, dtype='float64').reshape((-1,) + x.shape[-2:])
+
+
+@_jit
+def _vif_pool_kernel(var_x, var_y, cov_xy, sigma_nsq, nums, dens):
+    n, h, w = var_x.shape
+    for r in prange(n*h):
+        b = r // h
+        i = r % h
+        num = 0.0
+        den = 0.0
+        for j in range(w):
+            vx = var_x[b, i, j]
+            vy = var_y[b, i, j]
+            cxy = cov_xy[b, i, j]
+            g = cxy / (vx + 1e-10)
+            sv_sq = vy - g * cxy
+            if vx < 1e-10:
+                g = 0.0
+                sv_sq = vy
+                vx = 0.0
+            if vy < 1e-10:
+                g = 0.0
+                sv_sq = 0.0
+            if g < 0:
+                sv_sq = vx
+                g = 0.0
+            if sv_sq < 1e-10:
+                sv_sq = 1e-10
+            num += np.log(1 + g*g * vx / (sv_sq + sigma_nsq)) + 1e-4
+            den += np.log(1 + vx / sigma_nsq) + 1e-4
+        nums[b, i] = num
+        dens[b, i] = den
+
+
+def vif_pool(var_x, var_y, cov_xy, sigma_nsq):
+    '''
+    Fused VIF masking, clamping and pooling. Returns the (numerator, denominator) sums
+    over the last two axes, i.e., scalars for 2D inputs and arrays for stacks of bands.
+    '''
+    lead_shape = var_x.shape[:-2]
+    var_x, var_y, cov_xy = [_as_stack(x) for x in (var_x, var_y, cov_xy)]
+    nums = np.empty(var_x.shape[:2])
+    dens = np.empty(var_x.shape[:2])
+    _vif_pool_kernel(var_x, var_y, cov_xy, float(sigma_nsq), nums, dens)
+    nums = nums.sum(-1).reshape(lead_shape)
+    dens = dens.sum(-1).reshape(lead_shape)
+    if not lead_shape:
+        return nums[()], dens[()]
+    return nums, dens
+
+
+@_jit
+def _dlm_decouple_kernel(r0, r1, r2, d0, d1, d2, rest0, rest1, rest2, add0, add1, add2):
+    eps = 1e-30
+    n, h, w = r0.shape
+    for r in prange(n*h):
+        b = r // h
+        i = r % h
+        for j in range(w):
+            psi_ref = np.arctan(r1[b, i, j] / (r0[b, i, j] + eps)) + (np.pi if r0[b, i, j] <= 0 else 0.0)
+            psi_dist = np.arctan(d1[b, i, j] / (d0[b, i, j] + eps)) + (np.pi if d0[b, i, j] <= 0 else 0.0)
+            mask = 180*np.abs(psi_ref - psi_dist)/np.pi < 1
+
+            k = min(max(d0[b, i, j] / (r0[b, i, j] + eps), 0.0), 1.0)
+            rest0[b, i, j] = d0[b, i, j] if mask else k * r0[b, i, j]
+            add0[b, i, j] = d0[b, i, j] - rest0[b, i, j]
+
+            k = min(max(d1[b, i, j] / (r1[b, i, j] + eps), 0.0), 1.0)
+            rest1[b, i, j] = d1[b, i, j] if mask else k * r1[b, i, j]
+            add1[b, i, j] = d1[b, i, j] - rest1[b, i, j]
+
+            k = min(max(d2[b, i, j] / (r2[b, i, j] + eps), 0.0), 1.0)
+            rest2[b, i, j] = d2[b, i, j] if mask else k * r2[b, i, j]
+            add2[b, i, j] = d2[b, i, j] - rest2[b, i, j]
+
+
+def dlm_decouple(level_ref, level_dist):
+    shape = level_ref[0].shape
+    ref = [_as_stack(subband) for subband in level_ref]
+    dist = [_as_stack(subband) for subband in level_dist]
+    rest = [np.empty_like(subband) for subband in ref]
+    add = [np.empty_like(subband) for subband in ref]
+    _dlm_decouple_kernel(*ref, *dist, *rest, *add)
+    level_rest = tuple([subband.reshape(shape) for subband in rest])
+    level_add = tuple([subband.reshape(shape) for subband in add])
+    return level_rest, level_add
+
+
+@_jit_helper
+def _reflect_index(i, n):
+    # Index into a signal extended by 'reflect' padding (d c b | a b c d | c b a)
+    if i < 0:
+        return -i
+    if i >= n:
+        return 2*n - 2 - i
+    return i
+
+
+@_jit
+def _dlm_contrast_mask_kernel(m0, m1, m2, s0, s1, s2, out0, out1, out2):
+    n, h, w = m0.shape
+    for r in prange(n*h):
+        b = r // h
+        i = r % h
+        for j in range(w):
+            masking_threshold = 0.0
+            for m in (m0, m1, m2):
+                box_sum = 0.0
+                for di in range(-1, 2):
+                    ii = _reflect_index(i + di, h)
+                    for dj in range(-1, 2):
+                        box_sum += np.abs(m[b, ii, _reflect_index(j + dj, w)])
+                masking_threshold += (max(box_sum, 0.0) + np.abs(m[b, i, j])) / 30
+            out0[b, i, j] = max(np.abs(s0[b, i, j]) - masking_threshold, 0.0)
+            out1[b, i, j] = max(np.abs(s1[b, i, j]) - masking_threshold, 0.0)
+            out2[b, i, j] = max(np.abs(s2[b, i, j]) - masking_threshold, 0.0)
+
+
+# Masks level_2 using level_1
+def dlm_contrast_mask_one_way(level_1, level_2):
+    shape = level_2[0].shape
+    masking = [_as_stack(subband) for subband in level_1]
+    signal = [_as_stack(subband) for subband in level_2]
+    out = [np.empty_like(subband) for subband in signal]
+    _dlm_contrast_mask_kernel(*masking, *signal, *out)
+    return tuple([subband.reshape(shape) for subband in out])
+
+
+@_jit
+def _phase_congruency_kernel(eo, thresh, pc_sum, cutoff, g, eps):
+    nscale, _, n, h, w = eo.shape
+    for r in prange(n*h):
+        b = r // h
+        i = r % h
+        for j in range(w):
+            sum_e = 0.0
+            sum_o = 0.0
+            sum_an = 0.0
+            max_an = 0.0
+            for s in range(nscale):
+                e = eo[s, 0, b, i, j]
+                o = eo[s, 1, b, i, j]
+                an = np.sqrt(e*e + o*o)
+                sum_an += an
+                sum_e += e
+                sum_o += o
+                if s == 0 or an > max_an:
+                    max_an = an
+            x_energy = np.sqrt(sum_e*sum_e + sum_o*sum_o) + eps
+            mean_e = sum_e / x_energy
+            mean_o = sum_o / x_energy
+            energy = 0.0
+            for s in range(nscale):
+                e = eo[s, 0, b, i, j]
+                o = eo[s, 1, b, i, j]
+                energy += e*mean_e + o*mean_o - np.abs(e*mean_o - o*mean_e)
+            energy = max(energy - thresh[b], 0.0)
+            width = (sum_an / (max_an + eps) - 1) / (nscale - 1)
+            weight = 1 / (1 + np.exp(g * (cutoff - width)))
+            pc_sum[b, i, j] += weight * energy / sum_an
+
+
+def phase_congruency_orient(eo, thresh, pc_sum, cutoff, g, eps):
+    '''
+    Fused phase congruency of one orientation, accumulated into pc_sum of shape (n, H, W).
+    eo holds the even and odd filter responses of shape (nscale, 2, n, H, W), and thresh the noise threshold of each image.
+    '''
+    _phase_congruency_kernel(eo, np.ascontiguousarray(thresh, dtype='float64'), pc_sum, float(cutoff), float(g), float(eps))
+
+
+@_jit_helper
+def _symmetric_index(i, n):
+    # Index into a signal extended by half-sample symmetric padding (b a | a b c d | d c), i.e., ndimage's 'reflect'
+    if i < 0:
+        return -i - 1
+    if i >= n:
+        return 2*n - 1 - i
+    return i
+
+
+@_jit
+def _int_sep_filter_kernel(x, q, step, out):
+    n, h, w = x.shape
+    _, ho, wo = out.shape
+    r = len(q) >> 1
+    for row in prange(n*ho):
+        b = row // ho
+        i = row % ho
+        col_sums = np.zeros(w, dtype=np.int64)
+        for t in range(len(q)):
+            ii = _symmetric_index(step*i + r - t, h)
+            for j in range(w):
+                col_sums[j] += q[t] * np.int64(x[b, ii, j])
+        for j in range(wo):
+            acc = np.int64(0)
+            c = step*j + r
+            if c - 2*r >= 0 and c < w:
+                for t in range(len(q)):
+                    acc += q[t] * col_sums[c - t]
+            else:
+                for t in range(len(q)):
+                    acc += q[t] * col_sums[_symmetric_index(c - t, w)]
+            out[b, i, j] = acc
+
+
+def int_sep_filter(img, qfilt, step):
+    '''
+    Exact integer separable convolution along the last two axes with 'reflect' boundaries, accumulated in int64.
+    Outputs are evaluated every step pixels along both axes.
+    '''
+    lead_shape = img.shape[:-2]
+    h, w = img.shape[-2:]
+    x = np.ascontiguousarray(img).reshape((-1, h, w))
+    out = np.empty((x.shape[0], (h + step - 1) // step, (w + step - 1) // step), dtype='int64')
+    _int_sep_filter_kernel(x, np.ascontiguousarray(qfilt, dtype='int64'), step, out)
+    return out.reshape(lead_shape + out.shape[-2:])
@@ -23,6 +23,56 @@ def custom_wavedec2(data, wavelet, mode='symmetric', level=None, axes=(-2, -1)):
     return (approxs, details)
 
 
+def haar_wavedec2_int(data, level):
+    '''
+    Integer Haar decomposition of integer images whose dimensions are divisible by 2^level, with the structure of
+    custom_wavedec2(data, 'haar', 'periodization', level). Subbands of level l are exact integers equal to 2^l times
+    the corresponding coefficients of custom_wavedec2. Code values of up to 16 bits and up to 5 levels fit in int32.
+    '''
+    approxs = []
+    details = []
+    data = np.asarray(data).astype('int32')
+    for _ in range(level):
+        sum_top = data[..., ::2, ::2] + data[..., ::2, 1::2]
+        diff_top = data[..., ::2, ::2] - data[..., ::2, 1::2]
+        sum_bottom = data[..., 1::2, ::2] + data[..., 1::2, 1::2]
+        diff_bottom = data[..., 1::2, ::2] - data[..., 1::2, 1::2]
+        data = sum_top + sum_bottom
+        approxs.append(data)
+        details.append((sum_top - sum_bottom, diff_top + diff_bottom, diff_top - diff_bottom))
+    return (approxs, details)
+
+
+def _haar_moments_int(pyr_ref, pyr_dist):
+    # Local means, variances and covariances of each level of integer Haar pyramids, as yielded by _ms_ssim_moments.
+    # Sums of squares are accumulated exactly in int64. After level l, they hold 4^l times the windowed sums
+    # of squared float coefficients, so 4^l times the mean over a 2^l x 2^l window is obtained by dividing by 16^l.
+    approxs_ref, details_ref = pyr_ref
+    approxs_dist, details_dist = pyr_dist
+    var_x = var_y = cov_xy = None
+    for lev, (approx_ref, approx_dist, detail_level_ref, detail_level_dist) in enumerate(zip(approxs_ref, approxs_dist, details_ref, details_dist)):
+        detail_level_ref = [subband.astype('int64') for subband in detail_level_ref]
+        detail_level_dist = [subband.astype('int64') for subband in detail_level_dist]
+        var_x_add = sum(subband*subband for subband in detail_level_ref)
+        var_y_add = sum(subband*subband for subband in detail_level_dist)
+        cov_xy_add = sum(subband_ref*subband_dist for subband_ref, subband_dist in zip(detail_level_ref, detail_level_dist))
+        if lev == 0:
+            var_x, var_y, cov_xy = var_x_add, var_y_add, cov_xy_add
+        else:
+            var_x = 4*block_sum_2x2(var_x) + var_x_add
+            var_y = 4*block_sum_2x2(var_y) + var_y_add
+            cov_xy = 4*block_sum_2x2(cov_xy) + cov_xy_add
+
+        mu_scale = 1.0 / (1 << (2*lev + 2))
+        var_scale = mu_scale * mu_scale
+        yield approx_ref * mu_scale, approx_dist * mu_scale, var_x * var_scale, var_y * var_scale, cov_xy * var_scale
+
+
+def block_sum_2x2(x):
+    # Sums of non-overlapping 2x2 blocks along the last two axes
+    return x[..., ::2, ::2] + x[..., ::2, 1::2] + x[..., 1::2, ::2] + x[..., 1::2, 1::2]
+
+
 def dlm_pyr(pyr_ref, pyr_dist, border_size=0.2, csf='li'):
     # Pyramids are assumed to have the structure
     # ([A1, ..., An], [(H1, V1, D1), ..., (Hn, Vn, Dn)])
@@ -47,18 +97,18 @@ def dlm_pyr(pyr_ref, pyr_dist, border_size=0.2, csf='li'):
     dlm_num = 0
     dlm_den = 0
     for level in pyr_rest:
-        h, w = level[0].shape
+        h, w = level[0].shape[-2:]
         border_h = int(border_size*h)
         border_w = int(border_size*w)
         for subband in level:
-            dlm_num += np.power(np.sum(np.power(subband[border_h:-border_h, border_w:-border_w], 3.0)), 1.0/3)
+            dlm_num += np.power(np.sum(np.power(subband[..., border_h:-border_h, border_w:-border_w], 3.0), axis=(-2, -1)), 1.0/3)
 
     for level in details_ref:
-        h, w = level[0].shape
+        h, w = level[0].shape[-2:]
         border_h = int(border_size*h)
         border_w = int(border_size*w)
         for subband in level:
-            dlm_den += np.power(np.sum(np.abs(np.power(subband[border_h:-border_h, border_w:-border_w], 3.0))), 1.0/3)
+            dlm_den += np.power(np.sum(np.abs(np.power(subband[..., border_h:-border_h, border_w:-border_w], 3.0)), axis=(-2, -1)), 1.0/3)
 
     dlm = (dlm_num + 1e-4) / (dlm_den + 1e-4)
 
@@ -189,17 +239,19 @@ def ssim_pyr(pyr_ref, pyr_dist, max_val=1, K1=0.01, K2=0.03, pool='cov'):
     C1 = (K1*max_val)**2
     C2 = (K2*max_val)**2
 
-    var_x = np.zeros((details_ref[0][0].shape[0] << 1, details_ref[0][0].shape[1] << 1))
-    var_y = np.zeros((details_ref[0][0].shape[0] << 1, details_ref[0][0].shape[1] << 1))
-    cov_xy = np.zeros((details_ref[0][0].shape[0] << 1, details_ref[0][0].shape[1] << 1))
+    # Supports stacks of frames, i.e., subbands of shape (K, H, W), in which case K values are returned per pool
+    band_shape = details_ref[0][0].shape
+    var_x = np.zeros(band_shape[:-2] + (band_shape[-2] << 1, band_shape[-1] << 1))
+    var_y = np.zeros(band_shape[:-2] + (band_shape[-2] << 1, band_shape[-1] << 1))
+    cov_xy = np.zeros(band_shape[:-2] + (band_shape[-2] << 1, band_shape[-1] << 1))
 
     for detail_level_ref, detail_level_dist in zip(details_ref, details_dist):
         var_x_add = np.stack([subband**2 for subband in detail_level_ref], axis=-1).sum(-1)
         var_y_add = np.stack([subband**2 for subband in detail_level_dist], axis=-1).sum(-1)
         cov_xy_add = np.stack([subband_ref * subband_dist for subband_ref, subband_dist in zip(detail_level_ref, detail_level_dist)], axis=-1).sum(-1)
-        var_x = im2col(var_x, 2, 2).sum(0).reshape(var_x_add.shape) + var_x_add
-        var_y = im2col(var_y, 2, 2).sum(0).reshape(var_y_add.shape) + var_y_add
-        cov_xy = im2col(cov_xy, 2, 2).sum(0).reshape(cov_xy_add.shape) + cov_xy_add
+        var_x = block_sum_2x2(var_x) + var_x_add
+        var_y = block_sum_2x2(var_y) + var_y_add
+        cov_xy = block_sum_2x2(cov_xy) + cov_xy_add
 
     win_dim = (1 << n_levels)  # 2^L
     win_size = (1 << (n_levels << 1))  # 2^(2L), i.e., a win_dim X win_dim square
@@ -210,18 +262,22 @@ def ssim_pyr(pyr_ref, pyr_dist, max_val=1, K1=0.01, K2=0.03, pool='cov'):
     var_y /= win_size
     cov_xy /= win_size
 
+    return _ssim_pool(mu_x, mu_y, var_x, var_y, cov_xy, C1, C2, pool)
+
+
+def _ssim_pool(mu_x, mu_y, var_x, var_y, cov_xy, C1, C2, pool):
     l = (2*mu_x*mu_y + C1) / (mu_x**2 + mu_y**2 + C1)
     cs = (2 * cov_xy + C2) / (var_x + var_y + C2)
 
     ssim_map = l * cs
-    mean_ssim = np.mean(ssim_map)
+    mean_ssim = np.mean(ssim_map, axis=(-2, -1))
 
     if pool == 'mean':
         return mean_ssim
     elif pool == 'cov':
-        return np.std(ssim_map) / mean_ssim
+        return np.std(ssim_map, axis=(-2, -1)) / mean_ssim
     elif pool == 'all':
-        return mean_ssim, np.std(ssim_map) / mean_ssim
+        return mean_ssim, np.std(ssim_map, axis=(-2, -1)) / mean_ssim
     else:
         raise ValueError('Invalid pool option.')
 
@@ -229,27 +285,20 @@ def ssim_pyr(pyr_ref, pyr_dist, max_val=1, K1=0.01, K2=0.03, pool='cov'):
 def ms_ssim_pyr(pyr_ref, pyr_dist, max_val=1, K1=0.01, K2=0.03, pool='cov', full=False):
     # Pyramids are assumed to have the structure
     # ([A1, ..., An], [(H1, V1, D1), ..., (Hn, Vn, Dn)])
-    approxs_ref, details_ref = pyr_ref
-    approxs_dist, details_dist = pyr_dist
+    _, details_ref = pyr_ref
+    _, details_dist = pyr_dist
 
     assert len(details_ref) == len(details_dist), 'Both wavelet pyramids must be of the same height'
     n_levels = len(details_ref)
-    assert n_levels <= 5, 'Exponents are defined only for 5 scales'
-    assert pool in ['mean', 'cov', 'all'], 'pool must be one of \'mean\', \'cov\', or \'all\''
-    exps = np.array([0.0448, 0.2856, 0.3001, 0.2363, 0.1333])
-
-    l_mean_scales = np.zeros((n_levels,))
-    cs_mean_scales = np.zeros((n_levels,))
-    ssim_mean_scales = np.zeros((n_levels,))
-    l_cov_scales = np.zeros((n_levels,))
-    cs_cov_scales = np.zeros((n_levels,))
-    ssim_cov_scales = np.zeros((n_levels,))
-    l_mink_scales = np.zeros((n_levels,))
-    cs_mink_scales = np.zeros((n_levels,))
-    ssim_mink_scales = np.zeros((n_levels,))
-
     C1 = (K1*max_val)**2
     C2 = (K2*max_val)**2
+    return _ms_ssim_from_moments(_ms_ssim_moments(pyr_ref, pyr_dist), n_levels, C1, C2, pool, full)
+
+
+def _ms_ssim_moments(pyr_ref, pyr_dist):
+    # Local means, variances and covariances of each level, over windows of the size of the level's support
+    approxs_ref, details_ref = pyr_ref
+    approxs_dist, details_dist = pyr_dist
 
     var_x = np.zeros((details_ref[0][0].shape[0] << 1, details_ref[0][0].shape[1] << 1))
     var_y = np.zeros((details_ref[0][0].shape[0] << 1, details_ref[0][0].shape[1] << 1))
@@ -257,7 +306,7 @@ def ms_ssim_pyr(pyr_ref, pyr_dist, max_val=1, K1=0.01, K2=0.03, pool='cov', full
 
     win_dim = 1
     win_size = 1
-    for lev, (approx_ref, approx_dist, detail_level_ref, detail_level_dist) in enumerate(zip(approxs_ref, approxs_dist, details_ref, details_dist)):
+    for approx_ref, approx_dist, detail_level_ref, detail_level_dist in zip(approxs_ref, approxs_dist, details_ref, details_dist):
         win_dim <<= 1
         win_size <<= 2
 
@@ -269,9 +318,25 @@ def ms_ssim_pyr(pyr_ref, pyr_dist, max_val=1, K1=0.01, K2=0.03, pool='cov', full
         var_y = im2col(var_y, 2, 2).mean(0).reshape(var_y_add.shape) + var_y_add / win_size
         cov_xy = im2col(cov_xy, 2, 2).mean(0).reshape(cov_xy_add.shape) + cov_xy_add / win_size
 
-        mu_x = approx_ref / win_dim
-        mu_y = approx_dist / win_dim
+        yield approx_ref / win_dim, approx_dist / win_dim, var_x, var_y, cov_xy
 
+
+def _ms_ssim_from_moments(moments, n_levels, C1, C2, pool, full):
+    assert n_levels <= 5, 'Exponents are defined only for 5 scales'
+    assert pool in ['mean', 'cov', 'all'], 'pool must be one of \'mean\', \'cov\', or \'all\''
+    exps = np.array([0.0448, 0.2856, 0.3001, 0.2363, 0.1333])
+
+    l_mean_scales = np.zeros((n_levels,))
+    cs_mean_scales = np.zeros((n_levels,))
+    ssim_mean_scales = np.zeros((n_levels,))
+    l_cov_scales = np.zeros((n_levels,))
+    cs_cov_scales = np.zeros((n_levels,))
+    ssim_cov_scales = np.zeros((n_levels,))
+    l_mink_scales = np.zeros((n_levels,))
+    cs_mink_scales = np.zeros((n_levels,))
+    ssim_mink_scales = np.zeros((n_levels,))
+
+    for lev, (mu_x, mu_y, var_x, var_y, cov_xy) in enumerate(moments):
         l = (2*mu_x*mu_y + C1) / (mu_x**2 + mu_y**2 + C1)
         cs = (2 * cov_xy + C2) / (var_x + var_y + C2)
         ssim_map = l * cs
@@ -319,6 +384,16 @@ def ms_ssim_pyr(pyr_ref, pyr_dist, max_val=1, K1=0.01, K2=0.03, pool='cov', full
         return (ret_mean, ret_cov, ret_mink)
 
 
+def ms_ssim_pyr_int(pyr_ref, pyr_dist, max_val, K1=0.01, K2=0.03, pool='cov', full=False):
+    '''
+    Fixed-point counterpart of ms_ssim_pyr for pyramids from haar_wavedec2_int, where max_val is in units of the input codes.
+    '''
+    assert len(pyr_ref[1]) == len(pyr_dist[1]), 'Both wavelet pyramids must be of the same height'
+    C1 = (K1*max_val)**2
+    C2 = (K2*max_val)**2
+    return _ms_ssim_from_moments(_haar_moments_int(pyr_ref, pyr_dist), len(pyr_ref[1]), C1, C2, pool, full)
+
+
 def strred_pyr(pyr_ref, pyr_dist, prev_pyr_ref, prev_pyr_dist, block_size=3, single=False, full=False):
     # Pyramids are assumed to have the structure
     # ([A1, ..., An], [(H1, V1, D1), ..., (Hn, Vn, Dn)])
@@ -34,9 +34,22 @@ def rred_entropies_and_scales(subband, block_size=3):
 
         n_eigs = (2 if np.iscomplexobj(subband) else 1)*block_size*block_size
 
-        entropies = np.zeros_like(s)
-        for j in range(n_eigs):
-            entropies = entropies + np.log(s*lamda[j]+sigma_nsq) + np.log(2*np.pi*np.exp(1))
+        entropies = gsm_entropies(s, lamda[:n_eigs], sigma_nsq)
         scales = np.log(1 + s)
 
-    return entropies, scales
\ No newline at end of file
+    return entropies, scales
+
+
+def gsm_entropies(s, lamda, sigma_nsq=0.1):
+    # Entropies of all eigen-channels, i.e., sum_j log(s*lamda_j + sigma_nsq) + log(2*pi*e),
+    # accumulated in place so that only one scratch array the size of s is allocated
+    entr_const = np.log(2*np.pi*np.exp(1))
+    entropies = np.zeros_like(s)
+    tmp = np.empty_like(s)
+    for lamda_j in lamda:
+        np.multiply(s, lamda_j, out=tmp)
+        tmp += sigma_nsq
+        np.log(tmp, out=tmp)
+        entropies += tmp
+        entropies += entr_const
+    return entropies
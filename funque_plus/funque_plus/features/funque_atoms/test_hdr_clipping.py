@@ -0,0 +1,225 @@
+# Tests of the brightness clipping detector and its video drivers.
+# Run from the project root: python -m pytest funque_plus/features/funque_atoms/test_hdr_clipping.py
+# ------------------------------------------------------------
+import csv
+import os
+os.environ.setdefault("FUNQUE_DISABLE_NUMBA", "1")  # also inherited by spawned workers
+
+import numpy as np
+import cv2
+import pytest
+
+from funque_plus.features.funque_atoms.hdr_clipping import (
+    CLIP_FEATURE_KEYS,
+    ClipFeatureAccumulator,
+    aggregate_brightness_clipping,
+    aggregate_luminance_percentiles,
+    brightness_clipping_features,
+    brightness_clipping_sweep,
+)
+from funque_plus.features.funque_atoms.hdr_clipping_video import detect_brightness_clipping_video
+
+
+def _baseline_brightness_clipping_features(frame_y, *, is_hdr=True, is_pq_10bit=True, area_min_px=64, thr_norm=0.99, thr_nits_ratio=0.98):
+    """The detector before the lookup table, histogram, keep table, local gradient and tile screening changes."""
+    H, W = frame_y.shape[:2]
+    if is_hdr and is_pq_10bit:
+        V = np.clip(frame_y, 0.0, 1.0).astype(np.float32)
+        V_m1 = np.power(V, 1.0 / (2523.0 / 32.0))
+        num = np.maximum(V_m1 - 3424.0 / 4096.0, 0.0)
+        den = 2413.0 / 128.0 - 2392.0 / 128.0 * V_m1
+        y_work = np.power(num / np.maximum(den, 1e-9), 1.0 / (2610.0 / 16384.0))
+        thr_val = thr_nits_ratio * np.percentile(y_work, 99.99)
+    else:
+        y_work = frame_y.astype(np.float32)
+        thr_val = thr_norm
+
+    y_blur = cv2.GaussianBlur(y_work, (3, 3), 0)
+    clip_mask = y_blur >= thr_val
+    clip_mask = cv2.morphologyEx(clip_mask.astype(np.uint8), cv2.MORPH_CLOSE, np.ones((3, 3), np.uint8))
+
+    nlabels, labels, stats, _ = cv2.connectedComponentsWithStats(clip_mask, connectivity=8)
+    refined = np.zeros_like(clip_mask)
+    for i in range(1, nlabels):
+        if stats[i, cv2.CC_STAT_AREA] >= area_min_px:
+            refined[labels == i] = 255
+    clip_mask = refined > 0
+
+    total_px = H * W
+    area_ratio = float(clip_mask.sum()) / float(total_px)
+    nlabels, labels, stats, _ = cv2.connectedComponentsWithStats(clip_mask.astype(np.uint8), connectivity=8)
+    num_regions = nlabels - 1
+    max_region_ratio = float(stats[1:, cv2.CC_STAT_AREA].max() / total_px) if num_regions > 0 else 0.0
+
+    gx = cv2.Sobel(y_blur, cv2.CV_32F, 1, 0, ksize=3)
+    gy = cv2.Sobel(y_blur, cv2.CV_32F, 0, 1, ksize=3)
+    grad_mag = np.sqrt(gx**2 + gy**2)
+    interior_grad = grad_mag[clip_mask].mean() if clip_mask.any() else 0.0
+    flatness = 1.0 / (1.0 + interior_grad * 500.0)
+    severity = 0.6 * area_ratio + 0.2 * max_region_ratio + 0.2 * flatness
+
+    return {
+        "clip_area_ratio": area_ratio,
+        "clip_num_regions": num_regions,
+        "clip_max_region_ratio": max_region_ratio,
+        "clip_flatness": flatness,
+        "clip_severity": severity,
+    }
+
+
+def _random_codes(rng, height, width):
+    """10-bit codes with a few bright rectangles of random size, some of them clipped."""
+    codes = rng.integers(0, 800, (height, width)).astype(np.uint16)
+    for _ in range(rng.integers(0, 10)):
+        y, x = rng.integers(0, height), rng.integers(0, width)
+        h, w = rng.integers(1, 60, 2)
+        codes[y:y + h, x:x + w] = rng.integers(950, 1024)
+    return codes
+
+
+def _features(frame_y, **kwargs):
+    f = brightness_clipping_features(frame_y, **kwargs)
+    f.pop("clip_luma_hist", None)
+    return f
+
+
+@pytest.mark.parametrize("seed", range(8))
+def test_features_match_baseline(seed):
+    rng = np.random.default_rng(seed)
+    for _ in range(4):
+        codes = _random_codes(rng, *rng.integers(20, 300, 2))
+        frame = codes.astype(np.float32) / 1023
+        for area_min_px in (1, 16, 64):
+            hdr_kwargs = dict(is_hdr=True, is_pq_10bit=True, area_min_px=area_min_px, thr_nits_ratio=0.9)
+            expected = _baseline_brightness_clipping_features(frame, **hdr_kwargs)
+            assert _features(codes, **hdr_kwargs) == expected
+            assert _features(frame, **hdr_kwargs) == expected
+
+            sdr_kwargs = dict(is_hdr=False, area_min_px=area_min_px, thr_norm=0.92)
+            assert _features(frame, **sdr_kwargs) == _baseline_brightness_clipping_features(frame, **sdr_kwargs)
+
+
+@pytest.mark.parametrize("seed", range(4))
+def test_sweep_matches_features(seed):
+    rng = np.random.default_rng(seed)
+    grid = dict(thr_norms=(0.9, 0.96), thr_nits_ratios=(0.8, 0.9, 0.98), area_mins=(1, 16, 64))
+    for _ in range(4):
+        codes = _random_codes(rng, *rng.integers(20, 300, 2))
+        frame = codes.astype(np.float32) / 1023
+        for frame_y, is_hdr in ((codes, True), (frame, True), (frame, False)):
+            sweep = brightness_clipping_sweep(frame_y, is_hdr=is_hdr, is_pq_10bit=True, **grid)
+            assert len(sweep) == 18
+            for (thr_norm, thr_nits_ratio, area_min_px), f in sweep.items():
+                f = dict(f)
+                f.pop("clip_luma_hist", None)
+                assert f == _features(
+                    frame_y,
+                    is_hdr=is_hdr,
+                    is_pq_10bit=True,
+                    area_min_px=area_min_px,
+                    thr_norm=thr_norm,
+                    thr_nits_ratio=thr_nits_ratio,
+                )
+
+
+WIDTH, HEIGHT, N_FRAMES = 96, 64, 11
+
+
+@pytest.fixture(scope="module")
+def videos(tmp_path_factory):
+    """Short P010, 8-bit YUV 4:2:0 and MP4 videos of random frames, with their detect_brightness_clipping_video arguments."""
+    rng = np.random.default_rng(0)
+    frames = [_random_codes(rng, HEIGHT, WIDTH) for _ in range(N_FRAMES)]
+    root = tmp_path_factory.mktemp("videos")
+
+    p010_path, yuv8_path, mp4_path = str(root / "p010.yuv"), str(root / "yuv8.yuv"), str(root / "video.mp4")
+    with open(p010_path, "wb") as f:
+        for codes in frames:
+            f.write((codes << 6).tobytes())
+            f.write(np.full(WIDTH * HEIGHT // 2, 512 << 6, dtype=np.uint16).tobytes())
+    with open(yuv8_path, "wb") as f:
+        for codes in frames:
+            f.write((codes >> 2).astype(np.uint8).tobytes())
+            f.write(np.full(WIDTH * HEIGHT // 2, 128, dtype=np.uint8).tobytes())
+    writer = cv2.VideoWriter(mp4_path, cv2.VideoWriter_fourcc(*"mp4v"), 25, (WIDTH, HEIGHT))
+    if not writer.isOpened():
+        pytest.skip("OpenCV cannot write MP4")
+    for codes in frames:
+        writer.write(cv2.cvtColor((codes >> 2).astype(np.uint8), cv2.COLOR_GRAY2BGR))
+    writer.release()
+
+    return {
+        "p010": (p010_path, dict(input_type="p010", width=WIDTH, height=HEIGHT, is_pq_10bit=True, thr_nits_ratio=0.9, area_min_px=16)),
+        "yuv8": (yuv8_path, dict(input_type="yuv8", width=WIDTH, height=HEIGHT, thr_norm=0.92, area_min_px=16)),
+        "mp4": (mp4_path, dict(input_type="mp4", thr_norm=0.92, area_min_px=16)),
+    }
+
+
+def _assert_per_frame_equal(per_frame, expected):
+    assert len(per_frame) == len(expected)
+    for f, g in zip(per_frame, expected):
+        assert f.keys() == g.keys()
+        for key in f:
+            if key == "clip_luma_hist":
+                np.testing.assert_array_equal(f[key], g[key])
+            else:
+                assert f[key] == g[key]
+
+
+@pytest.mark.parametrize("name", ["p010", "yuv8", "mp4"])
+@pytest.mark.parametrize("frame_stride", [1, 3])
+def test_parallel_detection_matches_serial(videos, name, frame_stride):
+    path, kwargs = videos[name]
+    serial = detect_brightness_clipping_video(path, frame_stride=frame_stride, workers=1, **kwargs)
+    parallel = detect_brightness_clipping_video(path, frame_stride=frame_stride, workers=3, **kwargs)
+    assert len(serial["per_frame"]) == len(range(0, N_FRAMES, frame_stride))
+    _assert_per_frame_equal(parallel["per_frame"], serial["per_frame"])
+    assert parallel["aggregate"] == serial["aggregate"]
+    assert parallel["luma_percentiles"] == serial["luma_percentiles"]
+
+
+@pytest.mark.parametrize("name, workers", [("p010", 1), ("yuv8", 1), ("mp4", 1), ("p010", 3)])
+def test_streamed_detection_matches_in_memory(videos, tmp_path, name, workers):
+    path, kwargs = videos[name]
+    in_memory = detect_brightness_clipping_video(path, frame_stride=2, workers=workers, **kwargs)
+    per_frame = in_memory["per_frame"]
+    assert in_memory["aggregate"] == aggregate_brightness_clipping(per_frame)
+    assert in_memory["luma_percentiles"] == aggregate_luminance_percentiles(per_frame)
+    assert bool(in_memory["luma_percentiles"]) == (name == "p010")
+
+    csv_path = str(tmp_path / "per_frame.csv")
+    streamed = detect_brightness_clipping_video(path, frame_stride=2, workers=workers, per_frame_path=csv_path, **kwargs)
+    assert streamed["per_frame"] is None
+    assert streamed["aggregate"] == in_memory["aggregate"]
+    assert streamed["luma_percentiles"] == in_memory["luma_percentiles"]
+
+    with open(csv_path, newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ["frame"] + list(CLIP_FEATURE_KEYS)
+    assert [int(row[0]) for row in rows[1:]] == list(range(0, N_FRAMES, 2))
+    for row, f in zip(rows[1:], per_frame):
+        assert [float(v) for v in row[1:]] == [f[key] for key in CLIP_FEATURE_KEYS]
+
+
+@pytest.mark.parametrize("name, workers", [("p010", 1), ("mp4", 1), ("p010", 3)])
+def test_aggregate_only_detection_matches_in_memory(videos, name, workers):
+    path, kwargs = videos[name]
+    in_memory = detect_brightness_clipping_video(path, frame_stride=2, workers=workers, **kwargs)
+    aggregate_only = detect_brightness_clipping_video(path, frame_stride=2, workers=workers, keep_per_frame=False, **kwargs)
+    assert aggregate_only["per_frame"] is None
+    assert aggregate_only["aggregate"] == in_memory["aggregate"]
+    assert aggregate_only["luma_percentiles"] == in_memory["luma_percentiles"]
+
+
+def test_aggregate_only_accumulator_keeps_no_per_frame_data():
+    rng = np.random.default_rng(0)
+    acc = ClipFeatureAccumulator(keep_per_frame=False)
+    for frame_ind in range(5):
+        acc.append(brightness_clipping_features(_random_codes(rng, 64, 96), area_min_px=16), frame_ind)
+    assert acc.luma_hist.sum() == 5 * 64 * 96
+    with pytest.raises(ValueError):
+        acc.per_frame()
+    # Only the columns needed by the aggregates are stored
+    with pytest.raises(ValueError):
+        acc.column("clip_flatness")
+    assert len(acc.column("clip_area_ratio")) == 5
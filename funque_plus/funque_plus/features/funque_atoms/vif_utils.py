@@ -1,4 +1,5 @@
 import numpy as np
+from . import numba_utils
 
 
 def im2col(img, k, stride=1):
@@ -14,15 +15,20 @@ def im2col(img, k, stride=1):
     return ret[:, :, ::stride, ::stride].reshape(k*k, -1)
 
 
+def pad_2d(x, pad, mode='reflect'):
+    # Pads only the last two (spatial) axes, so that stacks of frames of shape (K, H, W) are supported
+    return np.pad(x, [(0, 0)]*(x.ndim - 2) + [(pad, pad)]*2, mode=mode)
+
+
 def integral_image(x):
-    M, N = x.shape
-    int_x = np.zeros((M+1, N+1))
+    M, N = x.shape[-2:]
+    int_x = np.zeros(x.shape[:-2] + (M+1, N+1))
     # int_x[1:, 1:] = np.cumsum(np.cumsum(x, 0), 1)
     # Slower, but more precise than cumsum
-    for i in range(x.shape[0]):
-        int_x[i+1, 1:] = int_x[i, 1:] + x[i, :]
-    for j in range(x.shape[1]):
-        int_x[:, j+1] = int_x[:, j+1] + int_x[:, j]
+    for i in range(M):
+        int_x[..., i+1, 1:] = int_x[..., i, 1:] + x[..., i, :]
+    for j in range(N):
+        int_x[..., :, j+1] = int_x[..., :, j+1] + int_x[..., :, j]
     return int_x
 
 
@@ -31,8 +37,8 @@ def moments(x, y, k, stride):
 
     k_norm = k**2
 
-    x_pad = np.pad(x, int((kh - stride)/2), mode='reflect')
-    y_pad = np.pad(y, int((kw - stride)/2), mode='reflect')
+    x_pad = pad_2d(x, int((kh - stride)/2), mode='reflect')
+    y_pad = pad_2d(y, int((kw - stride)/2), mode='reflect')
 
     int_1_x = integral_image(x_pad)
     int_1_y = integral_image(y_pad)
@@ -42,13 +48,13 @@ def moments(x, y, k, stride):
 
     int_xy = integral_image(x_pad*y_pad)
 
-    mu_x = (int_1_x[:-kh:stride, :-kw:stride] - int_1_x[:-kh:stride, kw::stride] - int_1_x[kh::stride, :-kw:stride] + int_1_x[kh::stride, kw::stride])/k_norm
-    mu_y = (int_1_y[:-kh:stride, :-kw:stride] - int_1_y[:-kh:stride, kw::stride] - int_1_y[kh::stride, :-kw:stride] + int_1_y[kh::stride, kw::stride])/k_norm
+    mu_x = (int_1_x[..., :-kh:stride, :-kw:stride] - int_1_x[..., :-kh:stride, kw::stride] - int_1_x[..., kh::stride, :-kw:stride] + int_1_x[..., kh::stride, kw::stride])/k_norm
+    mu_y = (int_1_y[..., :-kh:stride, :-kw:stride] - int_1_y[..., :-kh:stride, kw::stride] - int_1_y[..., kh::stride, :-kw:stride] + int_1_y[..., kh::stride, kw::stride])/k_norm
 
-    var_x = (int_2_x[:-kh:stride, :-kw:stride] - int_2_x[:-kh:stride, kw::stride] - int_2_x[kh::stride, :-kw:stride] + int_2_x[kh::stride, kw::stride])/k_norm - mu_x**2
-    var_y = (int_2_y[:-kh:stride, :-kw:stride] - int_2_y[:-kh:stride, kw::stride] - int_2_y[kh::stride, :-kw:stride] + int_2_y[kh::stride, kw::stride])/k_norm - mu_y**2
+    var_x = (int_2_x[..., :-kh:stride, :-kw:stride] - int_2_x[..., :-kh:stride, kw::stride] - int_2_x[..., kh::stride, :-kw:stride] + int_2_x[..., kh::stride, kw::stride])/k_norm - mu_x**2
+    var_y = (int_2_y[..., :-kh:stride, :-kw:stride] - int_2_y[..., :-kh:stride, kw::stride] - int_2_y[..., kh::stride, :-kw:stride] + int_2_y[..., kh::stride, kw::stride])/k_norm - mu_y**2
 
-    cov_xy = (int_xy[:-kh:stride, :-kw:stride] - int_xy[:-kh:stride, kw::stride] - int_xy[kh::stride, :-kw:stride] + int_xy[kh::stride, kw::stride])/k_norm - mu_x*mu_y
+    cov_xy = (int_xy[..., :-kh:stride, :-kw:stride] - int_xy[..., :-kh:stride, kw::stride] - int_xy[..., kh::stride, :-kw:stride] + int_xy[..., kh::stride, kw::stride])/k_norm - mu_x*mu_y
 
     mask_x = (var_x < 0)
     mask_y = (var_y < 0)
@@ -91,23 +97,29 @@ def vif_spatial(img_ref, img_dist, k=11, sigma_nsq=0.1, stride=1, full=False):
 
     _, _, var_x, var_y, cov_xy = moments(x, y, k, stride)
 
-    g = cov_xy / (var_x + 1e-10)
-    sv_sq = var_y - g * cov_xy
+    if numba_utils.ENABLED:
+        num, den = numba_utils.vif_pool(var_x, var_y, cov_xy, sigma_nsq)
+    else:
+        g = cov_xy / (var_x + 1e-10)
+        sv_sq = var_y - g * cov_xy
 
-    g[var_x < 1e-10] = 0
-    sv_sq[var_x < 1e-10] = var_y[var_x < 1e-10]
-    var_x[var_x < 1e-10] = 0
+        g[var_x < 1e-10] = 0
+        sv_sq[var_x < 1e-10] = var_y[var_x < 1e-10]
+        var_x[var_x < 1e-10] = 0
 
-    g[var_y < 1e-10] = 0
-    sv_sq[var_y < 1e-10] = 0
+        g[var_y < 1e-10] = 0
+        sv_sq[var_y < 1e-10] = 0
 
-    sv_sq[g < 0] = var_x[g < 0]
-    g[g < 0] = 0
-    sv_sq[sv_sq < 1e-10] = 1e-10
+        sv_sq[g < 0] = var_x[g < 0]
+        g[g < 0] = 0
+        sv_sq[sv_sq < 1e-10] = 1e-10
+
+        num = np.sum(np.log(1 + g**2 * var_x / (sv_sq + sigma_nsq)) + 1e-4, axis=(-2, -1))
+        den = np.sum(np.log(1 + var_x / sigma_nsq) + 1e-4, axis=(-2, -1))
 
-    vif_val = np.sum(np.log(1 + g**2 * var_x / (sv_sq + sigma_nsq)) + 1e-4)/np.sum(np.log(1 + var_x / sigma_nsq) + 1e-4)
+    vif_val = num/den
     if (full):
-        return (np.sum(np.log(1 + g**2 * var_x / (sv_sq + sigma_nsq)) + 1e-4), np.sum(np.log(1 + var_x / sigma_nsq) + 1e-4), vif_val)
+        return (num, den, vif_val)
     else:
         return vif_val
 